@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 frame access benchmark.
+
+Times the access to frames picked at random in a video, and to every k-th
+frame, with `readFrame` (decoding from the start of the video every time) and
+with `IndexedFrameSource` (persistent index of the frames, seeking, cache of
+decoded frames). Also checks that both return exactly the same frames, and
+exits with status 1 if they do not.
+
+The index is built in a temporary directory, so the first open (which builds
+it) is timed too.
+
+Sample usage (from the repository root):
+python -m benchmarks.bench_frame_access -n 20 /path/to/dataset/sample01/input.mp4
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import shutil
+import tempfile
+from time import time
+import json
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+from utils.frames import *
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_NAME = "SmartDoc17 Frame Access Benchmark"
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark random and strided access to video frames, with and without the frame index.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-n', '--num-frames',
+        type=int,
+        default=20,
+        help="Number of frames accessed at random.")
+
+    parser.add_argument('-k', '--stride',
+        type=int,
+        default=10,
+        help="Stride of the strided access.")
+
+    parser.add_argument('-s', '--seed',
+        type=int,
+        default=42,
+        help="Seed of the random frame selection.")
+
+    parser.add_argument('-o', '--output',
+        help="Path to a JSON file where results will be saved.")
+
+    parser.add_argument('video',
+        action=StoreValidFilePath,
+        help="Path to the video to read frames from.")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    index_dir = tempfile.mkdtemp(prefix="bench_frame_access")
+    try:
+        t_start = time()
+        frames = IndexedFrameSource(args.video, index_dir=index_dir)
+        t_build = time() - t_start
+        frames.release()
+        t_start = time()
+        frames = IndexedFrameSource(args.video, index_dir=index_dir)
+        t_load = time() - t_start
+    finally:
+        shutil.rmtree(index_dir)
+    logger.info("%d frames, index built in %.3fs, loaded in %.3fs.", frames.num_frames, t_build, t_load)
+
+    rng = np.random.RandomState(args.seed)
+    random_ids = [int(fidx) for fidx in rng.randint(0, frames.num_frames, args.num_frames)]
+    strided_ids = range(0, frames.num_frames, args.stride)
+
+    # --------------------------------------------------------------------------
+    num_mismatches = 0
+    t_start = time()
+    expected = [readFrame(args.video, fidx) for fidx in random_ids]
+    t_random_readframe = time() - t_start
+    t_start = time()
+    got = [frames.get(fidx) for fidx in random_ids]
+    t_random_indexed = time() - t_start
+    for (fidx, e, g) in zip(random_ids, expected, got):
+        if not np.array_equal(e, g):
+            num_mismatches += 1
+            logger.error("Frame %d differs.", fidx)
+    del expected, got
+
+    # strided access, reading (and skipping) frames in order for reference
+    expected = {}
+    t_start = time()
+    with FrameSource(args.video) as source:
+        fidx = 0
+        while True:
+            (ok, frame) = source.read()
+            if not ok:
+                break
+            if fidx % args.stride == 0:
+                expected[fidx] = frame.copy()
+            fidx += 1
+    t_strided_sequential = time() - t_start
+    frames = IndexedFrameSource(args.video, cache_size=0, index_dir=None) # no cache hit
+    t_start = time()
+    for (fidx, frame) in frames.iterFrames(strided_ids):
+        if not np.array_equal(expected.get(fidx), frame):
+            num_mismatches += 1
+            logger.error("Frame %d differs.", fidx)
+    t_strided_indexed = time() - t_start
+    stats = frames.getStats()
+    frames.release()
+
+    # --------------------------------------------------------------------------
+    logger.info(DBGSEP)
+    logger.info("%-34s %10s %8s", "access", "time (s)", "speedup")
+    logger.info("%-34s %10.3f %8.2f", "%d random, readFrame" % len(random_ids), t_random_readframe, 1.)
+    logger.info("%-34s %10.3f %8.2f", "%d random, IndexedFrameSource" % len(random_ids), t_random_indexed,
+                t_random_readframe / t_random_indexed if t_random_indexed > 0 else float("inf"))
+    logger.info("%-34s %10.3f %8.2f", "1/%d, sequential read" % args.stride, t_strided_sequential, 1.)
+    logger.info("%-34s %10.3f %8.2f", "1/%d, IndexedFrameSource" % args.stride, t_strided_indexed,
+                t_strided_sequential / t_strided_indexed if t_strided_indexed > 0 else float("inf"))
+    logger.info("Strided access: %d seeks (%d failed), %d frames grabbed.",
+                stats["num_seeks"], stats["num_failed_seeks"], stats["num_grabs"])
+    if num_mismatches:
+        logger.error("%d frames differ.", num_mismatches)
+    else:
+        logger.info("Both methods return identical frames.")
+
+    if args.output:
+        report = {"video": args.video,
+                  "num_frames": frames.num_frames,
+                  "index_build_time": t_build,
+                  "index_load_time": t_load,
+                  "num_random": len(random_ids),
+                  "random_readframe_time": t_random_readframe,
+                  "random_indexed_time": t_random_indexed,
+                  "stride": args.stride,
+                  "strided_sequential_time": t_strided_sequential,
+                  "strided_indexed_time": t_strided_indexed,
+                  "seekable": stats["seekable"],
+                  "num_mismatches": num_mismatches}
+        with open(args.output, "wb") as output:
+            json.dump(report, output, indent=2)
+        logger.debug("Results saved to %s" % args.output)
+
+    if num_mismatches:
+        return 1
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)
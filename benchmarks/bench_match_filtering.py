@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 match filtering micro-benchmark.
+
+Times the work done by AbstractPOITracker from the matching of the frame
+descriptors to homography estimation (k-NN matching, ratio test, and gathering
+of the coordinates of the model and frame points matched), with the array-based
+implementation of trackers/Matchers.py and with the former one, which matched
+with cv2.BFMatcher and then worked match by match on DMatch and KeyPoint
+objects. Both are checked to keep exactly the same points by
+tests/test_match_filtering.py.
+
+Sample usage (from the repository root):
+python -m benchmarks.bench_match_filtering -n 10 -r 3
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+from time import time
+import json
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+
+from trackers.Tracker import multiPyrDown
+from trackers.Matchers import *
+from trackers.SIFT_BFTracker import createSIFTDetector
+
+from benchmarks.synthetic import makeDocument, randomViewHomography
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_NAME = "SmartDoc17 Match Filtering Benchmark"
+
+NUM_PYRDOWN_MODEL = 1 # same as SIFT_BFTracker
+SECOND_MATCH_TRESH = 0.75
+
+# ==============================================================================
+def matchObjects(matcher, desc):
+    return matcher.knnMatch(desc, k=2)
+
+def filterObjects(knn_matches, keypoints, mdl_keyp):
+    """
+    Former implementation: ratio test and gathering on DMatch and KeyPoint
+    objects. Return tuple(model points, frame points).
+    """
+    matches = [m[0] for m in knn_matches if len(m) >= 2 and m[0].distance < m[1].distance * SECOND_MATCH_TRESH]
+    pt00 = [mdl_keyp[m.trainIdx].pt for m in matches]
+    pt10 = [keypoints[m.queryIdx].pt for m in matches]
+    pt0, pt1 = np.float32((pt00, pt10)).reshape(2, -1, 2)
+    return (pt0, pt1)
+
+def matchArrays(matcher, desc):
+    return knnMatchArray(matcher, desc)
+
+def filterArrays(knn_matches, keypoints, mdl_pts):
+    """
+    Current implementation (see AbstractPOITracker._searchFullFrame).
+    Return tuple(model points, frame points).
+    """
+    matches = ratioTest(knn_matches, SECOND_MATCH_TRESH)
+    return (mdl_pts[matches["train_idx"]], keypointsToPoints(keypoints)[matches["query_idx"]])
+
+def timeImplementation(match, filter, matcher, views, mdl, repeat):
+    """
+    Return the mean times (s) taken per view by `match` and by `filter`, and
+    the results of the latter.
+    """
+    (t_match, t_filter) = (0., 0.)
+    for _ in range(repeat):
+        results = []
+        for (keypoints, desc) in views:
+            t0 = time()
+            knn_matches = match(matcher, desc)
+            t1 = time()
+            results.append(filter(knn_matches, keypoints, mdl))
+            t_match += t1 - t0
+            t_filter += time() - t1
+    n = repeat * len(views)
+    return (t_match / n, t_filter / n, results)
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark match filtering and point gathering, with the array-based implementation and the former one.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-n', '--num-views',
+        type=int,
+        default=10,
+        help="Number of synthetic views to generate.")
+
+    parser.add_argument('-r', '--repeat',
+        type=int,
+        default=3,
+        help="Number of times each implementation processes every view.")
+
+    parser.add_argument('-s', '--seed',
+        type=int,
+        default=42,
+        help="Seed of the random view generator.")
+
+    parser.add_argument('-o', '--output',
+        help="Path to a JSON file where results will be saved.")
+
+    parser.add_argument('-g', '--ground-truth-image',
+        action=StoreValidFilePath,
+        help="Path to ground truth image used as model and to generate views (default: synthetic document).")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    rng = np.random.RandomState(args.seed)
+    (detector, _) = createSIFTDetector()
+    if args.ground_truth_image is not None:
+        img_gt = cv2.imread(args.ground_truth_image)
+    else:
+        img_gt = makeDocument(seed=args.seed)
+
+    logger.info("Extracting model features...")
+    mdl_gray = cv2.cvtColor(multiPyrDown(img_gt, NUM_PYRDOWN_MODEL), cv2.COLOR_BGR2GRAY)
+    (mdl_keyp, mdl_desc) = detector.detectAndCompute(mdl_gray, None)
+    mdl_pts = keypointsToPoints(mdl_keyp)
+    cv_matcher = cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
+    matcher = createBruteForceMatcher()
+    for m in (cv_matcher, matcher):
+        m.add([mdl_desc])
+        m.train()
+    logger.info("%d model descriptors.", len(mdl_desc))
+
+    logger.info("Generating and extracting %d views...", args.num_views)
+    views = []
+    for _ in range(args.num_views):
+        H = randomViewHomography(img_gt.shape, (1920, 1080), rng)
+        view = cv2.warpPerspective(img_gt, H, (1920, 1080))
+        (keypoints, desc) = detector.detectAndCompute(cv2.cvtColor(view, cv2.COLOR_BGR2GRAY), None)
+        if desc is not None:
+            views.append((keypoints, desc))
+
+    # --------------------------------------------------------------------------
+    (tm_objects, tf_objects, _) = timeImplementation(matchObjects, filterObjects, cv_matcher,
+                                                      views, mdl_keyp, args.repeat)
+    (tm_arrays, tf_arrays, res_arrays) = timeImplementation(matchArrays, filterArrays, matcher,
+                                                            views, mdl_pts, args.repeat)
+    (t_objects, t_arrays) = (tm_objects + tf_objects, tm_arrays + tf_arrays)
+
+    # --------------------------------------------------------------------------
+    num_matches = np.mean([len(r[0]) for r in res_arrays]) if res_arrays else 0.
+    num_queries = np.mean([len(desc) for (_, desc) in views]) if views else 0.
+    logger.info(DBGSEP)
+    logger.info("%d views, %.0f query descriptors and %.0f matches per view on average.",
+                len(views), num_queries, num_matches)
+    logger.info("%-16s %10s %11s %12s %8s", "implementation", "match (ms)", "filter (ms)", "frame (ms)", "speedup")
+    logger.info("%-16s %10.3f %11.3f %12.3f %8.2f", "objects",
+                1000 * tm_objects, 1000 * tf_objects, 1000 * t_objects, 1.)
+    logger.info("%-16s %10.3f %11.3f %12.3f %8.2f", "arrays",
+                1000 * tm_arrays, 1000 * tf_arrays, 1000 * t_arrays,
+                t_objects / t_arrays if t_arrays > 0 else float("inf"))
+
+    if args.output:
+        report = {"ground_truth_image": args.ground_truth_image,
+                  "num_model_descriptors": len(mdl_desc),
+                  "num_views": len(views),
+                  "mean_queries_per_view": float(num_queries),
+                  "mean_matches_per_view": float(num_matches),
+                  "objects_match_time_per_frame": tm_objects,
+                  "objects_filter_time_per_frame": tf_objects,
+                  "arrays_match_time_per_frame": tm_arrays,
+                  "arrays_filter_time_per_frame": tf_arrays}
+        with open(args.output, "wb") as output:
+            json.dump(report, output, indent=2)
+        logger.debug("Results saved to %s" % args.output)
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 matcher benchmark.
+
+Compares approximate nearest-neighbour matchers with the brute-force baseline
+used by SIFT_BFTracker, on synthetic views (random perspective warps) of a
+ground truth image, or of a synthetic document if no image is given. For each
+matcher configuration, reports index construction time, matching throughput,
+and recall of the matches which pass the ratio test of the brute-force matcher.
+
+Sample usage (from the repository root):
+python -m benchmarks.bench_matchers -n 10 -o matchers.json \
+  -g /path/to/dataset/sample01/ground-truth.png
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+from time import time
+import json
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+
+from trackers.Tracker import multiPyrDown
+from trackers.Matchers import *
+from trackers.SIFT_BFTracker import createSIFTDetector
+
+from benchmarks.synthetic import makeDocument, randomViewHomography
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_NAME = "SmartDoc17 Matcher Benchmark"
+
+NUM_PYRDOWN_MODEL = 1 # same as SIFT_BFTracker
+SECOND_MATCH_TRESH = 0.75
+
+# ==============================================================================
+def benchMatcher(name, matcher, mdl_desc, views_desc, reference_matches=None):
+    """
+    Time index construction and matching of every view with `matcher`.
+    If `reference_matches` (list of set of (queryIdx, trainIdx), one per view)
+    is provided, also compute the recall of the matches found.
+    Return a tuple(result:dict, matches:list(set)).
+    """
+    t0 = time()
+    matcher.add([mdl_desc])
+    matcher.train()
+    t_build = time() - t0
+
+    found = []
+    t_match = 0.
+    num_queries = 0
+    for desc in views_desc:
+        t0 = time()
+        matches = knnMatchArray(matcher, desc)
+        t_match += time() - t0
+        num_queries += len(desc)
+        passed = ratioTest(matches, SECOND_MATCH_TRESH)
+        found.append(set(zip(passed["query_idx"].tolist(), passed["train_idx"].tolist())))
+
+    result = {"matcher": name,
+              "build_time": t_build,
+              "match_time_per_frame": t_match / max(1, len(views_desc)),
+              "queries_per_second": num_queries / t_match if t_match > 0 else float("inf"),
+              "matches_per_frame": np.mean([len(f) for f in found]) if found else 0.}
+    if reference_matches is not None:
+        num_ref = sum(len(r) for r in reference_matches)
+        num_common = sum(len(r & f) for (r, f) in zip(reference_matches, found))
+        result["recall"] = float(num_common) / num_ref if num_ref else 1.
+    return (result, found)
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark approximate matchers against brute force matching on synthetic views of a ground truth image.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-n', '--num-views',
+        type=int,
+        default=10,
+        help="Number of synthetic views to generate.")
+
+    parser.add_argument('-s', '--seed',
+        type=int,
+        default=42,
+        help="Seed of the random view generator.")
+
+    parser.add_argument('--trees',
+        type=int,
+        nargs="+",
+        default=[1, 4, 8],
+        help="Values of the FLANN 'trees' parameter to benchmark.")
+
+    parser.add_argument('--checks',
+        type=int,
+        nargs="+",
+        default=[16, 32, 64, 128],
+        help="Values of the FLANN 'checks' parameter to benchmark.")
+
+    parser.add_argument('-o', '--output',
+        help="Path to a JSON file where results will be saved.")
+
+    parser.add_argument('-g', '--ground-truth-image',
+        action=StoreValidFilePath,
+        help="Path to ground truth image used as model and to generate views (default: synthetic document).")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    rng = np.random.RandomState(args.seed)
+    (detector, _) = createSIFTDetector()
+    if args.ground_truth_image is not None:
+        img_gt = cv2.imread(args.ground_truth_image)
+    else:
+        img_gt = makeDocument(seed=args.seed)
+
+    logger.info("Extracting model features...")
+    mdl_gray = cv2.cvtColor(multiPyrDown(img_gt, NUM_PYRDOWN_MODEL), cv2.COLOR_BGR2GRAY)
+    (_, mdl_desc) = detector.detectAndCompute(mdl_gray, None)
+    logger.info("%d model descriptors.", len(mdl_desc))
+
+    logger.info("Generating and extracting %d views...", args.num_views)
+    views_desc = []
+    for _ in range(args.num_views):
+        H = randomViewHomography(img_gt.shape, (1920, 1080), rng)
+        view = cv2.warpPerspective(img_gt, H, (1920, 1080))
+        (_, desc) = detector.detectAndCompute(cv2.cvtColor(view, cv2.COLOR_BGR2GRAY), None)
+        if desc is not None:
+            views_desc.append(desc)
+
+    # --------------------------------------------------------------------------
+    (baseline, reference_matches) = benchMatcher("bf", createMatcher("bf"), mdl_desc, views_desc)
+    baseline["recall"] = 1.
+    results = [baseline]
+    for trees in args.trees:
+        for checks in args.checks:
+            (res, _) = benchMatcher("flann_%d_%d" % (trees, checks),
+                                    createMatcher("flann", trees=trees, checks=checks),
+                                    mdl_desc, views_desc, reference_matches)
+            res["trees"] = trees
+            res["checks"] = checks
+            results.append(res)
+
+    # --------------------------------------------------------------------------
+    logger.info(DBGSEP)
+    logger.info("%-16s %9s %12s %12s %8s %8s", "matcher", "build (s)", "frame (ms)", "queries/s", "recall", "speedup")
+    for res in results:
+        logger.info("%-16s %9.3f %12.1f %12.0f %8.3f %8.2f",
+                    res["matcher"], res["build_time"], 1000 * res["match_time_per_frame"],
+                    res["queries_per_second"], res["recall"],
+                    baseline["match_time_per_frame"] / res["match_time_per_frame"])
+
+    if args.output:
+        report = {"ground_truth_image": args.ground_truth_image,
+                  "num_model_descriptors": len(mdl_desc),
+                  "num_views": len(views_desc),
+                  "results": results}
+        with open(args.output, "wb") as output:
+            json.dump(report, output, indent=2)
+        logger.debug("Results saved to %s" % args.output)
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 tracker benchmark.
+
+Runs trackers over synthetic sequences (a generated document warped with known
+homographies, plus blur and noise, see benchmarks/synthetic.py), and reports
+for each tracker: frames per second, peak memory, acceptance rate and corner
+error against the known ground truth. No external data is needed.
+
+Each tracker runs in its own process, so that peak memory measures are not
+polluted by other trackers. Results can be saved as JSON and compared with a
+previous run (for instance, on another commit) with `--baseline`.
+
+Sample usage (from the repository root):
+python -m benchmarks.bench_trackers -n 100 -o bench.json
+python -m benchmarks.bench_trackers -n 100 --baseline bench.json SIFT_BFTracker
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+import resource
+from time import time
+import json
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+
+from trackers import TRACKER_NAMES, createTracker
+from trackers.Estimators import ESTIMATOR_NAMES
+
+from benchmarks.synthetic import *
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.1" # 1.1: corner errors measured against the corners the trackers report
+PROG_NAME = "SmartDoc17 Tracker Benchmark"
+
+# ==============================================================================
+def peakMemory():
+    """
+    Peak resident memory of the current process, in MiB.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss / 1024.**2 # bytes
+    return maxrss / 1024. # KiB
+
+def cornerErrors(corners_true, tl, bl, br, tr):
+    """
+    Distance (in pixels) between each estimated corner and the true one.
+    """
+    est = np.float32([[pt.x, pt.y] for pt in (tl, bl, br, tr)])
+    return np.sqrt(((est - corners_true)**2).sum(axis=1))
+
+def runBenchmark(config):
+    """
+    Run a single tracker over a synthetic sequence. Meant to be run in a
+    dedicated process. Return a result dictionary.
+    """
+    tracker = createTracker(config["tracker"])
+    tracker.setIncremental(config["incremental"])
+    tracker.setCoarseToFine(config["coarse_to_fine"])
+    if config["keypoint_budget"] is not None:
+        tracker.setKeypointBudget(*config["keypoint_budget"])
+    if config["estimator"] is not None:
+        tracker.setEstimator(config["estimator"])
+    tracker.enableStats(True)
+
+    t0 = time()
+    tracker.reconfigureModel(config["document_path"])
+    t_model = time() - t0
+
+    doc = cv2.imread(config["document_path"])
+    (fw, fh) = config["frame_size"]
+    tracker.reinitFrameSize(fw, fh)
+    # true corners: the corners the tracker reports, projected by the true
+    # homography (not the corners of the image, which differ by 1 or 2 pixels)
+    model_corners = tracker.modelCorners().reshape(1, -1, 2)
+
+    num_accepted = 0
+    t_frames = 0.
+    errors = [] # max corner error of each accepted frame
+    for (frame, H, _corners) in makeSequence(doc, config["num_frames"], (fw, fh), seed=config["seed"]):
+        t0 = time()
+        (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
+        t_frames += time() - t0
+        if not rejected:
+            num_accepted += 1
+            corners = cv2.perspectiveTransform(model_corners, H).reshape(-1, 2)
+            errors.append(float(cornerErrors(corners, tl, bl, br, tr).max()))
+
+    num_frames = config["num_frames"]
+    errors = np.float64(errors)
+    return {"tracker": tracker.getName(),
+            "incremental": config["incremental"],
+            "coarse_to_fine": config["coarse_to_fine"],
+            "keypoint_budget": config["keypoint_budget"],
+            "estimator": config["estimator"],
+            "model_time": t_model,
+            "fps": num_frames / t_frames if t_frames > 0 else float("inf"),
+            "mean_frame_time": t_frames / num_frames,
+            "peak_memory_mib": peakMemory(),
+            "acceptance_rate": float(num_accepted) / num_frames,
+            "corner_error": {"mean": float(errors.mean()) if len(errors) else None,
+                             "median": float(np.median(errors)) if len(errors) else None,
+                             "p95": float(np.percentile(errors, 95)) if len(errors) else None,
+                             "max": float(errors.max()) if len(errors) else None},
+            "stats": tracker.getStats()}
+
+def gitRevision():
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=root).strip().decode("ascii")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def modeName(result):
+    modes = [name for (key, name) in (("incremental", "incr."), ("coarse_to_fine", "c2f")) if result.get(key)]
+    if result.get("keypoint_budget"):
+        modes.append("%d/%d kp" % tuple(result["keypoint_budget"]))
+    if result.get("estimator"):
+        modes.append(result["estimator"])
+    return " (%s)" % ", ".join(modes) if modes else ""
+
+def _resultKey(result):
+    return (result["tracker"], result["incremental"], result.get("coarse_to_fine", False),
+            tuple(result.get("keypoint_budget") or ()), result.get("estimator"))
+
+def logResults(results, baseline=None):
+    base = {}
+    if baseline is not None:
+        base = dict((_resultKey(r), r) for r in baseline["results"])
+        if baseline.get("version") != PROG_VERSION:
+            logger.warning("Baseline produced by version %s of the benchmark (current: %s): corner errors may not be comparable.",
+                           baseline.get("version"), PROG_VERSION)
+
+    def fmtErr(value):
+        return "%8.2f" % value if value is not None else "%8s" % "-"
+
+    logger.info(DBGSEP)
+    logger.info("%-28s %8s %9s %8s %8s %8s %8s", "tracker", "fps", "mem (MiB)", "accept", "err mean", "err p95", "err max")
+    for r in results:
+        name = r["tracker"] + modeName(r)
+        err = r["corner_error"]
+        logger.info("%-28s %8.2f %9.1f %7.1f%% %s %s %s", name, r["fps"], r["peak_memory_mib"],
+                    100 * r["acceptance_rate"], fmtErr(err["mean"]), fmtErr(err["p95"]), fmtErr(err["max"]))
+        b = base.get(_resultKey(r))
+        if b is not None:
+            logger.info("%-28s %+7.1f%% %+9.1f %+7.1f%% %s", "  vs. baseline",
+                        100 * (r["fps"] / b["fps"] - 1), r["peak_memory_mib"] - b["peak_memory_mib"],
+                        100 * (r["acceptance_rate"] - b["acceptance_rate"]),
+                        fmtErr(err["mean"] - b["corner_error"]["mean"])
+                            if err["mean"] is not None and b["corner_error"]["mean"] is not None else "")
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Benchmark trackers on synthetic warped-document sequences.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-n', '--num-frames',
+        type=int,
+        default=50,
+        help="Number of frames of the synthetic sequence.")
+
+    parser.add_argument('-s', '--seed',
+        type=int,
+        default=42,
+        help="Seed of the document and sequence generators.")
+
+    parser.add_argument('--frame-size',
+        type=int,
+        nargs=2,
+        default=list(DEFAULT_FRAME_SIZE),
+        metavar=("WIDTH", "HEIGHT"),
+        help="Size of the synthetic frames.")
+
+    parser.add_argument('--incremental',
+        action="store_true",
+        help="Also benchmark each tracker in incremental mode.")
+
+    parser.add_argument('--coarse-to-fine',
+        action="store_true",
+        help="Also benchmark each tracker in coarse-to-fine mode.")
+
+    parser.add_argument('--keypoint-budget',
+        type=int,
+        nargs=2,
+        metavar=("MODEL", "FRAME"),
+        help="Also benchmark each tracker with this maximum number of keypoints per model and per frame.")
+
+    parser.add_argument('--estimators',
+        nargs="+",
+        choices=ESTIMATOR_NAMES,
+        default=[],
+        help="Also benchmark each tracker with each of these homography estimators.")
+
+    parser.add_argument('-o', '--output',
+        help="Path to a JSON file where results will be saved.")
+
+    parser.add_argument('--baseline',
+        action=StoreValidFilePath,
+        help="Path to the JSON results of a previous run, to compare with.")
+
+    parser.add_argument('trackers',
+        nargs="*",
+        choices=TRACKER_NAMES,
+        default=TRACKER_NAMES,
+        help="Trackers to benchmark (default: all of them).")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    tmp_dir = tempfile.mkdtemp(prefix="sd17bench")
+    try:
+        document_path = os.path.join(tmp_dir, "document.png")
+        cv2.imwrite(document_path, makeDocument(seed=args.seed))
+
+        configs = []
+        for tracker_name in args.trackers:
+            modes = [(False, False, None, None)]
+            if args.incremental:
+                modes.append((True, False, None, None))
+            if args.coarse_to_fine:
+                modes.append((False, True, None, None))
+            if args.keypoint_budget:
+                modes.append((False, False, args.keypoint_budget, None))
+            for estimator in args.estimators:
+                modes.append((False, False, None, estimator))
+            for (incremental, coarse_to_fine, keypoint_budget, estimator) in modes:
+                configs.append({"tracker": tracker_name,
+                                "incremental": incremental,
+                                "coarse_to_fine": coarse_to_fine,
+                                "keypoint_budget": keypoint_budget,
+                                "estimator": estimator,
+                                "document_path": document_path,
+                                "frame_size": tuple(args.frame_size),
+                                "num_frames": args.num_frames,
+                                "seed": args.seed})
+
+        results = []
+        for config in configs:
+            logger.info("Running %s%s...", config["tracker"], modeName(config))
+            # a fresh process per run, for independent peak memory measures
+            pool = multiprocessing.Pool(processes=1)
+            try:
+                results.append(pool.apply(runBenchmark, (config,)))
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    # --------------------------------------------------------------------------
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            baseline = json.load(f)
+    logResults(results, baseline)
+
+    if args.output:
+        report = {"program": PROG_NAME,
+                  "version": PROG_VERSION,
+                  "git_revision": gitRevision(),
+                  "opencv_version": cv2.__version__,
+                  "num_frames": args.num_frames,
+                  "seed": args.seed,
+                  "frame_size": args.frame_size,
+                  "results": results}
+        with open(args.output, "wb") as output:
+            json.dump(report, output, indent=2)
+        logger.info("Results saved to %s" % args.output)
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic test data for benchmarks: document images, and video sequences
+obtained by warping them with known homographies, plus blur and noise.
+"""
+
+# ==============================================================================
+# Imports
+import cv2
+import numpy as np
+
+# ==============================================================================
+DEFAULT_FRAME_SIZE = (1920, 1080) # (w, h)
+
+# ==============================================================================
+def makeDocument(width=1240, height=1754, seed=0):
+    """
+    int x int x int ---> ndarray
+    Generate a document page image (default: A4 at 150 DPI): title, paragraphs
+    of pseudo-words, a colored figure and a table. The same seed always produces
+    the same page.
+    """
+    rng = np.random.RandomState(seed)
+    img = np.full((height, width, 3), 255, np.uint8)
+    margin = width // 12
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    def randomWord():
+        return "".join(chr(rng.randint(ord('a'), ord('z') + 1)) for _ in range(rng.randint(1, 11)))
+
+    y = margin + 40
+    cv2.putText(img, " ".join(randomWord().capitalize() for _ in range(4)), (margin, y), font, 1.6, (20, 20, 20), 3)
+    y += 80
+    line_height = 30
+    while y < height - margin:
+        block = rng.randint(0, 10)
+        if block == 0 and y + 300 < height - margin:
+            # figure
+            (x0, x1) = (margin + rng.randint(0, 200), width - margin - rng.randint(0, 200))
+            color = tuple(int(c) for c in rng.randint(0, 256, 3))
+            cv2.rectangle(img, (x0, y), (x1, y + 250), color, -1)
+            for _ in range(5):
+                center = (rng.randint(x0, x1), rng.randint(y, y + 250))
+                cv2.circle(img, center, rng.randint(10, 80), tuple(int(c) for c in rng.randint(0, 256, 3)), -1)
+            y += 290
+        elif block == 1 and y + 200 < height - margin:
+            # table
+            for row in range(6):
+                for col in range(4):
+                    x = margin + col * (width - 2 * margin) // 4
+                    cv2.rectangle(img, (x, y + row * 32), (x + (width - 2 * margin) // 4, y + (row + 1) * 32), (0, 0, 0), 1)
+                    cv2.putText(img, randomWord(), (x + 6, y + row * 32 + 22), font, 0.55, (0, 0, 0), 1)
+            y += 230
+        else:
+            # paragraph
+            for _ in range(rng.randint(3, 9)):
+                x = margin
+                while True:
+                    word = randomWord()
+                    w = cv2.getTextSize(word, font, 0.65, 1)[0][0]
+                    if x + w > width - margin:
+                        break
+                    cv2.putText(img, word, (x, y), font, 0.65, (30, 30, 30), 1)
+                    x += w + 12
+                y += line_height
+                if y >= height - margin:
+                    break
+            y += line_height
+    return img
+
+def documentCorners(doc_shape):
+    (h, w) = doc_shape[:2]
+    return np.float32([[0, 0], [0, h - 1], [w - 1, h - 1], [w - 1, 0]])
+
+def randomViewHomography(model_shape, frame_size, rng, max_jitter=0.08):
+    """
+    Return a homography which projects a model of shape `model_shape` (h, w)
+    into a frame of size `frame_size` (w, h), as a document held in front of
+    a camera: roughly centered, covering most of the frame, with random
+    perspective distortion.
+    """
+    (mh, mw) = model_shape[:2]
+    (fw, fh) = frame_size
+    scale = 0.8 * min(float(fw) / mw, float(fh) / mh)
+    (cx, cy) = (fw / 2., fh / 2.)
+    (hw, hh) = (mw * scale / 2., mh * scale / 2.)
+    dst = np.float32([[cx - hw, cy - hh], [cx - hw, cy + hh],
+                      [cx + hw, cy + hh], [cx + hw, cy - hh]])
+    dst += rng.uniform(-max_jitter, max_jitter, dst.shape).astype(np.float32) * np.float32([fw, fh])
+    return cv2.getPerspectiveTransform(documentCorners(model_shape), dst)
+
+def makeSequence(doc, num_frames, frame_size=DEFAULT_FRAME_SIZE, seed=0,
+                 max_step=0.004, max_blur=2.0, noise_sigma=4.0, background=(96, 96, 96)):
+    """
+    Generate the frames of a synthetic handheld capture of `doc`.
+    Corners follow a smooth random walk (at most `max_step` times the frame
+    size per frame and per corner) from a random initial view. Each frame is
+    then blurred (gaussian blur with a random sigma up to `max_blur`) and
+    corrupted by gaussian noise of standard deviation `noise_sigma`.
+    Yield tuple(frame, H, corners) where H is the doc -> frame homography and
+    corners the (tl, bl, br, tr) corners of the document in the frame.
+    """
+    rng = np.random.RandomState(seed)
+    (fw, fh) = frame_size
+    src = documentCorners(doc.shape)
+    H = randomViewHomography(doc.shape, frame_size, rng)
+    dst = cv2.perspectiveTransform(src.reshape(1, -1, 2), H).reshape(-1, 2)
+    velocity = np.zeros_like(dst)
+    step = max_step * np.float32([fw, fh])
+    for _ in range(num_frames):
+        velocity = 0.8 * velocity + 0.2 * rng.uniform(-1, 1, dst.shape).astype(np.float32) * step
+        dst = dst + velocity
+        H = cv2.getPerspectiveTransform(src, dst)
+
+        frame = cv2.warpPerspective(doc, H, frame_size, flags=cv2.INTER_LINEAR,
+                                    borderMode=cv2.BORDER_CONSTANT, borderValue=background)
+        sigma = rng.uniform(0, max_blur)
+        if sigma > 0.3:
+            frame = cv2.GaussianBlur(frame, (0, 0), sigma)
+        if noise_sigma > 0:
+            noise = rng.normal(0, noise_sigma, frame.shape)
+            frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        yield (frame, H, dst.copy())
@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 tracker comparison tool.
+(c) 2017 L3i - Univ. La Rochelle
+    joseph (dot) chazalon (at) univ-lr (dot) fr
+
+Runs several trackers over every frame of every sample of a dataset in a
+single pass: each video is decoded once, by the main process, and its frames
+are handed to one worker process per tracker through a ring of shared memory
+slots (frames are never pickled). Trackers process each frame in parallel, and
+a slot is reused once every tracker is done with its frame.
+
+The outputs and timings of the trackers are then compared in a table: frame
+rate, acceptance rate, time to configure the model, and agreement with the
+first tracker (same accept/reject decision, distance between corners).
+Trajectories can be saved for each sample and tracker (see utils/trajectory.py).
+
+Sample usage:
+python compare_trackers.py -d -t SIFT_BFTracker SIFT_FLANNTracker SIFT_LKTracker \
+  -o comparison.json /path/to/dataset
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import os
+import os.path
+import sys
+from time import time
+import json
+import multiprocessing
+import traceback
+import Queue
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+from utils.reference import *
+from utils.frames import *
+from utils.trajectory import *
+
+from trackers import TRACKER_NAMES, DEFAULT_TRACKER, createTracker
+from trackers.Estimators import ESTIMATOR_NAMES, DEFAULT_ESTIMATOR
+from trackers.DescriptorCache import DescriptorCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_NAME = "SmartDoc17 Tracker Comparison"
+
+TRAJECTORY_EXT = ".traj"
+
+# ==============================================================================
+# Worker side
+# Each worker process owns one tracker. Commands are received on its own queue:
+#   ("sample", path_gt, trajectory_path or None)  configure the model
+#   ("frame", frame_id, slot, shape)              process the frame in `slot`
+#   ("end",)                                      end of the sample
+#   None                                          exit
+# and replies are sent on the queue shared by all workers:
+#   ("ready", worker_id, tracker name, tracker parameters)
+#   ("frame", worker_id, slot)                    slot released by the worker
+#   ("end", worker_id, records, model time, error message or None)
+# Errors do not stop the worker: the frames of the failed sample are released
+# without being processed.
+
+def _configureTracker(tracker_name, options):
+    tracker = createTracker(tracker_name)
+    tracker.setIncremental(options["incremental"])
+    tracker.setCoarseToFine(options["coarse_to_fine"])
+    tracker.setKeypointBudget(options["model_keypoints"], options["frame_keypoints"])
+    tracker.setEstimator(options["estimator"])
+    if options["model_cache_dir"] is not None:
+        tracker.setModelCache(DescriptorCache(options["model_cache_dir"], options["model_cache_size"]))
+    return tracker
+
+def _worker(worker_id, tracker_name, options, slots, commands, results):
+    tracker = _configureTracker(tracker_name, options)
+    results.put(("ready", worker_id, tracker.getName(), tracker.getParams()))
+    views = [np.frombuffer(slot, dtype=np.uint8) for slot in slots]
+
+    (records, writer, error, frame_size, t_model) = ([], None, None, None, 0.)
+    while True:
+        command = commands.get()
+        if command is None:
+            break
+
+        if command[0] == "sample":
+            (_, path_gt, trajectory_path) = command
+            (records, writer, error, frame_size, t_model) = ([], None, None, None, 0.)
+            try:
+                t_start = time()
+                tracker.reconfigureModel(path_gt)
+                t_model = time() - t_start
+                if trajectory_path is not None:
+                    writer = TrajectoryWriter(trajectory_path,
+                                              {"program": PROG_NAME,
+                                               "version": PROG_VERSION,
+                                               "tracker": tracker.getName(),
+                                               "tracker_params": tracker.getParams(),
+                                               "ground_truth_image": os.path.abspath(path_gt)})
+            except Exception as e:
+                error = "%s: %s" % (e.__class__.__name__, e)
+                logger.debug("%s: model configuration failed:\n%s", tracker_name, traceback.format_exc())
+
+        elif command[0] == "frame":
+            (_, fidx, slot, shape) = command
+            if error is None:
+                try:
+                    frame = views[slot][:int(np.prod(shape))].reshape(shape)
+                    if frame_size != shape[:2]:
+                        frame_size = shape[:2]
+                        tracker.reinitFrameSize(shape[1], shape[0])
+                    t_frame = time()
+                    (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
+                    t_frame = time() - t_frame
+                    num_inliers = tracker.getFrameInfo().get("num_inliers", 0)
+                    corners = np.nan if rejected else [(pt.x, pt.y) for pt in (tl, bl, br, tr)]
+                    records.append((fidx, not rejected, corners, num_inliers, t_frame))
+                    if writer is not None:
+                        writer.append(fidx, not rejected, (tl, bl, br, tr), num_inliers, t_frame)
+                except Exception as e:
+                    error = "%s: %s (frame %d)" % (e.__class__.__name__, e, fidx)
+                    logger.debug("%s: processing failed:\n%s", tracker_name, traceback.format_exc())
+            results.put(("frame", worker_id, slot))
+
+        elif command[0] == "end":
+            if writer is not None:
+                writer.close()
+            results.put(("end", worker_id, np.array(records, dtype=TRAJ_RECORD_DTYPE), t_model, error))
+            (records, writer) = ([], None)
+
+# ==============================================================================
+# Main process side
+class WorkerPool(object):
+    """
+    One worker process per tracker, sharing `num_slots` frame buffers of
+    `slot_size` bytes.
+    A RuntimeError is raised if a worker dies (a crash in OpenCV, for instance).
+    """
+    _POLL_PERIOD = 1. # seconds
+
+    def __init__(self, tracker_names, options, num_slots, slot_size):
+        self.num_workers = len(tracker_names)
+        self.slots = [multiprocessing.RawArray("B", slot_size) for _ in range(num_slots)]
+        self._views = [np.frombuffer(slot, dtype=np.uint8) for slot in self.slots]
+        self._free = list(range(num_slots))
+        self._pending = {} # slot ---> number of workers which did not release it yet
+        self._ends = {}
+        self._results = multiprocessing.Queue()
+        self._commands = []
+        self._processes = []
+        for (worker_id, name) in enumerate(tracker_names):
+            commands = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_worker, name="tracker-%s" % name,
+                                              args=(worker_id, name, options, self.slots, commands, self._results))
+            process.daemon = True
+            process.start()
+            self._commands.append(commands)
+            self._processes.append(process)
+
+        self.tracker_names = [None] * self.num_workers
+        self.tracker_params = [None] * self.num_workers
+        while None in self.tracker_names:
+            self._handle(self._nextReply())
+
+    def _nextReply(self):
+        while True:
+            try:
+                return self._results.get(timeout=self._POLL_PERIOD)
+            except Queue.Empty:
+                for process in self._processes:
+                    if not process.is_alive():
+                        raise RuntimeError("Worker process '%s' died (exit code %s)."
+                                           % (process.name, process.exitcode))
+
+    def _handle(self, reply):
+        if reply[0] == "frame":
+            slot = reply[2]
+            self._pending[slot] -= 1
+            if self._pending[slot] == 0:
+                del self._pending[slot]
+                self._free.append(slot)
+        elif reply[0] == "end":
+            self._ends[reply[1]] = reply[2:]
+        elif reply[0] == "ready":
+            self.tracker_names[reply[1]] = reply[2]
+            self.tracker_params[reply[1]] = reply[3]
+
+    def _broadcast(self, command):
+        for commands in self._commands:
+            commands.put(command)
+
+    def startSample(self, path_gt, trajectory_paths):
+        for (commands, path) in zip(self._commands, trajectory_paths):
+            commands.put(("sample", path_gt, path))
+
+    def pushFrame(self, fidx, frame):
+        """
+        Copy `frame` to a free slot (waiting for one if needed), and hand it to
+        every worker.
+        """
+        if frame.nbytes > len(self._views[0]):
+            raise ValueError("Frame %d is larger than the shared buffers (%s, %d bytes)."
+                             % (fidx, "x".join(str(s) for s in frame.shape), len(self._views[0])))
+        while not self._free:
+            self._handle(self._nextReply())
+        slot = self._free.pop()
+        self._views[slot][:frame.nbytes] = frame.reshape(-1)
+        self._pending[slot] = self.num_workers
+        self._broadcast(("frame", fidx, slot, frame.shape))
+
+    def endSample(self):
+        """
+        Wait for every worker to complete the sample. Return the list of
+        tuple(records, model configuration time, error) of each tracker.
+        """
+        self._broadcast(("end",))
+        while len(self._ends) < self.num_workers:
+            self._handle(self._nextReply())
+        (ends, self._ends) = (self._ends, {})
+        return [ends[worker_id] for worker_id in range(self.num_workers)]
+
+    def close(self):
+        self._broadcast(None)
+        for process in self._processes:
+            process.join()
+
+    def terminate(self):
+        for process in self._processes:
+            process.terminate()
+
+
+# ==============================================================================
+def frameSize(video_path):
+    """
+    str ---> int
+    Size in bytes of the first frame of `video_path` (0 if it cannot be read).
+    """
+    with FrameSource(video_path) as frames:
+        (ok, frame) = frames.read()
+    return frame.nbytes if ok else 0
+
+def compareSample(pool, sample_dir, max_frames, prefetch, trajectory_dir):
+    """
+    WorkerPool x str x int x int x str ---> dict
+    Run every tracker of `pool` over the frames of the sample `sample_dir`.
+    """
+    sample_name = os.path.basename(os.path.normpath(sample_dir))
+    trajectory_paths = [None] * pool.num_workers
+    if trajectory_dir is not None:
+        out_dir = os.path.join(trajectory_dir, sample_name)
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        trajectory_paths = [os.path.join(out_dir, name + TRAJECTORY_EXT) for name in pool.tracker_names]
+
+    pool.startSample(os.path.join(sample_dir, IN_FILE_GROUND_TRUTH), trajectory_paths)
+    frames = openFrameSource(os.path.join(sample_dir, IN_FILE_VIDEO), prefetch)
+    (num_frames, t_decode, error) = (0, 0., None)
+    t_start = time()
+    try:
+        while max_frames <= 0 or num_frames < max_frames:
+            t_read = time()
+            (ok, frame) = frames.read()
+            t_decode += time() - t_read
+            if not ok:
+                break
+            pool.pushFrame(num_frames, frame)
+            num_frames += 1
+    except ValueError as e:
+        error = str(e)
+        logger.error("%s: %s", sample_name, error)
+    finally:
+        frames.release()
+        results = pool.endSample()
+    return {"sample": sample_name,
+            "num_frames": num_frames,
+            "decode_time": t_decode,
+            "duration": time() - t_start,
+            "error": error,
+            "results": results}
+
+def compareRecords(records, ref_records):
+    """
+    ndarray(TRAJ_RECORD_DTYPE) x ndarray(TRAJ_RECORD_DTYPE) ---> tuple(int, int, float, int)
+    Return the number of frames processed by both trackers, the number of them
+    with the same decision, and the sum and number of mean corner distances
+    over the frames accepted by both.
+    """
+    num = min(len(records), len(ref_records))
+    (acc, ref_acc) = (records["accepted"][:num] != 0, ref_records["accepted"][:num] != 0)
+    both = acc & ref_acc
+    dist = np.sqrt(((records["corners"][:num][both] - ref_records["corners"][:num][both])**2).sum(axis=2))
+    return (num, int((acc == ref_acc).sum()), float(dist.mean(axis=1).sum()), int(both.sum()))
+
+def trackerTotals(comparisons, worker_id):
+    """
+    Aggregate the results of tracker `worker_id` over the samples `comparisons`
+    (see `compareSample`).
+    """
+    totals = {"num_frames": 0, "num_accepted": 0, "time": 0., "model_time": 0., "num_errors": 0,
+              "num_compared": 0, "num_same_decision": 0, "corner_distance_sum": 0., "num_both_accepted": 0}
+    for comparison in comparisons:
+        (records, t_model, error) = comparison["results"][worker_id]
+        totals["num_frames"] += len(records)
+        totals["num_accepted"] += int((records["accepted"] != 0).sum())
+        totals["time"] += float(records["time"].sum())
+        totals["model_time"] += t_model
+        totals["num_errors"] += error is not None
+        (num, same, dist_sum, both) = compareRecords(records, comparison["results"][0][0])
+        totals["num_compared"] += num
+        totals["num_same_decision"] += same
+        totals["corner_distance_sum"] += dist_sum
+        totals["num_both_accepted"] += both
+    totals["fps"] = totals["num_frames"] / totals["time"] if totals["time"] > 0 else 0.
+    totals["acceptance_rate"] = float(totals["num_accepted"]) / totals["num_frames"] if totals["num_frames"] else 0.
+    totals["decision_agreement"] = (float(totals["num_same_decision"]) / totals["num_compared"]
+                                    if totals["num_compared"] else 0.)
+    totals["mean_corner_distance"] = (totals["corner_distance_sum"] / totals["num_both_accepted"]
+                                      if totals["num_both_accepted"] else 0.)
+    return totals
+
+def logComparison(tracker_names, totals, total_duration, decode_time):
+    logger.info(DBGSEP)
+    logger.info("%-24s %8s %9s %8s %7s %9s %8s %10s %6s",
+                "tracker", "frames", "accepted", "ms/frame", "fps", "model (s)", "agree", "dist (px)", "errors")
+    for (name, t) in zip(tracker_names, totals):
+        logger.info("%-24s %8d %8.1f%% %8.1f %7.2f %9.2f %7.1f%% %10.2f %6d",
+                    name, t["num_frames"], 100. * t["acceptance_rate"],
+                    1000. * t["time"] / t["num_frames"] if t["num_frames"] else 0., t["fps"],
+                    t["model_time"], 100. * t["decision_agreement"], t["mean_corner_distance"], t["num_errors"])
+    logger.info(DBGSEP)
+    logger.info("Agreement and corner distance are relative to %s.", tracker_names[0])
+    sequential = sum(t["time"] + t["model_time"] for t in totals) + decode_time
+    logger.info("Total time %.2fs (decoding %.2fs), %.2fs if trackers had run one after the other.",
+                total_duration, decode_time, sequential)
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Compare several trackers over every frame of every sample of a dataset, decoding each video once.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-t', '--trackers',
+        nargs="+",
+        choices=TRACKER_NAMES,
+        default=TRACKER_NAMES,
+        help="Trackers to compare (agreement is measured with respect to the first one), each running in its own process.")
+
+    parser.add_argument('-m', '--max-frames',
+        type=int,
+        default=0,
+        help="Maximum number of frames to read from each video (0: no limit).")
+
+    parser.add_argument('-o', '--output',
+        help="Path to a JSON file where the comparison will be saved.")
+
+    parser.add_argument('--trajectory-dir',
+        help="Directory where the trajectory of each tracker is saved, as <sample>/<tracker>%s." % TRAJECTORY_EXT)
+
+    parser.add_argument('--slots',
+        type=int,
+        default=8,
+        help="Number of frames which can be shared with the trackers at the same time.")
+
+    parser.add_argument('--incremental',
+        action="store_true",
+        help="Search the document only around its previous position when the previous frame was accepted.")
+
+    parser.add_argument('--coarse-to-fine',
+        action="store_true",
+        help="Detect the document in reduced frames first, then refine its corners at full resolution (faster on large frames).")
+
+    parser.add_argument('--model-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept for each ground truth image, spread over the whole image (0: no limit).")
+
+    parser.add_argument('--frame-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept per frame, spread over the whole frame (0: no limit).")
+
+    parser.add_argument('-e', '--estimator',
+        choices=ESTIMATOR_NAMES,
+        default=DEFAULT_ESTIMATOR,
+        help="Robust homography estimator: OpenCV's RANSAC (ransac_cv) or LMEDS (lmeds), or RANSAC with adaptive iteration count and the homography of the previous frame as first hypothesis (ransac), with PROSAC-like sampling of the best matches first (prosac).")
+
+    parser.add_argument('--prefetch',
+        type=int,
+        default=4,
+        help="Number of frames decoded in advance by a background thread (0 disables prefetching).")
+
+    parser.add_argument('--model-cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help="Directory where the features extracted from ground truth images are cached.")
+
+    parser.add_argument('--model-cache-size',
+        type=int,
+        default=DEFAULT_MAX_SIZE / 1024**2,
+        help="Maximum size of the model feature cache, in MiB.")
+
+    parser.add_argument('--no-model-cache',
+        action="store_true",
+        help="Do not use (nor populate) the model feature cache.")
+
+    parser.add_argument('dataset_root',
+        action=StoreValidDirPath,
+        help="Path to the dataset root, containing one directory per sample (with 'ground-truth.png' and 'input.mp4' files).")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    if len(set(args.trackers)) != len(args.trackers):
+        logger.error("Each tracker can only be compared once.")
+        return 1
+    samples = listSamples(args.dataset_root)
+    logger.info("Found %d samples under '%s'.", len(samples), args.dataset_root)
+    if not samples:
+        return 1
+    if args.slots < 1:
+        logger.error("At least 1 slot is required.")
+        return 1
+
+    # Shared buffers must be allocated before workers are started: they are
+    # sized for the largest frame of the dataset.
+    slot_size = max(frameSize(os.path.join(sample_dir, IN_FILE_VIDEO)) for sample_dir in samples)
+    logger.debug("%d shared frame buffers of %d bytes.", args.slots, slot_size)
+    options = {"incremental": args.incremental,
+               "coarse_to_fine": args.coarse_to_fine,
+               "model_keypoints": args.model_keypoints,
+               "frame_keypoints": args.frame_keypoints,
+               "estimator": args.estimator,
+               "model_cache_dir": None if args.no_model_cache else args.model_cache_dir,
+               "model_cache_size": args.model_cache_size * 1024**2}
+
+    # Let's go
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    # --------------------------------------------------------------------------
+    t_start = time()
+    pool = WorkerPool(args.trackers, options, args.slots, max(1, slot_size))
+    comparisons = []
+    try:
+        for (k, sample_dir) in enumerate(samples):
+            comparison = compareSample(pool, sample_dir, args.max_frames, args.prefetch, args.trajectory_dir)
+            comparisons.append(comparison)
+            logger.info("[%3d/%3d] %-30s %5d frames (%.2fs)",
+                        k + 1, len(samples), comparison["sample"], comparison["num_frames"], comparison["duration"])
+            for (name, (records, _, error)) in zip(pool.tracker_names, comparison["results"]):
+                if error is not None:
+                    logger.error("%s failed on %s: %s", name, comparison["sample"], error)
+        pool.close()
+    except KeyboardInterrupt:
+        logger.error("Interrupted by user.")
+        pool.terminate()
+        return 2
+    except RuntimeError as e:
+        logger.error("%s", e)
+        pool.terminate()
+        return 2
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+    total_duration = time() - t_start
+    decode_time = sum(c["decode_time"] for c in comparisons)
+    totals = [trackerTotals(comparisons, worker_id) for worker_id in range(pool.num_workers)]
+    logComparison(pool.tracker_names, totals, total_duration, decode_time)
+
+    if args.output:
+        report = {"program": PROG_NAME,
+                  "version": PROG_VERSION,
+                  "trackers": [{"name": name, "params": params}
+                               for (name, params) in zip(pool.tracker_names, pool.tracker_params)],
+                  "options": options,
+                  "duration": total_duration,
+                  "decode_time": decode_time,
+                  "totals": dict(zip(pool.tracker_names, totals)),
+                  "samples": [{"sample": c["sample"],
+                               "num_frames": c["num_frames"],
+                               "error": c["error"],
+                               "tracker_errors": dict((name, c["results"][worker_id][2])
+                                                      for (worker_id, name) in enumerate(pool.tracker_names)),
+                               "trackers": dict((name, trackerTotals([c], worker_id))
+                                                for (worker_id, name) in enumerate(pool.tracker_names))}
+                              for c in comparisons]}
+        with open(args.output, "wb") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        logger.debug("Comparison saved to %s" % args.output)
+
+    if any(t["num_errors"] for t in totals) or any(c["error"] is not None for c in comparisons):
+        return 2
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)
@@ -30,17 +30,120 @@ import numpy as np
 # ==============================================================================
 from utils.args import *
 from utils.log import *
+from utils.reference import *
+from utils.frames import *
+from utils.selection import *
+from utils.manifest import *
+from utils.output import OutputWriter, DEFAULT_NUM_THREADS, DEFAULT_PNG_COMPRESSION
+from utils.dewarp import defaultBandRows
 
-from trackers.SIFT_BFTracker import SIFT_BFTracker
+from trackers import TRACKER_NAMES, DEFAULT_TRACKER, createTracker
+from trackers.Estimators import ESTIMATOR_NAMES, DEFAULT_ESTIMATOR
+from trackers.DescriptorCache import DescriptorCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
 
 # ==============================================================================
 logger = logging.getLogger(__name__)
 
 # ==============================================================================
 # Constants
-PROG_VERSION = "1.0"
+# Recorded in the manifest of each sample (see utils/manifest.py): bump it with
+# any change (here, in utils/ or in trackers/) which may change the outputs, so
+# that outputs generated before are not considered up to date.
+# 1.1: contiguous scan chunks, estimator reset per sequence
+PROG_VERSION = "1.1"
 PROG_NAME = "SmartDoc17 Reference Creator"
 
+# ==============================================================================
+def waitForKey(win_name, img, keys):
+    """
+    Display `img` until one of the characters in `keys` is pressed, and return it.
+    """
+    while True:
+        cv2.imshow(win_name, img)
+        key = cv2.waitKey(20) # required otherwise display thread show nothing
+        for k in keys:
+            if key & 0xFF == ord(k):
+                return k
+
+def selectInteractively(tracker, args, win_name_frame):
+    """
+    Display the detection in each frame until the user chooses one.
+    Return a tuple(fidx, frame, draw_mat, tl, bl, br, tr).
+    """
+    frames = openFrameSource(args.sample_video, args.prefetch)
+
+    (frame_width, frame_height) = (None, None)
+    detection_complete = False
+    can_read_frame = True
+    fidx = -1
+    tl = bl = br = tr = None
+    frame = None
+    draw_mat = None
+    while not detection_complete and can_read_frame:
+        with tracker.stats.timer("decode"):
+            can_read_frame, frame = frames.read()
+        fidx += 1
+        if not can_read_frame:
+            logger.error("End of stream (or read error) reached at frame %02d.", fidx)
+
+        # res_data = [(frameid, framemat, coords)]
+        (fh, fw, ch) = frame.shape
+
+        # TODO remove?
+        if (frame_width, frame_height) != (fw, fh):
+            (frame_width, frame_height) = (fw, fh)
+            logger.debug("Reinitializing tracker with frame size (w=%.3f; h=%.3f)" % (fw, fh))
+            tracker.reinitFrameSize(frame_width, frame_height)
+
+        (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
+
+        logDetection(logger, fidx, rejected, tl, bl, br, tr)
+
+        # viz
+        draw_mat = drawDetection(frame, rejected, tl, bl, br, tr)
+
+        logger.info("Press <q> to save and quit or <SPACE> to select next frame.")
+        action_chosen = waitForKey(win_name_frame, draw_mat, ('q', ' '))
+
+        # TODO add <e> for edit mode
+
+        if action_chosen == "q":
+            detection_complete = True
+
+    logFrameSourceStats(logger, frames)
+    frames.release()
+    return (fidx, frame, draw_mat, tl, bl, br, tr)
+
+def selectAutomatically(tracker, args):
+    """
+    Score every frame among the first `args.window` ones and pick the best one.
+    Return a tuple(fidx, frame, draw_mat, tl, bl, br, tr, runner_ups), or None
+    if no frame is valid. `runner_ups` is the list of tuple(fidx, frame, tl,
+    bl, br, tr) of the (at most) `args.dewarp_candidates` next best frames.
+    """
+    if args.jobs > 1:
+        candidates = scanCandidatesParallel(args.tracker, tracker.getParams(), args.ground_truth_image,
+                                            args.sample_video, args.window, args.jobs,
+                                            None if args.no_model_cache else args.model_cache_dir,
+                                            args.model_cache_size * 1024**2)
+    else:
+        candidates = scanCandidates(tracker, args.sample_video, args.window)
+    scored = scoreCandidates(candidates)
+    logCandidates(logger, scored)
+    if not scored:
+        return None
+
+    best = scored[0][1]
+    runner_ups = []
+    with IndexedFrameSource(args.sample_video) as frames:
+        frame = frames.get(best.frame_id)
+        for (_score, cand) in scored[1:1 + args.dewarp_candidates]:
+            runner_ups.append((cand.frame_id, frames.get(cand.frame_id), cand.tl, cand.bl, cand.br, cand.tr))
+    (tl, bl, br, tr) = (best.tl, best.bl, best.br, best.tr)
+    logDetection(logger, best.frame_id, False, tl, bl, br, tr)
+    draw_mat = drawDetection(frame, False, tl, bl, br, tr)
+    return (best.frame_id, frame, draw_mat, tl, bl, br, tr, runner_ups)
+
 # ==============================================================================
 def main(argv):
     # Option parsing
@@ -53,10 +156,98 @@ def main(argv):
         action="store_true", 
         help="Activate debug output.")
 
-    # parser.add_argument('-f', '--force', 
-    #     action="store_true", 
-    #     default=False,
-    #     help="Force overwriting of existing files in output directory.")
+    parser.add_argument('-t', '--tracker',
+        choices=TRACKER_NAMES,
+        default=DEFAULT_TRACKER,
+        help="Tracker used to detect the document in frames.")
+
+    parser.add_argument('-a', '--auto',
+        action="store_true",
+        help="Select the reference frame automatically, by scoring the detections in the first frames of the video.")
+
+    parser.add_argument('-c', '--confirm',
+        action="store_true",
+        help="In automatic mode, display the selected frame and ask for confirmation before saving.")
+
+    parser.add_argument('-w', '--window',
+        type=int,
+        default=60,
+        help="In automatic mode, number of frames (from the beginning of the video) to consider.")
+
+    parser.add_argument('-j', '--jobs',
+        type=int,
+        default=1,
+        help="In automatic mode, number of worker processes used to evaluate frames.")
+
+    parser.add_argument('--incremental',
+        action="store_true",
+        help="Search the document only around its previous position when the previous frame was accepted.")
+
+    parser.add_argument('--coarse-to-fine',
+        action="store_true",
+        help="Detect the document in reduced frames first, then refine its corners at full resolution (faster on large frames).")
+
+    parser.add_argument('--model-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept for the ground truth image, spread over the whole image (0: no limit).")
+
+    parser.add_argument('--frame-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept per frame, spread over the whole frame (0: no limit).")
+
+    parser.add_argument('-e', '--estimator',
+        choices=ESTIMATOR_NAMES,
+        default=DEFAULT_ESTIMATOR,
+        help="Robust homography estimator: OpenCV's RANSAC (ransac_cv) or LMEDS (lmeds), or RANSAC with adaptive iteration count and the homography of the previous frame as first hypothesis (ransac), with PROSAC-like sampling of the best matches first (prosac).")
+
+    parser.add_argument('--stats',
+        action="store_true",
+        help="Collect per-stage timings and per-frame counters, and save them to a JSON report next to the log file (not collected from worker processes when -j > 1).")
+
+    parser.add_argument('--prefetch',
+        type=int,
+        default=4,
+        help="Number of frames decoded in advance by a background thread (0 disables prefetching).")
+
+    parser.add_argument('--png-compression',
+        type=int,
+        choices=range(10),
+        default=DEFAULT_PNG_COMPRESSION,
+        help="zlib compression level of output PNG images, from 0 (fastest, largest files) to 9 (slowest, smallest files).")
+
+    parser.add_argument('--writer-threads',
+        type=int,
+        default=DEFAULT_NUM_THREADS,
+        help="Number of background threads writing output files (0 writes them in the main thread).")
+
+    parser.add_argument('--band-rows',
+        type=int,
+        default=defaultBandRows(),
+        help="Height of the bands by which reference frames are dewarped and written, to bound memory use (0: whole frames at once; the default is 0 if bands do not reproduce cv2.warpPerspective exactly with this version of OpenCV).")
+
+    parser.add_argument('--dewarp-candidates',
+        type=int,
+        default=0,
+        help="In automatic mode, also dewarp the given number of next best candidate frames (to '%s'), in the same pass as the reference frame." % OUT_FILE_CANDIDATE_DEWARPED.replace("%", "%%"))
+
+    parser.add_argument('--model-cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help="Directory where the features extracted from ground truth images are cached.")
+
+    parser.add_argument('--model-cache-size',
+        type=int,
+        default=DEFAULT_MAX_SIZE / 1024**2,
+        help="Maximum size of the model feature cache, in MiB.")
+
+    parser.add_argument('--no-model-cache',
+        action="store_true",
+        help="Do not use (nor populate) the model feature cache.")
+
+    parser.add_argument('-f', '--force',
+        action="store_true",
+        help="In automatic mode without confirmation, process the sample even if the output directory is up to date (same inputs, tracker and options).")
 
     parser.add_argument('ground_truth_image', 
         action=StoreValidFilePath,
@@ -76,11 +267,7 @@ def main(argv):
 
     # --------------------------------------------------------------------------
     # Definition of output paths
-    out_path_log = os.path.join(args.output_dir, "create_reference.log")
-    out_path_json = os.path.join(args.output_dir, "sample.json")
-    out_path_frame_extracted = os.path.join(args.output_dir, "reference_frame_%02d_extracted.png")
-    out_path_frame_extracted_viz = os.path.join(args.output_dir, "reference_frame_%02d_extracted_viz.png")
-    out_path_frame_dewarped = os.path.join(args.output_dir, "reference_frame_%02d_dewarped.png")
+    out_path_log = os.path.join(args.output_dir, OUT_FILE_LOG)
 
 
     # init logger to store a log copy in output dir
@@ -93,142 +280,95 @@ def main(argv):
     programHeader(logger, PROG_NAME, PROG_VERSION)
     dumpArgs(args, logger)
 
-    # --------------------------------------------------------------------------
-    # Prepare process
-    logger.debug("Starting up")
-    frames = cv2.VideoCapture(args.sample_video)
-
     # --------------------------------------------------------------------------
     # Load and initialize tracker
     logger.debug("Creating tracker...")
-    tracker = SIFT_BFTracker()
+    tracker = createTracker(args.tracker)
+    tracker.setIncremental(args.incremental)
+    tracker.setCoarseToFine(args.coarse_to_fine)
+    tracker.setKeypointBudget(args.model_keypoints, args.frame_keypoints)
+    tracker.setEstimator(args.estimator)
+    tracker.enableStats(args.stats)
+    if not args.no_model_cache:
+        tracker.setModelCache(DescriptorCache(args.model_cache_dir, args.model_cache_size * 1024**2))
     logger.debug("Tracker created.")
 
+    options = {"selection": "best" if args.auto else "interactive",
+               "window": args.window if args.auto else None,
+               # candidates depend on how the window is split into chunks, not on -j
+               "scan_chunk_size": DEFAULT_SCAN_CHUNK_SIZE if args.auto else None,
+               "dewarp_candidates": args.dewarp_candidates if args.auto else 0,
+               "stats": args.stats,
+               "png_compression": args.png_compression}
+    manifest = buildManifest(args.output_dir,
+                             {IN_FILE_GROUND_TRUTH: args.ground_truth_image, IN_FILE_VIDEO: args.sample_video},
+                             tracker, options, PROG_NAME, PROG_VERSION)
+    if args.auto and not args.confirm and not args.force:
+        (up_to_date, reason) = checkManifest(args.output_dir, manifest)
+        if up_to_date:
+            logger.info("Outputs are up to date, nothing to do (use -f to process the sample anyway).")
+            return
+        logger.debug("Outputs must be generated: %s.", reason)
+
     logger.debug("Configuring tracker with model '%s'", args.ground_truth_image)
     tracker.reconfigureModel(args.ground_truth_image)
     logger.debug("Tracker model configuration complete.")
 
-
-
-    win_name_gt = "Ground truth"
-    cv2.namedWindow(win_name_gt, cv2.WINDOW_NORMAL)
     img_gt = cv2.imread(args.ground_truth_image)
-    cv2.imshow(win_name_gt, img_gt)
+    interactive = not args.auto or args.confirm
+    if interactive:
+        win_name_gt = "Ground truth"
+        cv2.namedWindow(win_name_gt, cv2.WINDOW_NORMAL)
+        cv2.imshow(win_name_gt, img_gt)
+        win_name_frame = 'Tracker output'
+        cv2.namedWindow(win_name_frame, cv2.WINDOW_NORMAL)
 
     # Let's go
     # --------------------------------------------------------------------------
     logger.debug("--- Process started. ---")
     # --------------------------------------------------------------------------
-    win_name_frame = 'Tracker output'
-    cv2.namedWindow(win_name_frame, cv2.WINDOW_NORMAL)
-
-    (frame_width, frame_height) = (None, None)
-    detection_complete = False
-    can_read_frame = True
-    fidx = -1
-    tl = bl = br = tr = None
-    frame = None
-    draw_mat = None
-    while not detection_complete and can_read_frame:
-        can_read_frame, frame = frames.read()
-        fidx += 1
-        if not can_read_frame:
-            logger.error("End of stream (or read error) reached at frame %02d.", fidx)
-
-        # res_data = [(frameid, framemat, coords)]
-        draw_mat = frame.copy()
-        (fh, fw, ch) = frame.shape
-
-        # TODO remove?
-        if (frame_width, frame_height) != (fw, fh):
-            (frame_width, frame_height) = (fw, fh)
-            logger.debug("Reinitializing tracker with frame size (w=%.3f; h=%.3f)" % (fw, fh))
-            tracker.reinitFrameSize(frame_width, frame_height)
-
-        (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
-
-        # TODO extract display function
-        if not rejected:
-            logger.info("frame %04d: A " 
-                        "tl:(%4d,%4d) bl:(%4d,%4d) br:(%4d,%4d) tr:(%4d,%4d)",
-                        fidx, tl.x, tl.y, bl.x, bl.y, br.x, br.y, tr.x, tr.y)
-        else:
-            logger.info("frame %04d: R", fidx)
-
-        # viz
-        if not rejected:
-                dbgq = np.int32([[tl.x, tl.y],
-                                 [bl.x, bl.y],
-                                 [br.x, br.y],
-                                 [tr.x, tr.y]])
-                cv2.polylines(draw_mat, [dbgq], True, (0, 255, 0), 2)
-
-                for pt in (tl, bl, br, tr):
-                    cv2.putText(draw_mat, pt.name.upper(), (int(pt.x), int(pt.y)), cv2.FONT_HERSHEY_PLAIN, 2, (64, 255, 64), 2)
-        else:
-            cv2.circle(draw_mat, (frame_width/2, frame_height/2), 20, (0, 0, 255), 10)
-
-
-        action_chosen = None
-        logger.info("Press <q> to save and quit or <SPACE> to select next frame.")
-        while action_chosen is None:
-            cv2.imshow(win_name_frame, draw_mat)
-            key = cv2.waitKey(20) # required otherwise display thread show nothing
-            if key & 0xFF == ord('q'):
-                action_chosen = "quit"
-            if key & 0xFF == ord(' '):
-                action_chosen = "continue"
-
-        # TODO add <e> for edit mode
-
-        if action_chosen == "quit":
-            detection_complete = True
-
-
-    # Output file
-    results = {
-        "target_image_shape": {"x_len": img_gt.shape[1], "y_len": img_gt.shape[0]},
-        "input_video_shape": {"x_len": frame_width, "y_len": frame_height},
-        "reference_frame_id": fidx,
-        "object_coord_in_ref_frame": {
-            "top_left": {"x": tl.x, "y": tl.y},
-            "bottom_left": {"x": bl.x, "y": bl.y},
-            "bottom_right": {"x": br.x, "y": br.y},
-            "top_right": {"x": tr.x, "y": tr.y},
-        }
-    }
-
-
-    with open(out_path_json, "wb") as output:
-        json.dump(results, output, indent=2)
-
-    # write output out_path_json
-    logger.debug("SegResult file generated: %s" % out_path_json)
-
-    # save ref. frame extracted
-    cv2.imwrite(out_path_frame_extracted%fidx, frame)
-    cv2.imwrite(out_path_frame_extracted_viz%fidx, draw_mat)
-
-    # dewarp and save dewarped image
-    shape_object = np.float32([[tl.x, tl.y],
-                               [bl.x, bl.y],
-                               [br.x, br.y],
-                               [tr.x, tr.y]])
-    shape_target = np.float32([[0, 0],
-                               [0, img_gt.shape[0]-1],
-                               [img_gt.shape[1]-1, img_gt.shape[0]-1],
-                               [img_gt.shape[1]-1, 0]])
-
-    trans = cv2.getPerspectiveTransform(shape_object, shape_target)
-    frame_dewarped = cv2.warpPerspective(frame, trans, (img_gt.shape[1], img_gt.shape[0]))
-    cv2.imwrite(out_path_frame_dewarped%fidx, frame_dewarped)
+    if args.auto:
+        selection = selectAutomatically(tracker, args)
+        if selection is None:
+            logger.error("No valid reference frame found within the first %d frames, no output generated.", args.window)
+            return 1
+        (fidx, frame, draw_mat, tl, bl, br, tr, runner_ups) = selection
+        if args.confirm:
+            logger.info("Press <q> to save and quit or <ESC> to quit without saving.")
+            if waitForKey(win_name_frame, draw_mat, ('q', '\x1b')) != 'q':
+                logger.info("Selection discarded, no output generated.")
+                return 1
+    else:
+        (fidx, frame, draw_mat, tl, bl, br, tr) = selectInteractively(tracker, args, win_name_frame)
+        runner_ups = []
+
+    # Output files, written in the background (the manifest last, once every
+    # other file is complete)
+    invalidateManifest(args.output_dir)
+    writer = OutputWriter(args.writer_threads, args.png_compression)
+    try:
+        tasks = saveReference(args.output_dir, fidx, frame, draw_mat, tl, bl, br, tr, img_gt.shape, logger,
+                              band_rows=args.band_rows, writer=writer, candidates=runner_ups)
+        if args.stats:
+            tasks.append(saveStats(os.path.join(args.output_dir, OUT_FILE_STATS), tracker, writer=writer))
+        manifest["reference_frame_id"] = fidx
+        writer.submit("manifest", saveManifest,
+                      (args.output_dir, manifest,
+                       referenceOutputFiles(fidx, [c[0] for c in runner_ups]) + ([OUT_FILE_STATS] if args.stats else [])),
+                      after=tasks)
+
+        # --------------------------------------------------------------------------
+        if interactive:
+            logger.info("Press any key to exit.")
+            cv2.waitKey()
+            cv2.destroyWindow(win_name_frame)
+    finally:
+        writer.close()
+    logger.debug("Output files and manifest generated.")
 
     # --------------------------------------------------------------------------
     logger.debug("--- Process complete. ---")
     # --------------------------------------------------------------------------
-    logger.info("Press any key to exit.")
-    cv2.waitKey()
-    cv2.destroyWindow(win_name_frame)
 
 
 # ==============================================================================
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 reference creation tool - headless batch mode.
+(c) 2017 L3i - Univ. La Rochelle
+    joseph (dot) chazalon (at) univ-lr (dot) fr
+
+Processes every sample of a dataset tree without any user interaction: the
+reference frame is selected automatically (see utils/selection.py) and samples
+are processed in parallel by a pool of worker processes.
+
+Samples whose outputs are up to date (same inputs, tracker and options, see
+utils/manifest.py) are skipped, so an interrupted run resumes where it
+stopped. Use `-f` to process every sample again.
+
+Sample usage:
+python create_reference_batch.py -d -j 8 /path/to/dataset
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import os
+import os.path
+import sys
+from time import time
+import multiprocessing
+import traceback
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+from utils.reference import *
+from utils.frames import *
+from utils.selection import *
+from utils.png import readPngShape
+from utils.manifest import *
+from utils.output import OutputWriter, DEFAULT_NUM_THREADS, DEFAULT_PNG_COMPRESSION
+from utils.dewarp import defaultBandRows
+
+from trackers import TRACKER_NAMES, DEFAULT_TRACKER, createTracker
+from trackers.Estimators import ESTIMATOR_NAMES, DEFAULT_ESTIMATOR
+from trackers.DescriptorCache import DescriptorCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+# Recorded in the manifest of each sample (see utils/manifest.py): bump it with
+# any change (here, in utils/ or in trackers/) which may change the outputs, so
+# that outputs generated before are not considered up to date.
+# 1.1: contiguous scan chunks, estimator reset per sequence
+PROG_VERSION = "1.1"
+PROG_NAME = "SmartDoc17 Reference Creator (batch mode)"
+
+STATUS_OK = "ok"
+STATUS_UP_TO_DATE = "up-to-date"
+STATUS_NO_DETECTION = "no-detection"
+STATUS_ERROR = "error"
+
+SELECTION_FIRST = "first"
+SELECTION_BEST = "best"
+
+# ==============================================================================
+# Worker side
+# Each worker process owns its own tracker and output writer: OpenCV objects
+# cannot be shared between processes. Logger configuration is inherited from the
+# parent process.
+_worker_tracker = None
+_worker_writer = None
+
+def _initWorker(tracker_name, model_cache_dir, model_cache_size, keypoint_budget, estimator, writer_options):
+    global _worker_tracker, _worker_writer
+    _worker_writer = OutputWriter(*writer_options)
+    _worker_tracker = createTracker(tracker_name)
+    _worker_tracker.setKeypointBudget(*keypoint_budget)
+    _worker_tracker.setEstimator(estimator)
+    if model_cache_dir is not None:
+        _worker_tracker.setModelCache(DescriptorCache(model_cache_dir, model_cache_size))
+
+def findFirstAcceptedFrame(tracker, sample_video, max_frames, prefetch, sample_logger):
+    """
+    Tracker x str x int x int x Logger ---> tuple(fidx, frame, tl, bl, br, tr) or None
+    Process the frames of `sample_video` until the tracker accepts one, reading
+    at most `max_frames` frames (0 means no limit).
+    """
+    frames = openFrameSource(sample_video, prefetch)
+    (frame_width, frame_height) = (None, None)
+    fidx = -1
+    try:
+        while max_frames <= 0 or fidx + 1 < max_frames:
+            with tracker.stats.timer("decode"):
+                can_read_frame, frame = frames.read()
+            fidx += 1
+            if not can_read_frame:
+                sample_logger.error("End of stream (or read error) reached at frame %02d.", fidx)
+                break
+
+            (fh, fw, ch) = frame.shape
+            if (frame_width, frame_height) != (fw, fh):
+                (frame_width, frame_height) = (fw, fh)
+                tracker.reinitFrameSize(frame_width, frame_height)
+
+            (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
+            logDetection(sample_logger, fidx, rejected, tl, bl, br, tr)
+            if not rejected:
+                return (fidx, frame, tl, bl, br, tr)
+    finally:
+        logFrameSourceStats(sample_logger, frames)
+        frames.release()
+    return None
+
+def findBestFrame(tracker, sample_video, window, sample_logger):
+    """
+    Tracker x str x int x Logger ---> tuple(fidx, frame, tl, bl, br, tr) or None
+    Score the detections in the first `window` frames of `sample_video` and
+    return the best one.
+    """
+    scored = scoreCandidates(scanCandidates(tracker, sample_video, window))
+    logCandidates(sample_logger, scored)
+    if not scored:
+        return None
+    best = scored[0][1]
+    with IndexedFrameSource(sample_video) as frames:
+        frame = frames.get(best.frame_id)
+    return (best.frame_id, frame, best.tl, best.bl, best.br, best.tr)
+
+def outputOptions(options):
+    """
+    Options which have an influence on the outputs of a sample.
+    """
+    return dict((k, options[k]) for k in ("selection", "window", "scan_chunk_size", "max_frames", "stats",
+                                            "png_compression"))
+
+def processSample(task):
+    """
+    Process a single sample directory and return a summary dictionary.
+    The sample is skipped if its outputs are up to date, unless
+    `options["force"]` is set.
+    Never raises: errors are reported in the summary.
+    """
+    (sample_dir, options) = task
+    sample_name = os.path.basename(os.path.normpath(sample_dir))
+    summary = {"sample": sample_name, "status": STATUS_ERROR,
+               "reference_frame_id": None, "duration": 0., "message": ""}
+    path_gt = os.path.join(sample_dir, IN_FILE_GROUND_TRUTH)
+    path_video = os.path.join(sample_dir, IN_FILE_VIDEO)
+
+    # Check outputs before anything else: the log file of an up to date
+    # sample must be kept.
+    t_start = time()
+    try:
+        manifest = buildManifest(sample_dir, {IN_FILE_GROUND_TRUTH: path_gt, IN_FILE_VIDEO: path_video},
+                                 _worker_tracker, outputOptions(options), PROG_NAME, PROG_VERSION)
+        (up_to_date, reason) = checkManifest(sample_dir, manifest)
+    except Exception as e:
+        summary["message"] = "%s: %s" % (e.__class__.__name__, e)
+        summary["duration"] = time() - t_start
+        return summary
+    if up_to_date and not options["force"]:
+        summary["status"] = STATUS_UP_TO_DATE
+        summary["reference_frame_id"] = loadManifest(sample_dir).get("reference_frame_id")
+        summary["duration"] = time() - t_start
+        return summary
+
+    sample_logger = logging.getLogger("%s.%s" % (__name__, sample_name))
+    fh = logging.FileHandler(os.path.join(sample_dir, OUT_FILE_LOG), mode="w")
+    fh.setLevel(logging.DEBUG)
+    fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    sample_logger.addHandler(fh)
+
+    try:
+        programHeader(sample_logger, PROG_NAME, PROG_VERSION)
+        sample_logger.info("Processing sample (%s).", "forced" if up_to_date else reason)
+        invalidateManifest(sample_dir)
+
+        sample_logger.debug("Configuring tracker with model '%s'", path_gt)
+        _worker_tracker.enableStats(options["stats"]) # reset statistics for each sample
+        _worker_tracker.reconfigureModel(path_gt)
+        gt_shape = readPngShape(path_gt) # no need to decode the (large) image
+
+        if options["selection"] == SELECTION_BEST:
+            detection = findBestFrame(_worker_tracker, path_video, options["window"], sample_logger)
+        else:
+            detection = findFirstAcceptedFrame(_worker_tracker, path_video, options["max_frames"],
+                                               options["prefetch"], sample_logger)
+        if detection is None:
+            summary["status"] = STATUS_NO_DETECTION
+            summary["message"] = "no valid frame"
+            sample_logger.error("No frame accepted by tracker, no output generated.")
+        else:
+            (fidx, frame, tl, bl, br, tr) = detection
+            logDetection(sample_logger, fidx, False, tl, bl, br, tr)
+            draw_mat = drawDetection(frame, False, tl, bl, br, tr)
+            tasks = saveReference(sample_dir, fidx, frame, draw_mat, tl, bl, br, tr, gt_shape, sample_logger,
+                                  band_rows=options["band_rows"], writer=_worker_writer)
+            summary["status"] = STATUS_OK
+            summary["reference_frame_id"] = fidx
+        if options["stats"]:
+            stats_task = saveStats(os.path.join(sample_dir, OUT_FILE_STATS), _worker_tracker, writer=_worker_writer)
+        if summary["status"] == STATUS_OK:
+            manifest["reference_frame_id"] = fidx
+            output_files = referenceOutputFiles(fidx)
+            if options["stats"]:
+                output_files.append(OUT_FILE_STATS)
+                tasks.append(stats_task)
+            _worker_writer.submit("manifest", saveManifest, (sample_dir, manifest, output_files), after=tasks)
+        # outputs must be complete before the sample is reported
+        _worker_writer.wait()
+        sample_logger.debug("Output files generated.")
+    except Exception as e:
+        summary["status"] = STATUS_ERROR
+        summary["message"] = "%s: %s" % (e.__class__.__name__, e)
+        sample_logger.error("Processing failed:\n%s", traceback.format_exc())
+        try:
+            _worker_writer.wait() # not to report the failures of this sample with the next one
+        except IOError:
+            pass
+    finally:
+        summary["duration"] = time() - t_start
+        sample_logger.removeHandler(fh)
+        fh.close()
+    return summary
+
+# ==============================================================================
+def logSummary(summaries, total_duration):
+    logger.info(DBGSEP)
+    logger.info("%-30s %-14s %6s %9s  %s", "sample", "status", "frame", "time (s)", "message")
+    for s in sorted(summaries, key=lambda s: s["sample"]):
+        frame = "-" if s["reference_frame_id"] is None else "%d" % s["reference_frame_id"]
+        logger.info("%-30s %-14s %6s %9.2f  %s", s["sample"], s["status"], frame, s["duration"], s["message"])
+    logger.info(DBGSEP)
+    durations = [s["duration"] for s in summaries]
+    num_ok = len([s for s in summaries if s["status"] in (STATUS_OK, STATUS_UP_TO_DATE)])
+    num_up_to_date = len([s for s in summaries if s["status"] == STATUS_UP_TO_DATE])
+    logger.info("%d/%d samples processed successfully (%d already up to date) in %.2fs "
+                "(per sample: mean %.2fs, max %.2fs).",
+                num_ok, len(summaries), num_up_to_date, total_duration,
+                np.mean(durations) if durations else 0.,
+                max(durations) if durations else 0.)
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Headless reference frame detection and extraction for every sample of a dataset.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-f', '--force',
+        action="store_true",
+        help="Process every sample, even those whose outputs are up to date.")
+
+    parser.add_argument('-j', '--jobs',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of worker processes.")
+
+    parser.add_argument('-s', '--selection',
+        choices=[SELECTION_BEST, SELECTION_FIRST],
+        default=SELECTION_BEST,
+        help="Reference frame selection: best scored frame among the first ones, or first accepted frame.")
+
+    parser.add_argument('-w', '--window',
+        type=int,
+        default=60,
+        help="Number of frames (from the beginning of each video) scored by the 'best' selection.")
+
+    parser.add_argument('-m', '--max-frames',
+        type=int,
+        default=0,
+        help="Maximum number of frames to read from each video with the 'first' selection (0: no limit).")
+
+    parser.add_argument('-t', '--tracker',
+        choices=TRACKER_NAMES,
+        default=DEFAULT_TRACKER,
+        help="Tracker used to detect the document in frames.")
+
+    parser.add_argument('--model-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept for each ground truth image, spread over the whole image (0: no limit).")
+
+    parser.add_argument('--frame-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept per frame, spread over the whole frame (0: no limit).")
+
+    parser.add_argument('-e', '--estimator',
+        choices=ESTIMATOR_NAMES,
+        default=DEFAULT_ESTIMATOR,
+        help="Robust homography estimator: OpenCV's RANSAC (ransac_cv) or LMEDS (lmeds), or RANSAC with adaptive iteration count and the homography of the previous frame as first hypothesis (ransac), with PROSAC-like sampling of the best matches first (prosac).")
+
+    parser.add_argument('--stats',
+        action="store_true",
+        help="Collect per-stage timings and per-frame counters, and save them to a JSON report in each sample directory.")
+
+    parser.add_argument('--prefetch',
+        type=int,
+        default=4,
+        help="Number of frames decoded in advance by a background thread (0 disables prefetching).")
+
+    parser.add_argument('--png-compression',
+        type=int,
+        choices=range(10),
+        default=DEFAULT_PNG_COMPRESSION,
+        help="zlib compression level of output PNG images, from 0 (fastest, largest files) to 9 (slowest, smallest files).")
+
+    parser.add_argument('--writer-threads',
+        type=int,
+        default=DEFAULT_NUM_THREADS,
+        help="Number of background threads writing output files, in each worker process (0 writes them in the worker thread).")
+
+    parser.add_argument('--band-rows',
+        type=int,
+        default=defaultBandRows(),
+        help="Height of the bands by which reference frames are dewarped and written, to bound the memory used by each worker (0: whole frames at once; the default is 0 if bands do not reproduce cv2.warpPerspective exactly with this version of OpenCV).")
+
+    parser.add_argument('--model-cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help="Directory where the features extracted from ground truth images are cached.")
+
+    parser.add_argument('--model-cache-size',
+        type=int,
+        default=DEFAULT_MAX_SIZE / 1024**2,
+        help="Maximum size of the model feature cache, in MiB.")
+
+    parser.add_argument('--no-model-cache',
+        action="store_true",
+        help="Do not use (nor populate) the model feature cache.")
+
+    parser.add_argument('dataset_root',
+        action=StoreValidDirPath,
+        help="Path to the dataset root, containing one directory per sample (with 'ground-truth.png' and 'input.mp4' files).")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    samples = listSamples(args.dataset_root)
+    logger.info("Found %d samples under '%s'.", len(samples), args.dataset_root)
+    if not samples:
+        return 1
+
+    # Let's go
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    # --------------------------------------------------------------------------
+    t_start = time()
+    options = {"selection": args.selection,
+               "window": args.window,
+               "scan_chunk_size": DEFAULT_SCAN_CHUNK_SIZE,
+               "max_frames": args.max_frames,
+               "prefetch": args.prefetch,
+               "stats": args.stats,
+               "png_compression": args.png_compression,
+               "band_rows": args.band_rows, # same outputs whatever the band height
+               "force": args.force}
+    tasks = [(sample_dir, options) for sample_dir in samples]
+    pool = multiprocessing.Pool(processes=max(1, args.jobs),
+                                initializer=_initWorker,
+                                initargs=(args.tracker,
+                                          None if args.no_model_cache else args.model_cache_dir,
+                                          args.model_cache_size * 1024**2,
+                                          (args.model_keypoints, args.frame_keypoints),
+                                          args.estimator,
+                                          (args.writer_threads, args.png_compression)))
+    summaries = []
+    try:
+        for summary in pool.imap_unordered(processSample, tasks):
+            summaries.append(summary)
+            logger.info("[%3d/%3d] %-30s %-14s (%.2fs)",
+                        len(summaries), len(tasks), summary["sample"], summary["status"], summary["duration"])
+        pool.close()
+    except KeyboardInterrupt:
+        logger.error("Interrupted by user.")
+        pool.terminate()
+    pool.join()
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+    logSummary(summaries, time() - t_start)
+
+    if len([s for s in summaries if s["status"] not in (STATUS_OK, STATUS_UP_TO_DATE)]) > 0:
+        return 2
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)
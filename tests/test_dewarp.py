@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The banded dewarp of utils/dewarp.py must give exactly the same image as a
+single call to `cv2.warpPerspective`. `warpMaps` reproduces the fixed-point maps
+of OpenCV 2.4: the tests of `dewarpBands` are skipped with other versions, for
+which `dewarpToPng` must fall back to a single call.
+
+Run from the repository root with:
+python -m unittest discover tests
+"""
+
+# ==============================================================================
+# Imports
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.dewarp import dewarpBands, dewarpToPng, bandsAreExact
+
+# ==============================================================================
+# Output shape which neither the bands (of 64 rows) nor the blocks of
+# cv::warpPerspective divide evenly.
+TARGET_SHAPE = (333, 251, 3)
+BAND_ROWS = 64
+
+def randomFrame(rng, shape=(240, 320, 3)):
+    return rng.randint(0, 256, shape).astype(np.uint8)
+
+def randomHomography(rng, frame_shape, target_shape):
+    """
+    Frame -> target homography of a random convex quad of the frame (with a
+    strong perspective) onto the whole target.
+    """
+    (fh, fw) = frame_shape[:2]
+    (th, tw) = target_shape[:2]
+    quad = np.float32([[0.05, 0.10], [0.15, 0.90], [0.95, 0.75], [0.80, 0.05]])
+    quad += np.float32(rng.uniform(-0.04, 0.04, (4, 2)))
+    quad *= np.float32([fw, fh])
+    target = np.float32([[0, 0], [0, th - 1], [tw - 1, th - 1], [tw - 1, 0]])
+    return cv2.getPerspectiveTransform(quad, target)
+
+def warpPerspective(frame, trans, target_shape):
+    return cv2.warpPerspective(frame, trans, (target_shape[1], target_shape[0]))
+
+# ==============================================================================
+@unittest.skipUnless(bandsAreExact(), "warpMaps does not reproduce cv2.warpPerspective of OpenCV %s" % cv2.__version__)
+class DewarpBandsTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def testBandsMatchWarpPerspective(self):
+        for _ in range(5):
+            frame = randomFrame(self.rng)
+            trans = randomHomography(self.rng, frame.shape, TARGET_SHAPE)
+            bands = list(dewarpBands(frame, trans, TARGET_SHAPE, BAND_ROWS))
+            self.assertEqual([b.shape[0] for b in bands], [64, 64, 64, 64, 64, 13])
+            self.assertTrue(np.array_equal(np.vstack(bands), warpPerspective(frame, trans, TARGET_SHAPE)))
+
+    def testBandBoundaries(self):
+        # bands of 1 row, and bands larger than the image
+        frame = randomFrame(self.rng)
+        trans = randomHomography(self.rng, frame.shape, TARGET_SHAPE)
+        expected = warpPerspective(frame, trans, TARGET_SHAPE)
+        for band_rows in (1, 7, TARGET_SHAPE[0], 1000):
+            bands = np.vstack(list(dewarpBands(frame, trans, TARGET_SHAPE, band_rows)))
+            self.assertTrue(np.array_equal(bands, expected), "band_rows=%d" % band_rows)
+
+    def testOutsideOfFrame(self):
+        # target pixels which map outside of the frame are black
+        frame = randomFrame(self.rng)
+        trans = np.float64([[1.3, 0.1, -90.], [-0.05, 1.2, -60.], [0.0004, -0.0006, 1.]])
+        bands = np.vstack(list(dewarpBands(frame, trans, TARGET_SHAPE, BAND_ROWS)))
+        self.assertTrue(np.array_equal(bands, warpPerspective(frame, trans, TARGET_SHAPE)))
+
+    def testGrayLevelFrame(self):
+        frame = randomFrame(self.rng, (240, 320))
+        trans = randomHomography(self.rng, frame.shape, TARGET_SHAPE)
+        bands = np.vstack(list(dewarpBands(frame, trans, TARGET_SHAPE[:2], BAND_ROWS)))
+        self.assertTrue(np.array_equal(bands, warpPerspective(frame, trans, TARGET_SHAPE)))
+
+class DewarpToPngTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.tmp_dir = tempfile.mkdtemp(prefix="test_dewarp")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _checkDewarpToPng(self, band_rows):
+        # path used by `saveReference`, with two frames sharing the same transform
+        frames = [randomFrame(self.rng), randomFrame(self.rng), randomFrame(self.rng)]
+        transforms = [randomHomography(self.rng, frames[0].shape, TARGET_SHAPE)] * 2
+        transforms.append(randomHomography(self.rng, frames[0].shape, TARGET_SHAPE))
+        paths = [os.path.join(self.tmp_dir, "dewarped_%d.png" % k) for k in range(len(frames))]
+        dewarpToPng(frames, transforms, TARGET_SHAPE, paths, band_rows)
+        for (frame, trans, path) in zip(frames, transforms, paths):
+            self.assertTrue(np.array_equal(cv2.imread(path), warpPerspective(frame, trans, TARGET_SHAPE)))
+
+    def testSingleCall(self):
+        self._checkDewarpToPng(None)
+
+    def testBands(self):
+        self._checkDewarpToPng(BAND_ROWS)
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The array-based ratio test and point gathering of trackers/Matchers.py (see
+AbstractPOITracker._searchFullFrame) must keep exactly the same points as the
+former implementation, which worked on DMatch and KeyPoint objects.
+
+Run from the repository root with:
+python -m unittest discover tests
+"""
+
+# ==============================================================================
+# Imports
+import unittest
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+from trackers.Matchers import *
+
+# ==============================================================================
+SECOND_MATCH_TRESH = 0.75
+
+def filterObjects(knn_matches, keypoints, mdl_keyp, ratio=SECOND_MATCH_TRESH):
+    """
+    Former implementation: ratio test and gathering on DMatch and KeyPoint
+    objects. Return tuple(model points, frame points).
+    """
+    matches = [m[0] for m in knn_matches if len(m) >= 2 and m[0].distance < m[1].distance * ratio]
+    pt00 = [mdl_keyp[m.trainIdx].pt for m in matches]
+    pt10 = [keypoints[m.queryIdx].pt for m in matches]
+    if not matches:
+        return (np.zeros((0, 2), np.float32), np.zeros((0, 2), np.float32))
+    pt0, pt1 = np.float32((pt00, pt10)).reshape(2, -1, 2)
+    return (pt0, pt1)
+
+def filterArrays(knn, keypoints, mdl_pts, ratio=SECOND_MATCH_TRESH):
+    """
+    Current implementation. Return tuple(model points, frame points).
+    """
+    matches = ratioTest(knn, ratio)
+    return (mdl_pts[matches["train_idx"]], keypointsToPoints(keypoints)[matches["query_idx"]])
+
+def randomKeypoints(rng, num):
+    return [cv2.KeyPoint(float(x), float(y), 4.) for (x, y) in rng.uniform(0, 640, (num, 2))]
+
+# ==============================================================================
+class MatchFilteringTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        self.keypoints = randomKeypoints(self.rng, 50)
+        self.mdl_keyp = randomKeypoints(self.rng, 40)
+        self.mdl_pts = keypointsToPoints(self.mdl_keyp)
+
+    def _checkSamePoints(self, knn_matches):
+        expected = filterObjects(knn_matches, self.keypoints, self.mdl_keyp)
+        got = filterArrays(knnMatchesToArray(knn_matches), self.keypoints, self.mdl_pts)
+        for (e, g) in zip(expected, got):
+            self.assertEqual(g.dtype, np.float32)
+            self.assertEqual(g.shape, e.shape)
+            self.assertTrue(np.array_equal(g, e))
+        return got
+
+    def testEmptyMatches(self):
+        (pt0, pt1) = self._checkSamePoints([])
+        self.assertEqual(len(pt0), 0)
+        # nothing passes the ratio test
+        self._checkSamePoints([[cv2.DMatch(0, 0, 1.), cv2.DMatch(0, 1, 1.)]])
+        # no train descriptor
+        matcher = createBruteForceMatcher()
+        self.assertEqual(len(knnMatchArray(matcher, np.float32(self.rng.rand(5, 8)))), 0)
+
+    def testLessThanTwoNeighbours(self):
+        knn_matches = [[cv2.DMatch(0, 3, 1.)],
+                       [],
+                       [cv2.DMatch(2, 5, 1.), cv2.DMatch(2, 6, 4.)],
+                       [cv2.DMatch(3, 7, 1.)]]
+        (pt0, pt1) = self._checkSamePoints(knn_matches)
+        self.assertEqual(len(pt0), 1)
+        # a single train descriptor: nobody has a second neighbour
+        matcher = createBruteForceMatcher()
+        matcher.add([np.float32(self.rng.rand(1, 8))])
+        self.assertEqual(len(knnMatchArray(matcher, np.float32(self.rng.rand(5, 8)))), 0)
+
+    def testTiesOnRatioThreshold(self):
+        # distances are float32 in DMatch objects: test values around the
+        # threshold, in single precision
+        knn_matches = []
+        for (qidx, d2) in enumerate(np.float32(self.rng.uniform(50, 500, 16))):
+            d1 = np.float32(d2 * SECOND_MATCH_TRESH)
+            for (k, d) in enumerate((np.nextafter(d1, np.float32(0)), d1, np.nextafter(d1, np.float32(1e9)))):
+                knn_matches.append([cv2.DMatch(qidx, 3 * (qidx % 10) + k, float(d)),
+                                    cv2.DMatch(qidx, 39, float(d2))])
+        knn_matches.append([cv2.DMatch(0, 1, 3.), cv2.DMatch(0, 2, 4.)]) # 3 == 4 * 0.75
+        (pt0, pt1) = self._checkSamePoints(knn_matches)
+        self.assertTrue(0 < len(pt0) < len(knn_matches))
+
+    def testDuplicateTrainIndices(self):
+        # several frame points matched to the same model point are all kept
+        knn_matches = [[cv2.DMatch(qidx, 7, 1.), cv2.DMatch(qidx, 8, 10.)] for qidx in range(10)]
+        (pt0, pt1) = self._checkSamePoints(knn_matches)
+        self.assertEqual(len(pt0), 10)
+        self.assertTrue(np.array_equal(pt0, np.repeat(self.mdl_pts[7:8], 10, axis=0)))
+
+    def testBruteForceMatcher(self):
+        # same matches as cv2.BFMatcher, with one and several train images,
+        # including duplicated train descriptors
+        query = np.float32(self.rng.rand(50, 16))
+        train = np.float32(self.rng.rand(40, 16))
+        train[20:30] = train[10:20]
+        for train_desc in ([train], [train[:25], train[25:]]):
+            cv_matcher = cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
+            matcher = createBruteForceMatcher()
+            for m in (cv_matcher, matcher):
+                m.add(train_desc)
+                m.train()
+            expected = knnMatchesToArray(cv_matcher.knnMatch(query, k=2))
+            got = knnMatchArray(matcher, query)
+            for field in ("query_idx", "img_idx", "distance", "distance2"):
+                self.assertTrue(np.array_equal(got[field], expected[field]), field)
+            # duplicated descriptors may be reported in any order
+            offsets = np.cumsum([0] + [len(d) for d in train_desc])
+            (got_idx, expected_idx) = (got["train_idx"] + offsets[got["img_idx"]],
+                                       expected["train_idx"] + offsets[expected["img_idx"]])
+            self.assertTrue(np.array_equal(train[got_idx], train[expected_idx]))
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 full-video tracking tool.
+(c) 2017 L3i - Univ. La Rochelle
+    joseph (dot) chazalon (at) univ-lr (dot) fr
+
+Runs the tracker over every frame of a video and streams the results to a
+trajectory file (see utils/trajectory.py for the format).
+
+Sample usage:
+python track_video.py -d \
+  /path/to/dataset/sample01/ground-truth.png \
+  /path/to/dataset/sample01/input.mp4 \
+  /path/to/dataset/sample01/trajectory.traj
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import os
+import os.path
+import sys
+from time import time
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+from utils.reference import *
+from utils.frames import *
+from utils.trajectory import *
+
+from trackers import TRACKER_NAMES, DEFAULT_TRACKER, createTracker
+from trackers.Estimators import ESTIMATOR_NAMES, DEFAULT_ESTIMATOR
+from trackers.DescriptorCache import DescriptorCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_NAME = "SmartDoc17 Video Tracker"
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Track the document in every frame of a video and save the trajectory.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-t', '--tracker',
+        choices=TRACKER_NAMES,
+        default=DEFAULT_TRACKER,
+        help="Tracker used to detect the document in frames.")
+
+    parser.add_argument('--incremental',
+        action="store_true",
+        help="Search the document only around its previous position when the previous frame was accepted.")
+
+    parser.add_argument('--coarse-to-fine',
+        action="store_true",
+        help="Detect the document in reduced frames first, then refine its corners at full resolution (faster on large frames).")
+
+    parser.add_argument('--model-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept for the ground truth image, spread over the whole image (0: no limit).")
+
+    parser.add_argument('--frame-keypoints',
+        type=int,
+        default=0,
+        help="Maximum number of keypoints kept per frame, spread over the whole frame (0: no limit).")
+
+    parser.add_argument('-e', '--estimator',
+        choices=ESTIMATOR_NAMES,
+        default=DEFAULT_ESTIMATOR,
+        help="Robust homography estimator: OpenCV's RANSAC (ransac_cv) or LMEDS (lmeds), or RANSAC with adaptive iteration count and the homography of the previous frame as first hypothesis (ransac), with PROSAC-like sampling of the best matches first (prosac).")
+
+    parser.add_argument('--stats',
+        action="store_true",
+        help="Collect per-stage timings and per-frame counters, and save them to a JSON report next to the trajectory file.")
+
+    parser.add_argument('--prefetch',
+        type=int,
+        default=4,
+        help="Number of frames decoded in advance by a background thread (0 disables prefetching).")
+
+    parser.add_argument('--model-cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help="Directory where the features extracted from ground truth images are cached.")
+
+    parser.add_argument('--model-cache-size',
+        type=int,
+        default=DEFAULT_MAX_SIZE / 1024**2,
+        help="Maximum size of the model feature cache, in MiB.")
+
+    parser.add_argument('--no-model-cache',
+        action="store_true",
+        help="Do not use (nor populate) the model feature cache.")
+
+    parser.add_argument('ground_truth_image',
+        action=StoreValidFilePath,
+        help="Path to ground truth image which will be used to detect document region in frames.")
+
+    parser.add_argument('sample_video',
+        action=StoreValidFilePath,
+        help='Path to video input sample in which the document will be tracked.')
+
+    parser.add_argument('output_file',
+        help="Path to the trajectory file to generate (overwritten if it exists).")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    # Load and initialize tracker
+    logger.debug("Creating tracker...")
+    tracker = createTracker(args.tracker)
+    tracker.setIncremental(args.incremental)
+    tracker.setCoarseToFine(args.coarse_to_fine)
+    tracker.setKeypointBudget(args.model_keypoints, args.frame_keypoints)
+    tracker.setEstimator(args.estimator)
+    tracker.enableStats(args.stats)
+    if not args.no_model_cache:
+        tracker.setModelCache(DescriptorCache(args.model_cache_dir, args.model_cache_size * 1024**2))
+    logger.debug("Tracker created.")
+
+    logger.debug("Configuring tracker with model '%s'", args.ground_truth_image)
+    tracker.reconfigureModel(args.ground_truth_image)
+    logger.debug("Tracker model configuration complete.")
+
+    # Let's go
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    # --------------------------------------------------------------------------
+    metadata = {"program": PROG_NAME,
+                "version": PROG_VERSION,
+                "tracker": tracker.getName(),
+                "incremental": args.incremental,
+                "coarse_to_fine": args.coarse_to_fine,
+                "model_keypoints": args.model_keypoints,
+                "frame_keypoints": args.frame_keypoints,
+                "estimator": args.estimator,
+                "ground_truth_image": os.path.abspath(args.ground_truth_image),
+                "sample_video": os.path.abspath(args.sample_video)}
+
+    frames = openFrameSource(args.sample_video, args.prefetch)
+    writer = TrajectoryWriter(args.output_file, metadata)
+    (frame_width, frame_height) = (None, None)
+    fidx = -1
+    num_accepted = 0
+    t_start = time()
+    try:
+        while True:
+            with tracker.stats.timer("decode"):
+                can_read_frame, frame = frames.read()
+            if not can_read_frame:
+                break
+            fidx += 1
+
+            (fh, fw, ch) = frame.shape
+            if (frame_width, frame_height) != (fw, fh):
+                (frame_width, frame_height) = (fw, fh)
+                logger.debug("Reinitializing tracker with frame size (w=%.3f; h=%.3f)" % (fw, fh))
+                tracker.reinitFrameSize(frame_width, frame_height)
+
+            t_frame = time()
+            (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
+            t_frame = time() - t_frame
+
+            writer.append(fidx, not rejected, (tl, bl, br, tr),
+                          tracker.getFrameInfo().get("num_inliers", 0), t_frame)
+            if not rejected:
+                num_accepted += 1
+            logger.debug("frame %04d: %s (%.1f ms)", fidx, "R" if rejected else "A", 1000 * t_frame)
+    finally:
+        writer.close()
+        logFrameSourceStats(logger, frames)
+        frames.release()
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+    duration = time() - t_start
+    num_frames = fidx + 1
+    logger.info("%d frames processed in %.2fs (%.2f fps), %d accepted (%.1f%%).",
+                num_frames, duration, num_frames / duration if duration > 0 else 0.,
+                num_accepted, 100. * num_accepted / num_frames if num_frames else 0.)
+    logger.info("Trajectory saved to %s", args.output_file)
+    if args.stats:
+        saveStats(os.path.splitext(args.output_file)[0] + "_stats.json", tracker, frames, logger)
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)
@@ -4,8 +4,13 @@
 # ==============================================================================
 # Imports
 import logging
+from collections import namedtuple
+from time import time
 
 from Tracker import *
+from Matchers import knnMatchArray, ratioTest, keypointsToPoints
+from KeypointBudget import applyBudget, DEFAULT_GRID_SIZE
+from Estimators import createEstimator, DEFAULT_ESTIMATOR, DEFAULT_REPROJ_THRESHOLD
 from utils.log import *
 
 import cv2
@@ -15,13 +20,20 @@ import numpy as np
 logger = logging.getLogger(__name__)
 initLogger(logger, debug=True)
 
+# ==============================================================================
+# Features of a model image (after pyramid reduction)
+Model = namedtuple("Model", ["path", "desc", "pts", "quad"])
+
 # ==============================================================================
 class AbstractPOITracker(Tracker):
     def __init__(self, detector, matcher,
                  num_pyrdown_model=0,
                  num_pyrdown_frames=0,
                  num_of_matches=15,
-                 second_match_tresh=0.75):
+                 second_match_tresh=0.75,
+                 detector_params=None,
+                 incremental=False,
+                 roi_margin=0.25):
         super(AbstractPOITracker, self).__init__(
                 num_pyrdown_model=num_pyrdown_model,
                 num_pyrdown_frames=num_pyrdown_frames)
@@ -30,62 +42,600 @@ class AbstractPOITracker(Tracker):
         self.matcher = matcher
         self.num_of_matches = num_of_matches
         self.second_match_tresh = second_match_tresh
+        self.detector_params = detector_params if detector_params is not None else {}
+        self.model_cache = None
+        self.setIncremental(incremental, roi_margin)
+        self.setCoarseToFine(False)
+        self.setKeypointBudget(0, 0)
+        self.setEstimator(DEFAULT_ESTIMATOR)
 
-    def reconfigureModel(self, tracker_model):
-        # Clears the train descriptor collection.
-        self.matcher.clear()
+        self.models = []
+        self._prevH = None # model -> (reduced) frame homography of the last accepted frame
+        self._inliers = None # (model points, frame points) of the last homography estimated
+        self._prevModelId = None # index of the model found in the last accepted frame
+
+    def setIncremental(self, incremental, roi_margin=0.25):
+        """
+        AbstractPOITracker x bool x float ---> None
+        In incremental mode, when the previous frame was accepted, features are
+        only detected within the bounding box of the previous detection, dilated
+        by `roi_margin` times its largest side, and only matched against the
+        model features expected to be visible in this region. A full frame
+        search is performed if this fails.
+        """
+        self.incremental = incremental
+        self.roi_margin = roi_margin
+
+    def setCoarseToFine(self, coarse_to_fine, min_coarse_doc_side=256, max_coarse_levels=3, refine_window=0.25):
+        """
+        AbstractPOITracker x bool x int x int x float ---> None
+        In coarse-to-fine mode, full frame searches first estimate the
+        homography on a reduced frame, then refine it at the base resolution
+        with the features found in windows around the 4 predicted corners (of
+        half side `refine_window` times the largest side of the document),
+        matched against the model features expected in these windows only.
+        Coarse inliers are only used along with these matches when less than 3
+        corners have enough of them, to keep the estimation well conditioned.
+        The number of extra pyramid levels is chosen for each frame, as the
+        largest one (at most `max_coarse_levels`) for which the document still
+        spans `min_coarse_doc_side` pixels, according to the previous
+        detection, or assuming it fills the frame.
+        A plain full frame search is performed if the coarse search fails.
+        """
+        self.coarse_to_fine = coarse_to_fine
+        self.min_coarse_doc_side = min_coarse_doc_side
+        self.max_coarse_levels = max_coarse_levels
+        self.refine_window = refine_window
+
+    def setKeypointBudget(self, model_budget, frame_budget, grid_size=DEFAULT_GRID_SIZE):
+        """
+        AbstractPOITracker x int x int x int ---> None
+        Keep at most `model_budget` keypoints for each model, and at most
+        `frame_budget` keypoints per frame (0: no limit), spread over a grid of
+        `grid_size` buckets along the largest side of the image, the strongest
+        ones in each bucket (see `KeypointBudget.bucketedSelection`).
+        When features are only detected in a part of the frame (incremental and
+        coarse-to-fine modes), the frame budget is reduced in proportion to its
+        area.
+        Must be called before `reconfigureModel` for the model budget to apply.
+        """
+        self.model_keypoint_budget = model_budget
+        self.frame_keypoint_budget = frame_budget
+        self.budget_grid_size = grid_size
+
+    def setEstimator(self, estimator_name, threshold=DEFAULT_REPROJ_THRESHOLD):
+        """
+        AbstractPOITracker x str x float ---> None
+        Select the robust estimator of homographies (see
+        `Estimators.ESTIMATOR_FACTORIES`), with an inlier threshold of
+        `threshold` pixels (in the reduced frame). Matches are given to it with
+        their ratio test score, and along with the homography of the previous
+        frame (if the same model was found there) as prior.
+        """
+        self.estimator_name = estimator_name
+        self.estimator = createEstimator(estimator_name, threshold)
+
+    def getParams(self):
+        return {"detector": self.detector_params,
+                "num_pyrdown_model": self._num_pyrdown_model,
+                "num_pyrdown_frames": self._num_pyrdown_frames,
+                "num_of_matches": self.num_of_matches,
+                "second_match_tresh": self.second_match_tresh,
+                "incremental": self.incremental,
+                "roi_margin": self.roi_margin,
+                "coarse_to_fine": self.coarse_to_fine,
+                "min_coarse_doc_side": self.min_coarse_doc_side,
+                "max_coarse_levels": self.max_coarse_levels,
+                "refine_window": self.refine_window,
+                "model_keypoint_budget": self.model_keypoint_budget,
+                "frame_keypoint_budget": self.frame_keypoint_budget,
+                "budget_grid_size": self.budget_grid_size,
+                "estimator": dict(self.estimator.getParams(), name=self.estimator_name)}
+
+    def setParams(self, params):
+        """
+        AbstractPOITracker x dict ---> None
+        Apply the search modes, keypoint budget and estimator of `params` (see
+        `getParams`). Other parameters are set by the constructor of each
+        tracker class. Must be called before `reconfigureModel`.
+        """
+        self.setIncremental(params["incremental"], params["roi_margin"])
+        self.setCoarseToFine(params["coarse_to_fine"], params["min_coarse_doc_side"], params["max_coarse_levels"],
+                             params["refine_window"])
+        self.setKeypointBudget(params["model_keypoint_budget"], params["frame_keypoint_budget"],
+                               params["budget_grid_size"])
+        self.setEstimator(params["estimator"]["name"], params["estimator"]["threshold"])
+
+    def setModelCache(self, model_cache):
+        """
+        AbstractPOITracker x DescriptorCache ---> None
+        Use `model_cache` to store and reuse the features extracted from models.
+        None disables the cache.
+        """
+        self.model_cache = model_cache
+
+    def _modelExtractionParams(self):
+        """
+        Return everything which has an influence on the features extracted from
+        a model image, used as cache key along with the image content.
+        Trackers whose detector parameters give its type (like the SIFT-based
+        ones) share their cache entries, other ones only with trackers of the
+        same class.
+        """
+        params = {"detector": self.detector_params,
+                  "num_pyrdown_model": self._num_pyrdown_model}
+        if "type" not in self.detector_params:
+            params["tracker"] = self.__class__.__name__
+        if self.model_keypoint_budget > 0:
+            params["keypoint_budget"] = self.model_keypoint_budget
+            params["budget_grid_size"] = self.budget_grid_size
+        return params
+
+    def _extractModelFeatures(self, tracker_model):
+        """
+        Return a tuple(points, descriptors, shape) for the model image (after
+        pyramid reduction), using the model cache if possible: the coordinates
+        of the keypoints (see `keypointsToPoints`) are all the trackers need, so
+        no KeyPoint object is created when features are loaded from cache.
+        """
+        cache_key = None
+        if self.model_cache is not None:
+            cache_key = self.model_cache.key(tracker_model, self._modelExtractionParams())
+            cached = self.model_cache.load(cache_key)
+            if cached is not None:
+                logger.debug("Model features loaded from cache (key=%s).", cache_key)
+                (Ckeyp, Cdesc, Cshape) = cached
+                return (np.array(Ckeyp["pt"], np.float32).reshape(-1, 2), Cdesc, Cshape)
 
         Cimg = cv2.imread(tracker_model)
         Cimg = self._autoPyrDownModel(Cimg)
         Cgray = cv2.cvtColor(Cimg, cv2.COLOR_BGR2GRAY)
-        (xmax, ymax) = (Cimg.shape[1], Cimg.shape[0])
-        tl = (1, 1)
-        bl = (1, ymax)
-        br = (xmax, ymax)
-        tr = (xmax, 1)
-        self.mdl_quad = np.float32([tl, bl, br, tr])
-        # print Cquad
         (Ckeyp,Cdesc) = self.detector.detectAndCompute(Cgray,None)
+        if self.model_keypoint_budget > 0:
+            num_detected = len(Ckeyp)
+            (Ckeyp, Cdesc) = applyBudget(Ckeyp, Cdesc, Cgray.shape, self.model_keypoint_budget, self.budget_grid_size)
+            logger.debug("Model keypoint budget: %d keypoints kept out of %d.", len(Ckeyp), num_detected)
+
+        if self.model_cache is not None:
+            self.model_cache.store(cache_key, Ckeyp, Cdesc, Cimg.shape)
+            logger.debug("Model features stored in cache (key=%s).", cache_key)
+        return (keypointsToPoints(Ckeyp), Cdesc, Cimg.shape)
+
+    def reconfigureModel(self, tracker_model):
+        self.reconfigureModels([tracker_model])
+
+    def reconfigureModels(self, tracker_models):
+        """
+        AbstractPOITracker x list(str) ---> None
+        The descriptors of all models are added to the same matcher, each set
+        being tagged by its model index (`DMatch.imgIdx`), so that each frame
+        is matched only once whatever the number of models.
+        """
+        # Clears the train descriptor collection.
+        self.matcher.clear()
+
+        self.models = []
+        for tracker_model in tracker_models:
+            with self.stats.timer("model_features"):
+                (Cpts, Cdesc, Cshape) = self._extractModelFeatures(tracker_model)
+            (xmax, ymax) = (Cshape[1], Cshape[0])
+            tl = (1, 1)
+            bl = (1, ymax)
+            br = (xmax, ymax)
+            tr = (xmax, 1)
+            self.models.append(Model(path=tracker_model,
+                                     desc=Cdesc,
+                                     pts=Cpts,
+                                     quad=np.float32([tl, bl, br, tr])))
         # self.matcher.add(np.uint8([Cdesc]))
-        self.matcher.add([Cdesc])
-        self.mdl_keyp = Ckeyp
+        self.matcher.add([m.desc for m in self.models])
+        # Build the matcher index (if any) once, instead of lazily on first frame.
+        with self.stats.timer("matcher_train"):
+            self.matcher.train()
+        self._prevH = None
+        self._prevModelId = None
+
+    def modelCorners(self, model_id=0):
+        """
+        AbstractPOITracker x int ---> ndarray
+        Return the (tl, bl, br, tr) corners of model `model_id` whose projection
+        `processFrame` reports, in the coordinates of the full size model image
+        (4x2 float32 array).
+        """
+        return self.models[model_id].quad * np.float32(2**self._num_pyrdown_model)
+
+    def reinitFrameSize(self, frame_width, frame_height):
+        super(AbstractPOITracker, self).reinitFrameSize(frame_width, frame_height)
+        self._prevH = None
+        # a new sequence starts from the same random state, whatever was processed before
+        self.setEstimator(self.estimator_name, self.estimator.threshold)
+
+    def _resetFrameInfo(self, roi_search):
+        self._frameInfo = {"roi_search": roi_search,
+                           "num_keypoints": 0,
+                           "num_matches": 0,
+                           "num_inliers": 0}
+
+    def _reject(self, reason, msg, *args):
+        """
+        Log the reason why the current search failed, and count it.
+        """
+        if self._frameInfo.get("roi_search"):
+            reason = "roi_" + reason
+        self._frameInfo["rejection"] = reason
+        self.stats.reject(reason)
+        logger.debug("R: " + msg, *args)
+
+    def _ratioTest(self, knn_matches):
+        """
+        Return the matches of `knn_matches` (see `knnMatchArray`) which pass
+        the ratio test.
+        """
+        with self.stats.timer("ratio_test"):
+            return ratioTest(knn_matches, self.second_match_tresh)
+
+    def _detectAndCompute(self, gray, roi=None, timer="detect_and_compute"):
+        """
+        Detect and describe the features of `gray`, or of its region `roi`
+        (tuple(x0, y0, x1, y1)), within the frame keypoint budget (see
+        `setKeypointBudget`). Return tuple(keypoints, descriptors); keypoint
+        coordinates are relative to the region.
+        """
+        budget = self.frame_keypoint_budget
+        if roi is not None:
+            (x0, y0, x1, y1) = roi
+            if budget > 0:
+                area_ratio = float((x1 - x0) * (y1 - y0)) / (gray.shape[0] * gray.shape[1])
+                budget = max(1, int(round(budget * area_ratio)))
+            gray = gray[y0:y1, x0:x1]
+        with self.stats.timer(timer):
+            (keypoints,descriptors) = self.detector.detectAndCompute(gray, None)
+        if budget > 0:
+            self.stats.observe("num_keypoints_detected", len(keypoints))
+            with self.stats.timer("keypoint_budget"):
+                (keypoints, descriptors) = applyBudget(keypoints, descriptors, gray.shape,
+                                                       budget, self.budget_grid_size)
+        return (keypoints, descriptors)
+
+    def _prior(self, model_id, scale=1.):
+        """
+        Return the homography of model `model_id` in the previous frame (if it
+        was found there), for an image `scale` times the size of the (reduced)
+        frame, or None.
+        """
+        if self._prevH is None or self._prevModelId != model_id:
+            return None
+        return np.dot(np.diag([scale, scale, 1.]), self._prevH)
+
+    def _fitHomography(self, pt0, pt1, scores=None, prior=None):
+        """
+        Estimate the model -> frame homography from the matched model points
+        `pt0` and frame points `pt1`. `scores` (lower is better) and `prior` are
+        passed to the estimator (see `setEstimator`).
+        Only the cost of the estimation (time, iterations) is recorded here.
+        Return a dict describing its outcome, to be recorded by `_recordFit`:
+        "H" (None if rejected), "num_inliers" (None if estimation failed),
+        "rejection" (tuple(reason, msg, msg_args), or None), and, if accepted,
+        "reproj_error" and "inliers".
+        """
+        t0 = time()
+        with self.stats.timer("find_homography"):
+            (H, s, info) = self.estimator.estimate(pt0, pt1, scores, prior)
+        # a frame may need several estimations: times and iterations add up
+        self._frameInfo["estimation_time"] = self._frameInfo.get("estimation_time", 0.) + time() - t0
+        if "iterations" in info:
+            self._frameInfo["estimator_iterations"] = self._frameInfo.get("estimator_iterations", 0) + info["iterations"]
+            self.stats.observe("estimator_iterations", info["iterations"])
+        if info.get("prior_used"):
+            self.stats.count("estimator_prior_used")
+        if H is None:
+            return {"H": None, "num_inliers": None,
+                    "rejection": ("no_homography", "homography estimation failed (%d matches)", (len(pt0),))}
+
+        s = s.ravel() != 0
+        # print s.sum()
+        num_inliers = int(s.sum())
+        if num_inliers < self.num_of_matches:
+            return {"H": None, "num_inliers": num_inliers,
+                    "rejection": ("few_inliers", "not enough RANSAC inliers (%d < %d, got %d matches before)",
+                                  (num_inliers, self.num_of_matches, len(pt0)))}
+
+        # mean reprojection error of inliers, in full resolution frame pixels
+        proj = cv2.perspectiveTransform(pt0[s].reshape(1, -1, 2), H).reshape(-1, 2)
+        err = np.sqrt(((proj - pt1[s])**2).sum(axis=1)).mean()
+        return {"H": H, "num_inliers": num_inliers, "rejection": None,
+                "reproj_error": float(self._scaleCoord(err)), "inliers": (pt0[s], pt1[s])}
+
+    def _recordFit(self, fit):
+        """
+        Record the outcome of `_fitHomography` in the frame information and
+        the statistics (and reject the search if it failed). Return its
+        homography, or None.
+        """
+        if fit["num_inliers"] is not None:
+            self._frameInfo["num_inliers"] = fit["num_inliers"]
+            self.stats.observe("num_inliers", fit["num_inliers"])
+        if fit["H"] is None:
+            (reason, msg, msg_args) = fit["rejection"]
+            self._reject(reason, msg, *msg_args)
+            return None
+        self._frameInfo["reproj_error"] = fit["reproj_error"]
+        self.stats.observe("reproj_error", fit["reproj_error"])
+        self._inliers = fit["inliers"]
+        return fit["H"]
+
+    def _estimateHomography(self, pt0, pt1, scores=None, prior=None):
+        """
+        Return the model -> frame homography estimated from the matched model
+        points `pt0` and frame points `pt1`, or None if there are not enough
+        inliers (see `_fitHomography`).
+        """
+        return self._recordFit(self._fitHomography(pt0, pt1, scores, prior))
+
+    def _searchFullFrame(self, gray, scale=1.):
+        """
+        Search all models in the whole frame (`gray`, `scale` times the size of
+        the reduced frame).
+        Return tuple(H, model_id) for the model found (the one with the most
+        inliers), or tuple(None, None).
+        """
+        (keypoints,descriptors) = self._detectAndCompute(gray)
+        self._frameInfo["num_keypoints"] = len(keypoints)
+        self.stats.observe("num_keypoints", len(keypoints))
+        if descriptors is None:
+            self._reject("no_descriptors", "no descriptors")
+            return (None, None)
+
+        # matches = self.matcher.knnMatch(np.uint8(descriptors), k = 2)
+        with self.stats.timer("knn_match"):
+            knn_matches = knnMatchArray(self.matcher, descriptors)
+        matches = self._ratioTest(knn_matches)
+        self._frameInfo["num_matches"] = len(matches)
+        self.stats.observe("num_matches", len(matches))
+        # print len(matches)
+        if len(matches) < self.num_of_matches:
+            self._reject("few_matches", "not enough matches (%d < %d)", len(matches), self.num_of_matches)
+            return (None, None)
+
+        # Each match is a vote for the model it belongs to; only models with
+        # enough votes are considered, most voted first.
+        votes = np.bincount(matches["img_idx"], minlength=len(self.models))
+        candidates = [int(mid) for mid in np.argsort(-votes, kind="mergesort")
+                      if votes[mid] >= self.num_of_matches]
+        if len(self.models) > 1:
+            self._frameInfo["model_votes"] = dict((int(mid), int(votes[mid])) for mid in np.flatnonzero(votes))
+            if not candidates:
+                self._reject("few_votes", "not enough matches for any model (best: %d < %d)",
+                             votes.max(), self.num_of_matches)
+                return (None, None)
+
+        # Only the outcome for the model found (or, if none is, for the most
+        # voted one) is recorded: a frame is counted once in the statistics,
+        # whatever the number of models.
+        frame_pts = keypointsToPoints(keypoints)
+        (best_fit, first_fit) = (None, None)
+        for mid in candidates:
+            if best_fit is not None and votes[mid] <= best_fit["num_inliers"]:
+                break # cannot get more inliers than the best model so far
+            model_matches = matches if len(self.models) == 1 else matches[matches["img_idx"] == mid]
+            pt0 = self.models[mid].pts[model_matches["train_idx"]]
+            pt1 = frame_pts[model_matches["query_idx"]]
+            scores = model_matches["distance"] / model_matches["distance2"]
+            fit = self._fitHomography(pt0, pt1, scores, self._prior(mid, scale))
+            fit["model_id"] = mid
+            if first_fit is None:
+                first_fit = fit
+            if fit["H"] is not None and (best_fit is None or fit["num_inliers"] > best_fit["num_inliers"]):
+                best_fit = fit
+        fit = best_fit if best_fit is not None else first_fit
+        H = self._recordFit(fit)
+        return (H, fit["model_id"] if H is not None else None)
+
+    def _searchRoi(self, gray):
+        """
+        Incremental search around the previous detection (see `setIncremental`),
+        for the model found in the previous frame only.
+        """
+        model = self.models[self._prevModelId]
+        (img_h, img_w) = gray.shape[:2]
+        q = cv2.perspectiveTransform(model.quad.reshape(1, -1, 2), self._prevH).reshape(-1, 2)
+        (qx0, qy0) = q.min(axis=0)
+        (qx1, qy1) = q.max(axis=0)
+        margin = self.roi_margin * max(qx1 - qx0, qy1 - qy0)
+        x0 = int(max(0, np.floor(qx0 - margin)))
+        y0 = int(max(0, np.floor(qy0 - margin)))
+        x1 = int(min(img_w, np.ceil(qx1 + margin)))
+        y1 = int(min(img_h, np.ceil(qy1 + margin)))
+        if x1 - x0 < 16 or y1 - y0 < 16:
+            self._reject("small_roi", "ROI too small (%dx%d)", x1 - x0, y1 - y0)
+            return None
+
+        (keypoints,descriptors) = self._detectAndCompute(gray, (x0, y0, x1, y1))
+        self._frameInfo["num_keypoints"] = len(keypoints)
+        self.stats.observe("num_keypoints", len(keypoints))
+        if descriptors is None:
+            self._reject("no_descriptors", "no descriptors in ROI")
+            return None
+
+        # Model features expected to be visible in the ROI
+        mdl_pts_proj = cv2.perspectiveTransform(model.pts.reshape(1, -1, 2), self._prevH).reshape(-1, 2)
+        visible = np.flatnonzero((mdl_pts_proj[:, 0] >= x0) & (mdl_pts_proj[:, 0] < x1)
+                                 & (mdl_pts_proj[:, 1] >= y0) & (mdl_pts_proj[:, 1] < y1))
+        if len(visible) < self.num_of_matches:
+            self._reject("few_visible", "not enough model features expected in ROI (%d < %d)", len(visible), self.num_of_matches)
+            return None
+
+        with self.stats.timer("knn_match"):
+            if len(self.models) == 1 and 2 * len(visible) > len(model.pts):
+                # Most of the (only) model is visible: the prebuilt index is cheaper.
+                knn_matches = knnMatchArray(self.matcher, descriptors)
+                subset = None
+            else:
+                knn_matches = knnMatchArray(self.matcher, descriptors, model.desc[visible])
+                subset = visible
+        matches = self._ratioTest(knn_matches)
+        train_idx = matches["train_idx"] if subset is None else subset[matches["train_idx"]]
+        self._frameInfo["num_matches"] = len(matches)
+        self.stats.observe("num_matches", len(matches))
+        if len(matches) < self.num_of_matches:
+            self._reject("few_matches", "not enough matches in ROI (%d < %d)", len(matches), self.num_of_matches)
+            return None
+
+        pt0 = model.pts[train_idx]
+        pt1 = keypointsToPoints(keypoints)[matches["query_idx"]] + np.float32([x0, y0])
+        scores = matches["distance"] / matches["distance2"]
+        return self._estimateHomography(pt0, pt1, scores, self._prior(self._prevModelId))
+
+    def _coarseLevels(self, gray):
+        """
+        Number of pyramid levels to remove from `gray` for the coarse search
+        (see `setCoarseToFine`).
+        """
+        frame_side = max(gray.shape[:2])
+        doc_side = frame_side
+        if self._prevH is not None:
+            q = cv2.perspectiveTransform(self.models[self._prevModelId].quad.reshape(1, -1, 2), self._prevH).reshape(-1, 2)
+            doc_side = min(frame_side, (q.max(axis=0) - q.min(axis=0)).max())
+        levels = 0
+        while levels < self.max_coarse_levels and doc_side / 2**(levels + 1) >= self.min_coarse_doc_side:
+            levels += 1
+        return levels
+
+    def _refineCorners(self, gray, H, model_id):
+        """
+        Refine the homography `H` (at the resolution of `gray`) of model
+        `model_id` with the features found around the predicted corners.
+        Return the refined homography, or None if refinement failed.
+        """
+        model = self.models[model_id]
+        (img_h, img_w) = gray.shape[:2]
+        q = cv2.perspectiveTransform(model.quad.reshape(1, -1, 2), H).reshape(-1, 2)
+        radius = self.refine_window * (q.max(axis=0) - q.min(axis=0)).max()
+        mdl_pts_proj = cv2.perspectiveTransform(model.pts.reshape(1, -1, 2), H).reshape(-1, 2)
+
+        (pt0, pt1) = ([], [])
+        for (cx, cy) in q:
+            x0 = int(max(0, np.floor(cx - radius)))
+            y0 = int(max(0, np.floor(cy - radius)))
+            x1 = int(min(img_w, np.ceil(cx + radius)))
+            y1 = int(min(img_h, np.ceil(cy + radius)))
+            if x1 - x0 < 16 or y1 - y0 < 16:
+                continue # corner out of frame
+            visible = np.flatnonzero((mdl_pts_proj[:, 0] >= x0) & (mdl_pts_proj[:, 0] < x1)
+                                     & (mdl_pts_proj[:, 1] >= y0) & (mdl_pts_proj[:, 1] < y1))
+            if len(visible) < 2:
+                continue # no texture near this corner
+            (keypoints,descriptors) = self._detectAndCompute(gray, (x0, y0, x1, y1), "refine_detect_and_compute")
+            if descriptors is None or len(keypoints) < 2:
+                continue
+            with self.stats.timer("refine_knn_match"):
+                matches = self._ratioTest(knnMatchArray(self.matcher, descriptors, model.desc[visible]))
+            if len(matches):
+                pt0.append(model.pts[visible[matches["train_idx"]]])
+                pt1.append(keypointsToPoints(keypoints)[matches["query_idx"]] + np.float32([x0, y0]))
+
+        num_refine_matches = sum(len(p) for p in pt0)
+        self._frameInfo["num_refine_matches"] = num_refine_matches
+        self.stats.observe("num_refine_matches", num_refine_matches)
+        if num_refine_matches == 0:
+            self._reject("no_refine_matches", "no features matched around corners")
+            return None
+        if len([p for p in pt0 if len(p) >= self.num_of_matches]) < 3:
+            # not enough constraints: add coarse inliers, less accurate but
+            # spread over the whole document
+            pt0.append(self._inliers[0])
+            pt1.append(self._inliers[1])
+        return self._estimateHomography(np.concatenate(pt0), np.concatenate(pt1), prior=H)
+
+    def _searchCoarseToFine(self, gray):
+        """
+        Coarse-to-fine search of all models (see `setCoarseToFine`).
+        Return tuple(H, model_id) as `_searchFullFrame`.
+        """
+        levels = self._coarseLevels(gray)
+        if levels == 0:
+            return self._searchFullFrame(gray)
+
+        self._frameInfo["coarse_levels"] = levels
+        with self.stats.timer("coarse_pyrdown"):
+            coarse = multiPyrDown(gray, levels)
+        (H, model_id) = self._searchFullFrame(coarse, 1. / 2**levels)
+        if H is None:
+            logger.debug("Coarse search failed, falling back to full frame search.")
+            self.stats.count("coarse_fallbacks")
+            self._resetFrameInfo(roi_search=False)
+            return self._searchFullFrame(gray)
+        # back to the resolution of `gray`
+        scale = np.float64([[2**levels, 0, 0], [0, 2**levels, 0], [0, 0, 1]])
+        H = np.dot(scale, H)
+        self._frameInfo["reproj_error"] *= 2**levels
+        self._inliers = (self._inliers[0], self._inliers[1] * 2**levels)
+        coarse_info = dict(self._frameInfo)
+
+        H_fine = self._refineCorners(gray, H, model_id)
+        self._frameInfo["refined"] = H_fine is not None
+        if H_fine is None:
+            # the coarse estimate is still valid
+            logger.debug("Refinement failed, keeping coarse estimate.")
+            self.stats.count("refine_failures")
+            for k in ("num_inliers", "reproj_error"):
+                self._frameInfo[k] = coarse_info[k]
+            self._frameInfo.pop("rejection", None)
+            return (H, model_id)
+        return (H_fine, model_id)
+
+    def _search(self, gray):
+        """
+        Locate a model in `gray` (the frame, after pyramid reduction and
+        conversion to grayscale), using the search modes enabled.
+        Return tuple(H, model_id), or tuple(None, None) if no model was found.
+        """
+        (H, model_id) = (None, None)
+        if self.incremental and self._prevH is not None:
+            self._resetFrameInfo(roi_search=True)
+            H = self._searchRoi(gray)
+            model_id = self._prevModelId
+            if H is None:
+                logger.debug("ROI search failed, falling back to full frame search.")
+                self.stats.count("roi_fallbacks")
+        if H is None:
+            self._resetFrameInfo(roi_search=False)
+            if self.coarse_to_fine:
+                (H, model_id) = self._searchCoarseToFine(gray)
+            else:
+                (H, model_id) = self._searchFullFrame(gray)
+        return (H, model_id)
 
     def processFrame(self, frame):
+        with self.stats.timer("process_frame"):
+            return self._processFrame(frame)
+
+    def _processFrame(self, frame):
         self._rejectCurrent = True
         img = frame
         # -----
 
-        img = self._autoPyrDownFrame(img)
+        with self.stats.timer("pyrdown"):
+            img = self._autoPyrDownFrame(img)
+
+        with self.stats.timer("cvtcolor"):
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        (H, model_id) = self._search(gray)
+        self._prevH = H
+        self._prevModelId = model_id
+
+        self.stats.count("frames")
+        if H is not None:
+            with self.stats.timer("perspective_transform"):
+                q = cv2.perspectiveTransform(self.models[model_id].quad.reshape(1, -1, 2), H).reshape(-1, 2)
+
+            self.stats.count("accepted")
+            self._frameInfo["model_id"] = model_id
+            self._frameInfo["model"] = self.models[model_id].path
+            self._rejectCurrent = False
+            self._tl = Pt(name="tl", x=self._scaleCoord(q[0][0]), y=self._scaleCoord(q[0][1]))
+            self._bl = Pt(name="bl", x=self._scaleCoord(q[1][0]), y=self._scaleCoord(q[1][1]))
+            self._br = Pt(name="br", x=self._scaleCoord(q[2][0]), y=self._scaleCoord(q[2][1]))
+            self._tr = Pt(name="tr", x=self._scaleCoord(q[3][0]), y=self._scaleCoord(q[3][1]))
 
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        (keypoints,descriptors) = self.detector.detectAndCompute(gray,None)
-        if descriptors is None:
-            logger.debug("R no descriptors")
-        else:
-            # matches = self.matcher.knnMatch(np.uint8(descriptors), k = 2)
-            matches = self.matcher.knnMatch(descriptors, k = 2)
-            matches = [m[0] for m in matches if len(m) >= 2 and m[0].distance < m[1].distance * self.second_match_tresh]
-            # print len(matches)
-            if len(matches) < self.num_of_matches:
-                logger.debug("R: not enough matches (%d < %d)", len(matches), self.num_of_matches)
-            else:
-                pt00 = [self.mdl_keyp[m.trainIdx].pt for m in matches]
-                pt10 = [keypoints[m.queryIdx].pt for m in matches]
-                pt0, pt1 = np.float32((pt00, pt10))
-                H, s = cv2.findHomography(pt0, pt1, cv2.RANSAC, 3.0)
-
-                s = s.ravel() != 0
-                # print s.sum()
-                if s.sum() < self.num_of_matches:
-                    logger.debug("R: not enough RANSAC inliers (%d < %d, got %d matches before)", s.sum(), self.num_of_matches, len(matches))
-                else:
-                    pt0, pt1 = pt0[s], pt1[s]
-                    q = cv2.perspectiveTransform(self.mdl_quad.reshape(1, -1, 2), H).reshape(-1, 2)
-
-                    self._rejectCurrent = False
-                    self._tl = Pt(name="tl", x=self._scaleCoord(q[0][0]), y=self._scaleCoord(q[0][1]))
-                    self._bl = Pt(name="bl", x=self._scaleCoord(q[1][0]), y=self._scaleCoord(q[1][1]))
-                    self._br = Pt(name="br", x=self._scaleCoord(q[2][0]), y=self._scaleCoord(q[2][1]))
-                    self._tr = Pt(name="tr", x=self._scaleCoord(q[3][0]), y=self._scaleCoord(q[3][1]))
-                    
         return (self._rejectCurrent, self._tl, self._bl, self._br, self._tr)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+import os
+import os.path
+import errno
+import hashlib
+import json
+import tempfile
+from time import time
+
+import cv2
+import numpy as np
+
+from utils.manifest import hashFile
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Binary layout of the keypoints stored in cache (one record per keypoint).
+KEYPOINT_DTYPE = np.dtype([("pt", "<f4", (2,)),
+                           ("size", "<f4"),
+                           ("angle", "<f4"),
+                           ("response", "<f4"),
+                           ("octave", "<i4"),
+                           ("class_id", "<i4")])
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "smartdoc17", "models")
+DEFAULT_MAX_SIZE = 2 * 1024**3 # bytes
+
+_SUFFIX_META = ".json"
+_SUFFIX_KEYP = ".kp.npy"
+_SUFFIX_DESC = ".desc.npy"
+
+# ==============================================================================
+def keypointsToArray(keypoints):
+    return np.array([(k.pt, k.size, k.angle, k.response, k.octave, k.class_id)
+                     for k in keypoints],
+                    dtype=KEYPOINT_DTYPE)
+
+def arrayToKeypoints(arr):
+    """
+    Rebuild the cv2.KeyPoint objects of a KEYPOINT_DTYPE array, one by one:
+    only use it where OpenCV needs them (coordinates are `arr["pt"]`).
+    """
+    return [cv2.KeyPoint(float(r["pt"][0]), float(r["pt"][1]), float(r["size"]),
+                         float(r["angle"]), float(r["response"]),
+                         int(r["octave"]), int(r["class_id"]))
+            for r in arr]
+
+# ==============================================================================
+class DescriptorCache(object):
+    """
+    Persistent cache of the keypoints and descriptors computed over model images.
+
+    Entries are keyed by the content hash of the model image and by the
+    parameters of the extraction (detector parameters, pyramid level, etc.).
+    Each entry is made of 3 files:
+        <key>.json     metadata (shape of the image features were extracted from)
+        <key>.kp.npy   keypoints, as a KEYPOINT_DTYPE record array
+        <key>.desc.npy descriptors, as a 2D array
+    NPY files are loaded memory-mapped. The metadata file is written last, so an
+    entry is valid only if its metadata file exists.
+    Least recently used entries are evicted when the cache size exceeds
+    `max_size` bytes.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def key(self, model_path, extraction_params):
+        """
+        DescriptorCache x str x dict ---> str
+        Compute the cache key for the features of the image at `model_path`
+        extracted with `extraction_params` (must be JSON-serializable).
+        """
+        h = hashlib.sha1()
+        h.update(hashFile(model_path).encode("ascii"))
+        h.update(json.dumps(extraction_params, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def load(self, key):
+        """
+        DescriptorCache x str ---> tuple(keypoints:ndarray, descriptors:ndarray, shape:tuple) or None
+        Keypoints are returned as a KEYPOINT_DTYPE array (see `arrayToKeypoints`).
+        Return None if there is no valid entry for `key`.
+        """
+        path_meta = self._path(key, _SUFFIX_META)
+        try:
+            with open(path_meta, "rb") as f:
+                meta = json.load(f)
+            keyp = np.load(self._path(key, _SUFFIX_KEYP), mmap_mode="r")
+            desc = np.load(self._path(key, _SUFFIX_DESC), mmap_mode="r")
+        except (IOError, OSError, ValueError) as e:
+            if os.path.exists(path_meta):
+                logger.warning("Ignoring invalid cache entry '%s' (%s).", key, e)
+            return None
+        os.utime(path_meta, None) # mark as recently used
+        return (keyp, desc, tuple(meta["shape"]))
+
+    def store(self, key, keypoints, descriptors, shape):
+        """
+        DescriptorCache x str x list(cv2.KeyPoint) x ndarray x tuple ---> None
+        """
+        if descriptors is None:
+            descriptors = np.empty((0, 0), dtype=np.float32)
+        self._atomicSave(self._path(key, _SUFFIX_KEYP), keypointsToArray(keypoints))
+        self._atomicSave(self._path(key, _SUFFIX_DESC), np.ascontiguousarray(descriptors))
+        meta = {"shape": list(shape), "created": time()}
+        self._atomicWrite(self._path(key, _SUFFIX_META), json.dumps(meta).encode("utf-8"))
+        self.evict(keep=key)
+
+    def _atomicSave(self, path, arr):
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, arr)
+        os.rename(tmp_path, path)
+
+    def _atomicWrite(self, path, data):
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+    def _entries(self):
+        """
+        Return a list of tuple(last_use, size, key) for every entry in cache.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(_SUFFIX_META):
+                continue
+            key = name[:-len(_SUFFIX_META)]
+            try:
+                last_use = os.path.getmtime(self._path(key, _SUFFIX_META))
+                size = sum(os.path.getsize(self._path(key, s))
+                           for s in (_SUFFIX_META, _SUFFIX_KEYP, _SUFFIX_DESC)
+                           if os.path.exists(self._path(key, s)))
+            except OSError:
+                continue # concurrently evicted
+            entries.append((last_use, size, key))
+        return entries
+
+    def remove(self, key):
+        # metadata first so the entry is invalidated before its content is removed
+        for suffix in (_SUFFIX_META, _SUFFIX_KEYP, _SUFFIX_DESC):
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits in `max_size`.
+        The entry `keep` (if any) is never evicted.
+        """
+        entries = sorted(self._entries())
+        total_size = sum(size for (_, size, _) in entries)
+        entries = [e for e in entries if e[2] != keep]
+        while entries and total_size > self.max_size:
+            (_, size, key) = entries.pop(0)
+            logger.debug("Evicting cache entry '%s' (%d bytes).", key, size)
+            self.remove(key)
+            total_size -= size
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Homography estimators
+# Every estimator has an `estimate(pt0, pt1, scores=None, prior=None)` method
+# which returns a tuple(H, mask, info): the homography mapping model points
+# `pt0` to frame points `pt1` (None on failure), the inlier mask (uint8, one
+# value per point), and a dictionary of information about the estimation.
+# `scores` (optional) give the reliability of each match, lower is better (the
+# ratio of the distances to the two nearest neighbours, for instance), and
+# `prior` (optional) is a homography expected to be close to the solution (the
+# one of the previous frame, for instance). Estimators may ignore both.
+
+DEFAULT_REPROJ_THRESHOLD = 3.0
+
+class OpenCVEstimator(object):
+    """
+    `cv2.findHomography`, with the RANSAC or LMEDS method. OpenCV 2.4 does not
+    let the number of iterations or the confidence be set, and neither scores
+    nor prior are used.
+    """
+    def __init__(self, method=cv2.RANSAC, threshold=DEFAULT_REPROJ_THRESHOLD):
+        self.method = method
+        self.threshold = threshold
+
+    def getParams(self):
+        return {"type": {cv2.RANSAC: "RANSAC", cv2.LMEDS: "LMEDS"}.get(self.method, self.method),
+                "threshold": self.threshold}
+
+    def estimate(self, pt0, pt1, scores=None, prior=None):
+        (H, mask) = cv2.findHomography(pt0, pt1, self.method, self.threshold)
+        return (H, mask, {})
+
+# ==============================================================================
+def _normalization(pts):
+    """
+    Similarity which centers `pts` on the origin, at a mean distance of sqrt(2)
+    (Hartley normalization, for a well conditioned linear system).
+    """
+    center = pts.mean(axis=0)
+    dist = np.sqrt(((pts - center)**2).sum(axis=1)).mean()
+    s = np.sqrt(2.) / dist if dist > 0 else 1.
+    return np.array([[s, 0, -s * center[0]], [0, s, -s * center[1]], [0, 0, 1]])
+
+def _homographiesFrom4Points(src, dst):
+    """
+    Solve the homographies mapping each sample of 4 points of `src` to the same
+    sample of `dst` (both (K, 4, 2) arrays, normalized coordinates).
+    Return an array of (k, 3, 3) homographies, k <= K, degenerate samples
+    (collinear points) being skipped.
+    """
+    num = len(src)
+    (x, y) = (src[:, :, 0], src[:, :, 1])
+    (u, v) = (dst[:, :, 0], dst[:, :, 1])
+    A = np.zeros((num, 8, 8))
+    A[:, 0::2, 0] = x
+    A[:, 0::2, 1] = y
+    A[:, 0::2, 2] = 1
+    A[:, 0::2, 6] = -u * x
+    A[:, 0::2, 7] = -u * y
+    A[:, 1::2, 3] = x
+    A[:, 1::2, 4] = y
+    A[:, 1::2, 5] = 1
+    A[:, 1::2, 6] = -v * x
+    A[:, 1::2, 7] = -v * y
+    b = np.empty((num, 8))
+    b[:, 0::2] = u
+    b[:, 1::2] = v
+    valid = np.abs(np.linalg.det(A)) > 1e-9
+    if not valid.any():
+        return np.zeros((0, 3, 3))
+    h = np.linalg.solve(A[valid], b[valid][:, :, np.newaxis])[:, :, 0]
+    return np.concatenate([h, np.ones((len(h), 1))], axis=1).reshape(-1, 3, 3)
+
+def _inlierMasks(Hs, src_h, dst, threshold):
+    """
+    Return the (K, N) inlier masks of the homographies `Hs` (K, 3, 3), given
+    homogeneous source points `src_h` (3, N) and destination points `dst`
+    (N, 2).
+    """
+    # a single (3K, 3) x (3, N) product is much faster than a stacked one
+    proj = np.dot(Hs.reshape(-1, 3), src_h).reshape(len(Hs), 3, -1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = 1. / proj[:, 2, :]
+        dx = proj[:, 0, :] * w - dst[:, 0]
+        dy = proj[:, 1, :] * w - dst[:, 1]
+        return (dx * dx + dy * dy) < threshold * threshold
+
+class AdaptiveRansacEstimator(object):
+    """
+    RANSAC with an adaptive number of iterations: sampling stops as soon as
+    the probability to have missed a better hypothesis falls below
+    1 - `confidence`, given the best inlier ratio found so far (a handful of
+    iterations when most matches are inliers), or after `max_iters`
+    hypotheses.
+    Hypotheses are generated and scored by batches of `batch_size`, with array
+    operations. The best one is refined by least squares on its inliers.
+    `prosac`: PROSAC-like progressive sampling, if match scores are given: the
+              k-th batch draws its samples among the best 16*2^k matches only,
+              so that good hypotheses are found earlier, and the number of
+              iterations depends on the inlier ratio among these matches.
+    `prior_inlier_ratio`: the prior homography, if given, is scored first; if
+              its inlier ratio reaches this value, it is refined and returned
+              without any sampling. Otherwise it is the initial best hypothesis.
+    """
+    def __init__(self, threshold=DEFAULT_REPROJ_THRESHOLD, confidence=0.995, max_iters=2000,
+                 prosac=False, prior_inlier_ratio=0.8, batch_size=32, seed=0):
+        self.threshold = threshold
+        self.confidence = confidence
+        self.max_iters = max_iters
+        self.prosac = prosac
+        self.prior_inlier_ratio = prior_inlier_ratio
+        self.batch_size = batch_size
+        self.seed = seed
+        self._rng = np.random.RandomState(seed)
+
+    def getParams(self):
+        return {"type": "PROSAC" if self.prosac else "RANSAC_ADAPTIVE",
+                "threshold": self.threshold,
+                "confidence": self.confidence,
+                "max_iters": self.max_iters,
+                "prior_inlier_ratio": self.prior_inlier_ratio,
+                "batch_size": self.batch_size,
+                "seed": self.seed}
+
+    def _requiredIters(self, inlier_ratio):
+        """
+        Number of iterations required to draw at least one all-inlier sample
+        with probability `confidence`.
+        """
+        p_good = inlier_ratio ** 4
+        if p_good >= 1.:
+            return 1
+        if p_good <= 0.:
+            return self.max_iters
+        return int(np.ceil(np.log(1. - self.confidence) / np.log(1. - p_good)))
+
+    def _refine(self, pt0, pt1, src_h, H, mask):
+        """
+        Least squares refinement of H on its inliers `mask`.
+        Return tuple(H, mask) with the mask of the refined homography.
+        """
+        (H_ls, _) = cv2.findHomography(pt0[mask], pt1[mask], 0)
+        if H_ls is None:
+            return (H, mask)
+        mask_ls = _inlierMasks(H_ls[np.newaxis], src_h, pt1, self.threshold)[0]
+        if mask_ls.sum() < mask.sum():
+            return (H, mask)
+        return (H_ls, mask_ls)
+
+    def estimate(self, pt0, pt1, scores=None, prior=None):
+        pt0 = np.float64(pt0).reshape(-1, 2)
+        pt1 = np.float64(pt1).reshape(-1, 2)
+        num = len(pt0)
+        info = {"iterations": 0, "prior_used": False}
+        if num < 4:
+            return (None, None, info)
+
+        src_h = np.vstack([pt0.T, np.ones(num)])
+        (best_H, best_mask, best_count) = (None, None, 0)
+        if prior is not None:
+            best_mask = _inlierMasks(np.float64(prior)[np.newaxis], src_h, pt1, self.threshold)[0]
+            (best_H, best_count) = (np.float64(prior), int(best_mask.sum()))
+            if best_count >= self.prior_inlier_ratio * num:
+                info["prior_used"] = True
+                (H, mask) = self._refine(pt0, pt1, src_h, best_H, best_mask)
+                return (H / H[2, 2], np.uint8(mask).reshape(-1, 1), info)
+
+        # samples are drawn in normalized coordinates
+        (T0, T1) = (_normalization(pt0), _normalization(pt1))
+        n0 = np.dot(pt0, T0[:2, :2].T) + T0[:2, 2]
+        n1 = np.dot(pt1, T1[:2, :2].T) + T1[:2, 2]
+        T1_inv = np.linalg.inv(T1)
+        order = np.argsort(scores, kind="mergesort") if (self.prosac and scores is not None) else None
+
+        required = self.max_iters
+        if best_count > 0:
+            required = min(required, self._requiredIters(float(best_count) / num))
+        iters = 0
+        batch = 0
+        while iters < required:
+            # small batches first, not to draw more samples than needed when
+            # most matches are inliers
+            size = min(self.batch_size, 8 * 2**batch, required - iters)
+            pool = num if order is None else min(num, 16 * 2**batch)
+            # samples with the same point twice are degenerate, hence skipped
+            samples = self._rng.randint(0, pool, (size, 4))
+            if order is not None:
+                samples = order[samples]
+            iters += size
+            batch += 1
+
+            Hs = _homographiesFrom4Points(n0[samples], n1[samples])
+            if not len(Hs):
+                continue
+            # back to pixel coordinates: T1^-1 . Hn . T0
+            Hs = np.dot(np.dot(T1_inv, Hs).transpose(1, 0, 2), T0)
+            masks = _inlierMasks(Hs, src_h, pt1, self.threshold)
+            counts = masks.sum(axis=1)
+            k = int(counts.argmax())
+            if counts[k] > best_count:
+                (best_H, best_mask, best_count) = (Hs[k], masks[k], int(counts[k]))
+            if best_count > 0:
+                inlier_ratio = float(best_count) / num
+                if order is not None:
+                    # samples come from the best matches, which have a higher
+                    # inlier ratio
+                    inlier_ratio = max(inlier_ratio, best_mask[order[:pool]].mean())
+                required = min(self.max_iters, self._requiredIters(inlier_ratio))
+
+        info["iterations"] = iters
+        if best_H is None or best_count < 4:
+            return (None, None, info)
+        (H, mask) = self._refine(pt0, pt1, src_h, best_H, best_mask)
+        return (H / H[2, 2], np.uint8(mask).reshape(-1, 1), info)
+
+# ==============================================================================
+# Estimator factories
+
+def createOpenCVRansacEstimator(threshold=DEFAULT_REPROJ_THRESHOLD):
+    return OpenCVEstimator(cv2.RANSAC, threshold)
+
+def createLMedSEstimator(threshold=DEFAULT_REPROJ_THRESHOLD):
+    return OpenCVEstimator(cv2.LMEDS, threshold)
+
+def createAdaptiveRansacEstimator(threshold=DEFAULT_REPROJ_THRESHOLD):
+    return AdaptiveRansacEstimator(threshold)
+
+def createProsacEstimator(threshold=DEFAULT_REPROJ_THRESHOLD):
+    return AdaptiveRansacEstimator(threshold, prosac=True)
+
+ESTIMATOR_FACTORIES = {
+    "ransac_cv": createOpenCVRansacEstimator,
+    "lmeds": createLMedSEstimator,
+    "ransac": createAdaptiveRansacEstimator,
+    "prosac": createProsacEstimator,
+}
+ESTIMATOR_NAMES = sorted(ESTIMATOR_FACTORIES.keys())
+DEFAULT_ESTIMATOR = "ransac_cv"
+
+def createEstimator(name, threshold=DEFAULT_REPROJ_THRESHOLD):
+    return ESTIMATOR_FACTORIES[name](threshold)
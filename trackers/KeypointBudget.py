@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+
+from Matchers import keypointsToPoints
+
+import numpy as np
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Keypoint budget
+# Text-heavy pages yield tens of thousands of keypoints, most of them clustered
+# in dense text areas: matching time and memory grow with their number, while
+# the homography mostly benefits from points spread over the whole document.
+# The image is divided into a grid of buckets, and keypoints are kept bucket by
+# bucket, strongest first, in a round-robin way: every bucket gets the same
+# share of the budget, and the share of the buckets with fewer keypoints goes
+# to the others.
+
+DEFAULT_GRID_SIZE = 8 # number of buckets along the largest side of the image
+
+def bucketedSelection(keypoints, image_shape, budget, grid_size=DEFAULT_GRID_SIZE):
+    """
+    list(KeyPoint) x tuple x int x int ---> ndarray
+    Return the indices (in increasing order) of at most `budget` keypoints
+    selected among `keypoints`, detected in an image of shape `image_shape`.
+    A `budget` of 0 means no limit.
+    """
+    num_keyp = len(keypoints)
+    if budget <= 0 or num_keyp <= budget:
+        return np.arange(num_keyp)
+
+    (img_h, img_w) = image_shape[:2]
+    cell = float(max(img_w, img_h)) / grid_size
+    cols = max(1, int(np.ceil(img_w / cell)))
+    rows = max(1, int(np.ceil(img_h / cell)))
+    pts = keypointsToPoints(keypoints)
+    bx = np.clip((pts[:, 0] / cell).astype(int), 0, cols - 1)
+    by = np.clip((pts[:, 1] / cell).astype(int), 0, rows - 1)
+    bucket = by * cols + bx
+    response = np.float32([k.response for k in keypoints])
+
+    # rank of each keypoint in its bucket, by decreasing response
+    order = np.lexsort((-response, bucket))
+    sorted_bucket = bucket[order]
+    rank = np.empty(num_keyp, int)
+    rank[order] = np.arange(num_keyp) - np.searchsorted(sorted_bucket, sorted_bucket)
+
+    # best keypoint of every bucket first, then the second ones, etc.
+    selected = np.lexsort((-response, rank))[:budget]
+    return np.sort(selected)
+
+def applyBudget(keypoints, descriptors, image_shape, budget, grid_size=DEFAULT_GRID_SIZE):
+    """
+    list(KeyPoint) x ndarray x tuple x int x int ---> tuple(list(KeyPoint), ndarray)
+    Keep at most `budget` of the features (`keypoints`, `descriptors`) detected
+    in an image of shape `image_shape` (see `bucketedSelection`).
+    """
+    if descriptors is None or budget <= 0 or len(keypoints) <= budget:
+        return (keypoints, descriptors)
+    keep = bucketedSelection(keypoints, image_shape, budget, grid_size)
+    return ([keypoints[i] for i in keep], descriptors[keep])
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# FLANN index algorithms (see flann/defines.h)
+FLANN_INDEX_KDTREE = 1
+
+# ==============================================================================
+# Matcher factories
+# Every factory returns a cv2.DescriptorMatcher, or an object with the same
+# `add`, `clear` and `train` methods. Model descriptors are added to its train
+# collection and the index (if any) is built once by calling `train()` in
+# `AbstractPOITracker.reconfigureModel`, then reused for every frame. Matching
+# is done with `knnMatchArray`. Trackers create their matcher by name with
+# `createMatcher`.
+
+def createBruteForceMatcher(norm=cv2.NORM_L2):
+    """
+    Exact matcher: every query descriptor is compared to every model descriptor.
+    """
+    return BruteForceMatcher(norm)
+
+def createFlannKDTreeMatcher(trees=4, checks=64):
+    """
+    Approximate nearest-neighbour matcher using randomized KD-trees, suitable for
+    float descriptors (SIFT, SURF).
+    `trees`: number of parallel KD-trees in the index (more trees: better recall,
+             longer index construction).
+    `checks`: number of leaves visited when searching for neighbours (more checks:
+              better recall, slower matching).
+    """
+    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=trees)
+    search_params = dict(checks=checks)
+    return cv2.FlannBasedMatcher(index_params, search_params)
+
+MATCHER_FACTORIES = {
+    "bf": createBruteForceMatcher,
+    "flann": createFlannKDTreeMatcher,
+}
+MATCHER_NAMES = sorted(MATCHER_FACTORIES.keys())
+
+def createMatcher(name, **params):
+    """
+    Create the matcher `name` (see `MATCHER_FACTORIES`), `params` being passed
+    to its factory.
+    """
+    return MATCHER_FACTORIES[name](**params)
+
+# ==============================================================================
+# Matching results as arrays
+# Filtering and gathering points match by match, on DMatch and KeyPoint
+# objects, is slow with thousands of matches per frame: results are stored in
+# arrays (directly by the brute force matcher, which never creates DMatch
+# objects, or converted once for the other matchers), and then processed with
+# array operations.
+
+# Best two neighbours of each query descriptor. Distances are stored as double
+# precision values, so that comparisons give the same results as with the
+# Python floats of DMatch objects.
+KNN_MATCH_DTYPE = np.dtype([("query_idx", "<i4"),
+                            ("train_idx", "<i4"),
+                            ("img_idx", "<i4"),
+                            ("distance", "<f8"),
+                            ("distance2", "<f8")])
+
+def knnMatchesToArray(knn_matches):
+    """
+    list(list(DMatch)) ---> ndarray(KNN_MATCH_DTYPE)
+    Convert the result of `knnMatch(..., k=2)`. Query descriptors with less
+    than 2 neighbours are ignored.
+    """
+    return np.array([(m[0].queryIdx, m[0].trainIdx, m[0].imgIdx, m[0].distance, m[1].distance)
+                     for m in knn_matches if len(m) >= 2],
+                    dtype=KNN_MATCH_DTYPE)
+
+def ratioTest(knn, ratio):
+    """
+    ndarray(KNN_MATCH_DTYPE) x float ---> ndarray(KNN_MATCH_DTYPE)
+    Lowe's ratio test: keep the matches whose best neighbour is significantly
+    closer than the second one.
+    """
+    return knn[knn["distance"] < knn["distance2"] * ratio]
+
+def keypointsToPoints(keypoints):
+    """
+    list(KeyPoint) ---> ndarray
+    Return the coordinates of `keypoints` as a (N, 2) float32 array.
+    """
+    if hasattr(cv2, "KeyPoint_convert"): # OpenCV 3+
+        return cv2.KeyPoint_convert(keypoints).reshape(-1, 2) if keypoints else np.zeros((0, 2), np.float32)
+    return np.float32([k.pt for k in keypoints]).reshape(-1, 2)
+
+def knnMatchArray(matcher, query, train=None):
+    """
+    DescriptorMatcher x ndarray x ndarray ---> ndarray(KNN_MATCH_DTYPE)
+    Best two neighbours of each `query` descriptor among the train collection
+    of `matcher`, or among `train` descriptors if given (then `img_idx` is 0).
+    """
+    if hasattr(matcher, "knnMatchArray"):
+        return matcher.knnMatchArray(query, train)
+    if train is None:
+        return knnMatchesToArray(matcher.knnMatch(query, k=2))
+    return knnMatchesToArray(matcher.knnMatch(query, train, k=2))
+
+# ==============================================================================
+class BruteForceMatcher(object):
+    """
+    Exact matcher, giving the same matches as cv2.BFMatcher, but as arrays:
+    `cv2.batchDistance` returns the best two neighbours of every query
+    descriptor as distance and index matrices, without creating DMatch objects.
+    Implements the part of the cv2.DescriptorMatcher interface used by the
+    trackers.
+    """
+    def __init__(self, norm=cv2.NORM_L2):
+        self.norm = norm
+        self._trainDesc = []
+
+    def add(self, descriptors):
+        self._trainDesc.extend(descriptors)
+
+    def clear(self):
+        self._trainDesc = []
+
+    def train(self):
+        pass # no index
+
+    def getTrainDescriptors(self):
+        return list(self._trainDesc)
+
+    def _knnMatch2(self, query, train):
+        """
+        Return tuple(distances, indices), both (N, 2): best two neighbours in
+        `train` of the `query` descriptors (index -1 if there is none).
+        """
+        dist = np.full((len(query), 2), np.inf, np.float32)
+        idx = np.full((len(query), 2), -1, np.int32)
+        if len(train) > 0:
+            # K is reduced to the number of train descriptors
+            k = min(2, len(train))
+            (d, i) = cv2.batchDistance(query, train, cv2.CV_32F, normType=self.norm, K=k)
+            (dist[:, :k], idx[:, :k]) = (d.reshape(-1, k), i.reshape(-1, k))
+        return (dist, idx)
+
+    def knnMatchArray(self, query, train=None):
+        """
+        ndarray x ndarray ---> ndarray(KNN_MATCH_DTYPE)
+        See `knnMatchArray` (module function).
+        """
+        if train is None and not self._trainDesc:
+            return np.empty(0, KNN_MATCH_DTYPE)
+        if train is not None or len(self._trainDesc) == 1:
+            (dist, idx) = self._knnMatch2(query, self._trainDesc[0] if train is None else train)
+            img_idx = np.zeros_like(idx)
+        else:
+            # merge the best two neighbours found in each train image
+            results = [self._knnMatch2(query, desc) for desc in self._trainDesc]
+            dist = np.hstack([r[0] for r in results])
+            idx = np.hstack([r[1] for r in results])
+            img_idx = np.repeat(np.arange(len(results), dtype=np.int32), 2)[np.newaxis, :].repeat(len(query), axis=0)
+            best = np.argsort(dist, axis=1, kind="mergesort")[:, :2]
+            rows = np.arange(len(query))[:, np.newaxis]
+            (dist, idx, img_idx) = (dist[rows, best], idx[rows, best], img_idx[rows, best])
+
+        valid = idx[:, 1] >= 0 # at least 2 neighbours
+        knn = np.empty(int(valid.sum()), KNN_MATCH_DTYPE)
+        knn["query_idx"] = np.flatnonzero(valid)
+        knn["train_idx"] = idx[valid, 0]
+        knn["img_idx"] = img_idx[valid, 0]
+        knn["distance"] = dist[valid, 0]
+        knn["distance2"] = dist[valid, 1]
+        return knn
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+
+from AbstractPOITracker import *
+from Matchers import *
+from SIFT_BFTracker import createSIFTDetector
+
+import cv2
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+class SIFT_FLANNTracker(AbstractPOITracker):
+    """
+    Same as SIFT_BFTracker, but with an approximate nearest-neighbour matcher
+    (randomized KD-trees) instead of brute force matching.
+    See `createFlannKDTreeMatcher` for the meaning of `trees` and `checks`.
+    """
+    def __init__(self, trees=4, checks=64):
+        (detector, detector_params) = createSIFTDetector()
+
+        self._trees = trees
+        self._checks = checks
+        matcher = createMatcher("flann", trees=trees, checks=checks)
+
+        super(SIFT_FLANNTracker, self).__init__(detector,
+                                          matcher,
+                                          num_pyrdown_model=1,
+                                          num_of_matches=15,
+                                          detector_params=detector_params)
+
+    def getParams(self):
+        params = super(SIFT_FLANNTracker, self).getParams()
+        params["matcher"] = {"type": "FLANN_KDTREE", "trees": self._trees, "checks": self._checks}
+        return params
+
+    def getName(self):
+        return super(SIFT_FLANNTracker, self).getName() + "_" + str(self._trees) + "_" + str(self._checks)
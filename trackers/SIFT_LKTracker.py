@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+
+from AbstractPOITracker import *
+from Matchers import *
+from SIFT_BFTracker import createSIFTDetector
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+class SIFT_LKTracker(AbstractPOITracker):
+    """
+    Hybrid tracker: SIFT_BFTracker on keyframes only, and in between, the
+    inliers of the last keyframe are tracked from frame to frame with pyramidal
+    Lucas-Kanade optical flow, the homography being estimated from the model
+    points of the tracked points.
+
+    A new keyframe (full search) is triggered when less than `min_tracked_ratio`
+    of the points of the last keyframe (or less than `num_of_matches` points)
+    are still tracked, when the mean reprojection error of the tracked points
+    exceeds `max_reproj_error` (full resolution pixels), or after
+    `max_keyframe_interval` frames (0: no limit).
+    """
+    def __init__(self,
+                 max_points=500,
+                 min_tracked_ratio=0.5,
+                 max_reproj_error=2.0,
+                 max_keyframe_interval=0,
+                 lk_win_size=21,
+                 lk_max_level=3,
+                 max_fb_error=1.0):
+        (detector, detector_params) = createSIFTDetector()
+
+        matcher = createMatcher("bf", norm=cv2.NORM_L2)
+
+        super(SIFT_LKTracker, self).__init__(detector,
+                                          matcher,
+                                          num_pyrdown_model=1,
+                                          num_of_matches=15,
+                                          detector_params=detector_params)
+
+        self.max_points = max_points
+        self.min_tracked_ratio = min_tracked_ratio
+        self.max_reproj_error = max_reproj_error
+        self.max_keyframe_interval = max_keyframe_interval
+        self.max_fb_error = max_fb_error
+        self._lk_params = dict(winSize=(lk_win_size, lk_win_size),
+                               maxLevel=lk_max_level,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+        self._resetFlow()
+
+    def getParams(self):
+        params = super(SIFT_LKTracker, self).getParams()
+        params["optical_flow"] = {"max_points": self.max_points,
+                                  "min_tracked_ratio": self.min_tracked_ratio,
+                                  "max_reproj_error": self.max_reproj_error,
+                                  "max_keyframe_interval": self.max_keyframe_interval,
+                                  "max_fb_error": self.max_fb_error,
+                                  "win_size": self._lk_params["winSize"][0],
+                                  "max_level": self._lk_params["maxLevel"]}
+        return params
+
+    def _resetFlow(self):
+        self._flowGray = None # previous frame
+        self._flowMdlPts = None # model points of the tracked points
+        self._flowPts = None # tracked points in the previous frame
+        self._flowModelId = None
+        self._flowKeyframePoints = 0 # number of points tracked from the last keyframe
+        self._flowAge = 0 # number of frames since the last keyframe
+
+    def reconfigureModels(self, tracker_models):
+        super(SIFT_LKTracker, self).reconfigureModels(tracker_models)
+        self._resetFlow()
+
+    def reinitFrameSize(self, frame_width, frame_height):
+        super(SIFT_LKTracker, self).reinitFrameSize(frame_width, frame_height)
+        self._resetFlow()
+
+    def _startFlow(self, gray, model_id):
+        """
+        Start tracking the inliers of the keyframe `gray`.
+        """
+        (mdl_pts, pts) = self._inliers
+        if len(pts) > self.max_points:
+            # evenly strided subset, to keep points spread over the document
+            keep = np.linspace(0, len(pts) - 1, self.max_points).astype(int)
+            (mdl_pts, pts) = (mdl_pts[keep], pts[keep])
+        self._flowGray = gray
+        self._flowMdlPts = np.float32(mdl_pts).reshape(-1, 2)
+        self._flowPts = np.float32(pts).reshape(-1, 2)
+        self._flowModelId = model_id
+        self._flowKeyframePoints = len(pts)
+        self._flowAge = 0
+
+    def _searchFlow(self, gray):
+        """
+        Track the points of the previous frame in `gray`, and estimate the
+        homography from them. Return it, or None if a keyframe is needed.
+        """
+        if self.max_keyframe_interval > 0 and self._flowAge >= self.max_keyframe_interval:
+            self._reject("keyframe_interval", "keyframe interval reached (%d frames)", self._flowAge)
+            return None
+
+        prev_pts = self._flowPts.reshape(-1, 1, 2)
+        with self.stats.timer("optical_flow"):
+            (pts, status, _err) = cv2.calcOpticalFlowPyrLK(self._flowGray, gray, prev_pts, None, **self._lk_params)
+            # forward-backward check: points which do not come back are lost
+            (back, back_status, _err) = cv2.calcOpticalFlowPyrLK(gray, self._flowGray, pts, None, **self._lk_params)
+        fb_error = np.sqrt(((back - prev_pts)**2).sum(axis=2)).ravel()
+        good = (status.ravel() != 0) & (back_status.ravel() != 0) & (fb_error < self.max_fb_error)
+        num_tracked = int(good.sum())
+        self._frameInfo["num_tracked"] = num_tracked
+        self.stats.observe("num_tracked", num_tracked)
+        if num_tracked < max(self.num_of_matches, self.min_tracked_ratio * self._flowKeyframePoints):
+            self._reject("few_tracked", "not enough points tracked (%d, %d at last keyframe)",
+                         num_tracked, self._flowKeyframePoints)
+            return None
+
+        (mdl_pts, pts) = (self._flowMdlPts[good], pts.reshape(-1, 2)[good])
+        H = self._estimateHomography(mdl_pts, pts, prior=self._prior(self._flowModelId))
+        if H is None:
+            return None
+        if self._frameInfo["reproj_error"] > self.max_reproj_error:
+            self._reject("flow_reproj_error", "reprojection error too high (%.2f > %.2f)",
+                         self._frameInfo["reproj_error"], self.max_reproj_error)
+            return None
+
+        # go on with the inliers only
+        (self._flowMdlPts, self._flowPts) = self._inliers
+        self._flowGray = gray
+        self._flowAge += 1
+        return H
+
+    def _search(self, gray):
+        if self._flowGray is not None and self._flowGray.shape == gray.shape:
+            self._resetFrameInfo(roi_search=False)
+            self._frameInfo["keyframe"] = False
+            H = self._searchFlow(gray)
+            if H is not None:
+                return (H, self._flowModelId)
+            logger.debug("Tracking lost, searching for a new keyframe.")
+            self.stats.count("flow_lost")
+
+        (H, model_id) = super(SIFT_LKTracker, self)._search(gray)
+        self._frameInfo["keyframe"] = True
+        self.stats.count("keyframes")
+        if H is None:
+            self._resetFlow()
+        else:
+            self._startFlow(gray, model_id)
+        return (H, model_id)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import math
+from time import time
+
+# ==============================================================================
+class Histogram(object):
+    """
+    Summary of a series of non-negative values: count, sum, min, max, and
+    counts per power-of-two bucket (bucket k holds values in [2**(k-1), 2**k[,
+    bucket 0 holds values < 1).
+    """
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        k = math.frexp(value)[1] if value >= 1 else 0
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+
+    def report(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.,
+                "min": self.min,
+                "max": self.max,
+                # list of [upper bound (exclusive), count]
+                "histogram": [[2**k, self.buckets[k]] for k in sorted(self.buckets)]}
+
+
+class _Timer(object):
+    __slots__ = ("_stats", "_name", "_start")
+
+    def __init__(self, stats, name):
+        self._stats = stats
+        self._name = name
+
+    def __enter__(self):
+        self._start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # durations are recorded in microseconds, for meaningful buckets
+        self._stats.observeTime(self._name, 1e6 * (time() - self._start))
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+# ==============================================================================
+class NullStats(object):
+    """
+    Statistics collector which does nothing: used when statistics are disabled,
+    so that instrumentation points cost (almost) nothing.
+    """
+    enabled = False
+
+    def timer(self, stage):
+        return _NULL_TIMER
+
+    def observeTime(self, stage, duration_us):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def count(self, name, increment=1):
+        pass
+
+    def reject(self, reason):
+        pass
+
+    def report(self):
+        return {}
+
+NULL_STATS = NullStats()
+
+
+class TrackerStats(NullStats):
+    """
+    Statistics accumulated over a run:
+    - stage durations (microseconds), as histograms: `with stats.timer("detect"): ...`
+    - per-frame values (keypoint, match, inlier counts...), as histograms
+    - event counters, including rejection reasons
+    """
+    enabled = True
+
+    def __init__(self):
+        self.stages = {}
+        self.values = {}
+        self.counters = {}
+        self.rejections = {}
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def observeTime(self, stage, duration_us):
+        hist = self.stages.get(stage)
+        if hist is None:
+            hist = self.stages[stage] = Histogram()
+        hist.add(duration_us)
+
+    def observe(self, name, value):
+        hist = self.values.get(name)
+        if hist is None:
+            hist = self.values[name] = Histogram()
+        hist.add(value)
+
+    def count(self, name, increment=1):
+        self.counters[name] = self.counters.get(name, 0) + increment
+
+    def reject(self, reason):
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+
+    def report(self):
+        """
+        TrackerStats ---> dict
+        JSON-serializable summary of the statistics.
+        """
+        return {"stages_us": dict((k, h.report()) for (k, h) in self.stages.items()),
+                "values": dict((k, h.report()) for (k, h) in self.values.items()),
+                "counters": dict(self.counters),
+                "rejections": dict(self.rejections)}
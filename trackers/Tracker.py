@@ -8,6 +8,8 @@ from collections import namedtuple
 
 import cv2
 
+from Stats import *
+
 # ==============================================================================
 Pt = namedtuple("Pt", ["name", "x", "y"])
 # validnames = ["tl","bl","br","tr"]
@@ -21,7 +23,6 @@ def multiPyrDown(img, num_pyrdown=1):
     return res
 
 # ==============================================================================
-# TODO add counters to facilitate statistics accumulation
 class Tracker(object):
     """
     Tracker is an interface for every tracker callable by `process_sample`.
@@ -35,7 +36,7 @@ class Tracker(object):
     # Interface
     # --------------------------------------------------------------------------
 
-    def reconfigureModel(self, tracker_model): # TODO allow multiple models?
+    def reconfigureModel(self, tracker_model):
         """
         Tracker x str ---> None
         Will be called once before processing each test sequence with the appropriate
@@ -43,6 +44,19 @@ class Tracker(object):
         """
         pass
 
+    def reconfigureModels(self, tracker_models):
+        """
+        Tracker x list(str) ---> None
+        Same as `reconfigureModel`, with several candidate models (for instance
+        the pages of a document): each frame is searched for any of them, and
+        the index of the one found is reported by `getFrameInfo()["model_id"]`.
+        Trackers which do not override this method accept a single model only,
+        and raise ValueError if given several.
+        """
+        if len(tracker_models) != 1:
+            raise ValueError("%s does not support multiple models (got %d)." % (self.getName(), len(tracker_models)))
+        self.reconfigureModel(tracker_models[0])
+
     def reinitFrameSize(self, frame_width, frame_height):
         """
         Tracker x int x int ---> None
@@ -63,6 +77,52 @@ class Tracker(object):
         """
         raise NotImplementedError()
 
+    def getFrameInfo(self):
+        """
+        Tracker ---> dict
+        Return extra information about the last frame processed (for instance:
+        number of matches and inliers). Available keys depend on the tracker.
+        """
+        return self._frameInfo
+
+    def enableStats(self, enabled=True):
+        """
+        Tracker x bool ---> None
+        Start (or stop) collecting per-stage timings and per-frame counters in
+        `self.stats`. Collection is disabled by default and costs (almost)
+        nothing then. Enabling it resets the statistics.
+        """
+        self.stats = TrackerStats() if enabled else NULL_STATS
+
+    def getStats(self):
+        """
+        Tracker ---> dict
+        Return a JSON-serializable report of the statistics collected so far
+        (empty if statistics are disabled).
+        """
+        report = self.stats.report()
+        if report:
+            report["tracker"] = self.getName()
+        return report
+
+    def getParams(self):
+        """
+        Tracker ---> dict
+        Return the (JSON-serializable) parameters of the tracker which have an
+        influence on its results, to tell whether results produced earlier are
+        still valid. Overwrite this method if your tracker has parameters.
+        """
+        return {}
+
+    def setParams(self, params):
+        """
+        Tracker x dict ---> None
+        Apply the parameters returned by `getParams()` on a tracker of the same
+        class, for instance to replicate its configuration in another process.
+        Overwrite this method if your tracker has configurable parameters.
+        """
+        pass
+
     def getName(self):
         """
         Tracker ---> str
@@ -86,6 +146,8 @@ class Tracker(object):
         self._bl = None
         self._br = None
         self._tr = None
+        self._frameInfo = {}
+        self.stats = NULL_STATS
 
         self._num_pyrdown_model  = num_pyrdown_model # could be dynamic according to frame size (to fit in frame's harmonics)
         self._num_pyrdown_frames = num_pyrdown_frames
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import importlib
+
+# ==============================================================================
+# Concrete trackers which can be selected by name. For each name, module
+# `trackers.<name>` must define a parameter-free class `<name>`.
+TRACKER_NAMES = [
+    "SIFT_BFTracker",
+    "SIFT_FLANNTracker",
+    "SIFT_LKTracker",
+]
+DEFAULT_TRACKER = "SIFT_BFTracker"
+
+def createTracker(name=DEFAULT_TRACKER):
+    """
+    str ---> Tracker
+    Instantiate the concrete tracker class `name` with its default parameters.
+    """
+    if name not in TRACKER_NAMES:
+        raise ValueError("Unknown tracker '%s' (available: %s)." % (name, ", ".join(TRACKER_NAMES)))
+    module = importlib.import_module("%s.%s" % (__name__, name))
+    return getattr(module, name)()
@@ -13,6 +13,12 @@ class StoreValidFilePath(argparse.Action):
             parser.error("'%s' does not exist or is not a file." % values)
         setattr(namespace, self.dest, values)
 
+class StoreValidDirPath(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        if not os.path.isdir(values):
+            parser.error("'%s' does not exist or is not a directory." % values)
+        setattr(namespace, self.dest, values)
+
 class StoreExistingOrCreatableDir(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         if type(values) is not str:
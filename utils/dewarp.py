@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Dewarping of frames into the (large) ground truth image shape, streamed to PNG.
+
+`cv2.warpPerspective` needs an output buffer of the size of the target, which
+is several tens of MiB for ground truth images scanned at 300 DPI. Instead, the
+output is computed by bands of rows and streamed to the PNG file, so that
+memory is bounded by the band size.
+
+Bands must be bit-identical to `cv2.warpPerspective(frame, M, size)` with
+default flags (bilinear interpolation, constant black border): OpenCV 2.4
+computes this warp by inverting M, building fixed-point coordinate maps with
+`INTER_TAB_SIZE` sub-pixel steps, block by block, and calling `cv2.remap` on
+them. `warpMaps` reproduces these maps (same floating point operations, same
+block layout), so each band can be remapped independently. Later versions of
+OpenCV compute the warp differently: bands are only used if `bandsAreExact()`
+(checked once per process), and the whole frame is warped at once (and encoded
+by OpenCV) otherwise. See tests/test_dewarp.py.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.png import PngStreamWriter
+from utils.output import writeImage, DEFAULT_PNG_COMPRESSION
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+DEFAULT_BAND_ROWS = 64
+
+# constants of OpenCV's geometric transforms (imgproc/imgproc.hpp)
+INTER_BITS = 5
+INTER_TAB_SIZE = 1 << INTER_BITS
+_WARP_BLOCK_SIZE = 32 # block size of cv::warpPerspective
+
+_INT_MIN = -2**31
+_INT_MAX = 2**31 - 1
+
+# ==============================================================================
+def _warpBlockWidth(width, height):
+    """
+    Width of the output blocks processed by cv::warpPerspective: coordinates
+    are computed relative to the block origin, which changes rounding.
+    """
+    bh0 = min(_WARP_BLOCK_SIZE // 2, height)
+    return min(_WARP_BLOCK_SIZE * _WARP_BLOCK_SIZE // bh0, width)
+
+def warpMaps(inv_mat, y_start, y_stop, width, height):
+    """
+    ndarray x int x int x int x int ---> tuple(ndarray, ndarray)
+    Fixed-point maps for `cv2.remap` which produce the rows [y_start, y_stop[
+    of the warp of an image to (width, height) by `inv_mat`, the inverse (dst
+    -> src) perspective transform.
+    Return tuple(xy, alpha): xy (int16, CV_16SC2) holds the integer source
+    coordinates, alpha (uint16) the index of the interpolation coefficients.
+    """
+    M = inv_mat.ravel()
+    bw0 = _warpBlockWidth(width, height)
+    y = np.arange(y_start, y_stop, dtype=np.float64)[:, np.newaxis]
+    cols = np.arange(width)
+    x = (cols - cols % bw0).astype(np.float64)[np.newaxis, :] # block origin
+    x1 = (cols % bw0).astype(np.float64)[np.newaxis, :] # offset in block
+
+    # same operations, in the same order, as cv::WarpPerspectiveInvoker
+    X0 = M[0]*x + M[1]*y + M[2]
+    Y0 = M[3]*x + M[4]*y + M[5]
+    W = (M[6]*x + M[7]*y + M[8]) + M[6]*x1
+    nz = W != 0
+    W = np.where(nz, INTER_TAB_SIZE / np.where(nz, W, 1.), 0.)
+    X = np.rint(np.clip((X0 + M[0]*x1)*W, _INT_MIN, _INT_MAX)).astype(np.int64)
+    Y = np.rint(np.clip((Y0 + M[3]*x1)*W, _INT_MIN, _INT_MAX)).astype(np.int64)
+
+    xy = np.empty((y_stop - y_start, width, 2), np.int16)
+    xy[..., 0] = np.clip(X >> INTER_BITS, -32768, 32767)
+    xy[..., 1] = np.clip(Y >> INTER_BITS, -32768, 32767)
+    alpha = ((Y & (INTER_TAB_SIZE-1))*INTER_TAB_SIZE + (X & (INTER_TAB_SIZE-1))).astype(np.uint16)
+    return (xy, alpha)
+
+def dewarpBands(frame, trans, target_shape, band_rows=DEFAULT_BAND_ROWS):
+    """
+    Generator: dewarp `frame` with the perspective transform `trans` (as given
+    to `cv2.warpPerspective`) into an image of shape `target_shape`, and yield
+    the result by bands of at most `band_rows` rows, top to bottom.
+    """
+    (height, width) = target_shape[:2]
+    (_ret, inv_trans) = cv2.invert(trans)
+    for y_start in range(0, height, band_rows):
+        y_stop = min(height, y_start + band_rows)
+        (xy, alpha) = warpMaps(inv_trans, y_start, y_stop, width, height)
+        yield cv2.remap(frame, xy, alpha, cv2.INTER_LINEAR)
+
+_bands_are_exact = None
+
+def bandsAreExact():
+    """
+    ---> bool
+    Whether `dewarpBands` gives the same result as `cv2.warpPerspective` with
+    the version of OpenCV in use, on a random image warped with a strong
+    perspective into a shape which the bands do not divide evenly.
+    """
+    global _bands_are_exact
+    if _bands_are_exact is None:
+        rng = np.random.RandomState(0)
+        frame = rng.randint(0, 256, (48, 64, 3)).astype(np.uint8)
+        quad = np.float32([[3, 5], [9, 44], [61, 37], [50, 2]])
+        target = np.float32([[0, 0], [0, 66], [50, 66], [50, 0]])
+        trans = cv2.getPerspectiveTransform(quad, target)
+        bands = np.vstack(list(dewarpBands(frame, trans, (67, 51), 16)))
+        _bands_are_exact = bool(np.array_equal(bands, cv2.warpPerspective(frame, trans, (51, 67))))
+    return _bands_are_exact
+
+def defaultBandRows():
+    """
+    ---> int
+    Default band height for `dewarpToPng`: DEFAULT_BAND_ROWS if bands are exact
+    with the version of OpenCV in use, 0 (whole frame at once) otherwise.
+    """
+    return DEFAULT_BAND_ROWS if bandsAreExact() else 0
+
+def dewarpToPng(frames, transforms, target_shape, paths, band_rows=DEFAULT_BAND_ROWS,
+                compression=DEFAULT_PNG_COMPRESSION):
+    """
+    Dewarp each frame of `frames` with the matching perspective transform of
+    `transforms` into an image of shape `target_shape`, and write the results
+    to the matching PNG file of `paths` (zlib `compression` level).
+    All outputs are produced by bands of `band_rows` rows in a single pass, and
+    frames which share the same transform share the coordinate maps. If
+    `band_rows` is 0 (or None), or if bands are not exact (see
+    `bandsAreExact`), each frame is warped at once with `cv2.warpPerspective`
+    instead.
+    """
+    (height, width) = target_shape[:2]
+    if band_rows and not bandsAreExact():
+        logger.debug("Dewarping by bands is not exact with OpenCV %s, warping whole frames.", cv2.__version__)
+        band_rows = 0
+    if not band_rows:
+        for (frame, trans, path) in zip(frames, transforms, paths):
+            writeImage(path, cv2.warpPerspective(frame, trans, (width, height)), compression)
+        return
+
+    writers = []
+    try:
+        for (frame, path) in zip(frames, paths):
+            channels = frame.shape[2] if frame.ndim == 3 else 1
+            writers.append(PngStreamWriter(path, width, height, channels, compression))
+
+        inv_transforms = [cv2.invert(trans)[1] for trans in transforms]
+        for y_start in range(0, height, band_rows):
+            y_stop = min(height, y_start + band_rows)
+            maps = {}
+            for (frame, inv_trans, writer) in zip(frames, inv_transforms, writers):
+                key = inv_trans.tobytes()
+                if key not in maps:
+                    maps[key] = warpMaps(inv_trans, y_start, y_stop, width, height)
+                (xy, alpha) = maps[key]
+                writer.write(cv2.remap(frame, xy, alpha, cv2.INTER_LINEAR))
+        for writer in writers:
+            writer.close()
+    except:
+        for writer in writers:
+            writer.abort()
+        raise
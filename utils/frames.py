@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+import os
+import os.path
+import errno
+import json
+import threading
+import collections
+import traceback
+import Queue
+from time import time
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.manifest import hashFile
+from utils.output import atomicWrite
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+class FrameSource(object):
+    """
+    Sequential source of video frames, with the same interface as
+    `cv2.VideoCapture.read()`.
+
+    The frame returned by `read()` is only guaranteed to be valid until the next
+    call to `read()` or `release()`: copy it if it has to be kept longer.
+    """
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self._capture = cv2.VideoCapture(video_path)
+
+    def read(self):
+        """
+        FrameSource ---> tuple(ok:bool, frame:ndarray)
+        """
+        return self._capture.read()
+
+    def occupancy(self):
+        """
+        FrameSource ---> int
+        Number of frames decoded in advance and waiting to be read.
+        """
+        return 0
+
+    def getStats(self):
+        """
+        FrameSource ---> dict
+        """
+        return {}
+
+    def release(self):
+        self._capture.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+# ==============================================================================
+class PrefetchingFrameSource(FrameSource):
+    """
+    Frame source which decodes frames ahead of time on a background thread.
+
+    Frames are decoded directly into a bounded ring of `num_buffers`
+    preallocated buffers: the buffer returned by `read()` is handed back to the
+    decoding thread on the next call to `read()`, so no copy is ever made.
+    Decoding therefore overlaps with the processing of the current frame (OpenCV
+    releases the GIL during decoding).
+    An exception raised by the decoding thread is raised again by `read()`.
+    """
+    _POLL_PERIOD = 0.1 # seconds
+
+    def __init__(self, video_path, num_buffers=4):
+        super(PrefetchingFrameSource, self).__init__(video_path)
+        if num_buffers < 2:
+            raise ValueError("At least 2 buffers are required for prefetching (got %d)." % num_buffers)
+        self.num_buffers = num_buffers
+
+        # Buffers are allocated with the shape of the first frame.
+        self._buffers = [None] * num_buffers
+        self._free = Queue.Queue()
+        self._ready = Queue.Queue()
+        for idx in range(num_buffers):
+            self._free.put(idx)
+        self._current = None # index of the buffer held by the consumer
+        self._eos = False
+        self._error = None # exception which stopped the decoding thread
+
+        # statistics
+        self._num_reads = 0
+        self._num_starved = 0 # reads which had to wait for the decoder
+        self._sum_occupancy = 0
+        self._max_occupancy = 0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decodeLoop, name="frame-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _decodeLoop(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    idx = self._free.get(timeout=self._POLL_PERIOD)
+                except Queue.Empty:
+                    continue
+                buf = self._buffers[idx]
+                if buf is None:
+                    (ok, frame) = self._capture.read()
+                else:
+                    (ok, frame) = self._capture.read(buf)
+                if ok and frame is not buf:
+                    # first use of this buffer, or change of frame size
+                    self._buffers[idx] = frame
+                self._ready.put((ok, idx))
+                if not ok:
+                    break
+        except Exception as e:
+            self._error = e
+            logger.debug("Decoding '%s' failed:\n%s", self.video_path, traceback.format_exc())
+
+    def read(self):
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        if self._eos:
+            return (False, None)
+
+        occupancy = self._ready.qsize()
+        self._num_reads += 1
+        self._sum_occupancy += occupancy
+        self._max_occupancy = max(self._max_occupancy, occupancy)
+        if occupancy == 0:
+            self._num_starved += 1
+
+        while True:
+            try:
+                (ok, idx) = self._ready.get(timeout=self._POLL_PERIOD)
+                break
+            except Queue.Empty:
+                # frames queued before the thread stopped are still read
+                if not self._thread.is_alive() and self._ready.empty():
+                    if self._error is not None:
+                        raise self._error
+                    raise IOError("Frame prefetching of '%s' stopped." % self.video_path)
+        if not ok:
+            self._eos = True
+            self._free.put(idx)
+            return (False, None)
+        self._current = idx
+        return (True, self._buffers[idx])
+
+    def occupancy(self):
+        return self._ready.qsize()
+
+    def getStats(self):
+        return {"num_buffers": self.num_buffers,
+                "num_reads": self._num_reads,
+                "num_starved_reads": self._num_starved,
+                "mean_occupancy": float(self._sum_occupancy) / self._num_reads if self._num_reads else 0.,
+                "max_occupancy": self._max_occupancy}
+
+    def release(self):
+        self._stop.set()
+        self._thread.join()
+        super(PrefetchingFrameSource, self).release()
+
+
+# ==============================================================================
+# Random access
+# OpenCV cannot seek frame-accurately in variable frame-rate videos: the position
+# requested is converted to a frame number using the average frame rate. Instead,
+# the timestamp of every frame (as reported by OpenCV) is recorded once in an
+# index; after a seek, the frame actually reached is identified by its
+# timestamp, and the target frame is reached by grabbing the frames in between.
+# If the seek overshot, or reached an unknown timestamp, seeking is given up for
+# this video and frames are decoded from the start.
+
+CAP_PROP_POS_MSEC = 0 # cv2.cv.CV_CAP_PROP_POS_MSEC
+FRAME_INDEX_VERSION = 1
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "smartdoc17", "frame_index")
+DEFAULT_FRAME_CACHE_SIZE = 256 * 1024**2 # bytes
+DEFAULT_SEEK_DISTANCE = 16 # frames
+_TIMESTAMP_TOLERANCE = 0.5 # ms
+
+def buildFrameIndex(video_path):
+    """
+    str ---> dict
+    Grab every frame of `video_path` (decoded but not converted) and return the
+    index of the video: number of frames and timestamp of each of them (ms).
+    """
+    capture = cv2.VideoCapture(video_path)
+    timestamps = []
+    try:
+        while capture.grab():
+            timestamps.append(capture.get(CAP_PROP_POS_MSEC))
+    finally:
+        capture.release()
+    return {"index_version": FRAME_INDEX_VERSION,
+            "opencv_version": cv2.__version__,
+            "num_frames": len(timestamps),
+            "timestamps": timestamps}
+
+def loadFrameIndex(video_path, index_dir=DEFAULT_INDEX_DIR):
+    """
+    str x str ---> dict
+    Return the index of `video_path` (see `buildFrameIndex`). Indexes are saved
+    to `index_dir` (unless None), keyed by the content hash of the video, and
+    only built the first time a video is opened.
+    """
+    if index_dir is None:
+        return buildFrameIndex(video_path)
+    path = os.path.join(index_dir, hashFile(video_path) + ".json")
+    try:
+        with open(path, "rb") as f:
+            index = json.loads(f.read().decode("utf-8"))
+        # timestamps depend on the video backend of OpenCV
+        if (index.get("index_version") == FRAME_INDEX_VERSION
+            and index.get("opencv_version") == cv2.__version__):
+            return index
+    except (IOError, OSError, ValueError):
+        pass
+
+    t_start = time()
+    index = buildFrameIndex(video_path)
+    logger.debug("Frame index of '%s' built in %.2fs (%d frames).", video_path, time() - t_start, index["num_frames"])
+    try:
+        try:
+            os.makedirs(index_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        atomicWrite(path, json.dumps(index).encode("utf-8"))
+    except (IOError, OSError) as e:
+        logger.warning("Could not save frame index '%s': %s", path, e)
+    return index
+
+class IndexedFrameSource(FrameSource):
+    """
+    Random access source of video frames, using the index of the video (see
+    `loadFrameIndex`).
+
+    `get(frame_id)` returns any frame: frames at most `seek_distance` frames
+    ahead of the last one decoded are reached by grabbing the frames in between,
+    other ones by seeking. Decoded frames are kept in a least recently used
+    cache of at most `cache_size` bytes, so the frames returned are shared with
+    the cache and must not be modified.
+    `read()` returns the frames in order, from the first one.
+    """
+    def __init__(self, video_path, cache_size=DEFAULT_FRAME_CACHE_SIZE, index_dir=DEFAULT_INDEX_DIR,
+                 seek_distance=DEFAULT_SEEK_DISTANCE):
+        super(IndexedFrameSource, self).__init__(video_path)
+        index = loadFrameIndex(video_path, index_dir)
+        self.num_frames = index["num_frames"]
+        self.timestamps = np.float64(index["timestamps"])
+        self.cache_size = cache_size
+        self.seek_distance = seek_distance
+        # frames can only be identified after a seek if timestamps are distinct
+        self._seekable = bool(np.all(np.diff(self.timestamps) > _TIMESTAMP_TOLERANCE))
+        self._position = -1 # last frame grabbed by the capture
+        self._next_read = 0
+        self._cache = collections.OrderedDict()
+        self._cache_bytes = 0
+
+        # statistics
+        self._num_gets = 0
+        self._num_hits = 0
+        self._num_seeks = 0
+        self._num_failed_seeks = 0
+        self._num_rewinds = 0
+        self._num_grabs = 0
+
+    def _identify(self, timestamp):
+        """
+        Return the id of the frame at `timestamp`, or None if there is none.
+        """
+        k = int(np.searchsorted(self.timestamps, timestamp))
+        for fidx in (k - 1, k):
+            if 0 <= fidx < self.num_frames and abs(self.timestamps[fidx] - timestamp) < _TIMESTAMP_TOLERANCE:
+                return fidx
+        return None
+
+    def _rewind(self):
+        self._capture.release()
+        self._capture = cv2.VideoCapture(self.video_path)
+        self._position = -1
+        self._num_rewinds += 1
+
+    def _seek(self, frame_id):
+        """
+        Move the capture to `frame_id`, or to a frame before it.
+        """
+        self._num_seeks += 1
+        self._capture.set(CAP_PROP_POS_MSEC, self.timestamps[frame_id])
+        reached = self._identify(self._capture.get(CAP_PROP_POS_MSEC)) if self._capture.grab() else None
+        if reached is None or reached > frame_id:
+            self._num_failed_seeks += 1
+            self._seekable = False
+            logger.debug("Seeking is not frame accurate in '%s', frames will be decoded from the start.",
+                         self.video_path)
+            self._rewind()
+        else:
+            self._position = reached
+
+    def _decode(self, frame_id):
+        if frame_id <= self._position or frame_id > self._position + self.seek_distance:
+            if self._seekable and frame_id > 0:
+                self._seek(frame_id)
+            elif frame_id <= self._position:
+                self._rewind()
+        while self._position < frame_id:
+            if not self._capture.grab():
+                return None
+            self._position += 1
+            self._num_grabs += 1
+        (ok, frame) = self._capture.retrieve()
+        return frame if ok else None
+
+    def get(self, frame_id):
+        """
+        IndexedFrameSource x int ---> ndarray or None
+        Return frame `frame_id` (0-indexed), or None if there is no such frame.
+        """
+        if not 0 <= frame_id < self.num_frames:
+            return None
+        self._num_gets += 1
+        frame = self._cache.pop(frame_id, None)
+        if frame is not None:
+            self._num_hits += 1
+            self._cache[frame_id] = frame # most recently used
+            return frame
+
+        frame = self._decode(frame_id)
+        if frame is not None and frame.nbytes <= self.cache_size:
+            self._cache[frame_id] = frame
+            self._cache_bytes += frame.nbytes
+            while self._cache_bytes > self.cache_size:
+                (_, evicted) = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
+        return frame
+
+    def iterFrames(self, frame_ids):
+        """
+        IndexedFrameSource x iterable(int) ---> generator(tuple(int, ndarray))
+        Yield tuple(frame_id, frame) for each id of `frame_ids` (increasing ids
+        are decoded the most efficiently), until the end of the video.
+        """
+        for frame_id in frame_ids:
+            frame = self.get(frame_id)
+            if frame is None:
+                return
+            yield (frame_id, frame)
+
+    def iterRange(self, start=0, stop=None, step=1):
+        """
+        IndexedFrameSource x int x int x int ---> generator(tuple(int, ndarray))
+        Yield frames `start`, `start + step`, ... before `stop` (default: until
+        the end of the video).
+        """
+        stop = self.num_frames if stop is None else min(stop, self.num_frames)
+        return self.iterFrames(range(start, stop, step))
+
+    def iterSampled(self, num_samples):
+        """
+        IndexedFrameSource x int ---> generator(tuple(int, ndarray))
+        Yield `num_samples` frames evenly spread over the video.
+        """
+        frame_ids = np.unique(np.linspace(0, self.num_frames - 1, num_samples).round().astype(int))
+        return self.iterFrames(int(fidx) for fidx in frame_ids)
+
+    def read(self):
+        frame = self.get(self._next_read)
+        if frame is None:
+            return (False, None)
+        self._next_read += 1
+        return (True, frame)
+
+    def getStats(self):
+        return {"num_frames": self.num_frames,
+                "seekable": self._seekable,
+                "num_gets": self._num_gets,
+                "cache_hits": self._num_hits,
+                "cache_bytes": self._cache_bytes,
+                "num_seeks": self._num_seeks,
+                "num_failed_seeks": self._num_failed_seeks,
+                "num_rewinds": self._num_rewinds,
+                "num_grabs": self._num_grabs}
+
+
+# ==============================================================================
+def openFrameSource(video_path, prefetch=4):
+    """
+    str x int ---> FrameSource
+    Open `video_path` with `prefetch` frames decoded in advance (0 disables
+    prefetching).
+    """
+    if prefetch > 0:
+        return PrefetchingFrameSource(video_path, num_buffers=max(2, prefetch + 1))
+    return FrameSource(video_path)
+
+def logFrameSourceStats(logger, frames):
+    stats = frames.getStats()
+    if "num_buffers" in stats:
+        logger.debug("Frame prefetching: %d reads, %d had to wait for decoding, "
+                     "queue occupancy mean=%.2f max=%d (%d buffers).",
+                     stats["num_reads"], stats["num_starved_reads"],
+                     stats["mean_occupancy"], stats["max_occupancy"], stats["num_buffers"])
+
+def readFrame(video_path, frame_id):
+    """
+    str x int ---> ndarray or None
+    Decode and return frame `frame_id` (0-indexed) of `video_path`. Previous
+    frames are grabbed (decoded but not converted) because seeking is not
+    frame-accurate with variable frame-rate videos.
+    Deprecated: `IndexedFrameSource(video_path).get(frame_id)` returns the same
+    frame, seeking to it when the video allows it. Only kept as the reference
+    of benchmarks/bench_frame_access.py.
+    """
+    capture = cv2.VideoCapture(video_path)
+    try:
+        for _ in range(frame_id):
+            if not capture.grab():
+                return None
+        (ok, frame) = capture.read()
+        return frame if ok else None
+    finally:
+        capture.release()
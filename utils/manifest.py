@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Build manifests, to skip samples whose outputs are up to date.
+
+After the outputs of a sample are generated, a manifest is written next to
+them. It records everything the outputs depend on: content hashes of the
+input files, tracker name and parameters, output-related options, and the
+program which generated them, along with the hashes of the outputs. A later
+run can skip the sample if all of them are unchanged. Code changes are only
+detected through the program version: it must be bumped with any change which
+may change the outputs.
+
+The manifest is written last (atomically) and removed before outputs are
+regenerated, so an interrupted run never leaves a valid manifest next to
+incomplete outputs: re-running the same command resumes where it stopped.
+"""
+
+# ==============================================================================
+# Imports
+import os
+import os.path
+import hashlib
+import json
+import tempfile
+
+# ==============================================================================
+from utils.reference import OUT_FILE_MANIFEST
+
+# ==============================================================================
+MANIFEST_VERSION = 1
+
+# ==============================================================================
+def hashFile(path, block_size=1<<20):
+    """
+    str ---> str
+    Return the SHA-1 hex digest of the content of the file at `path`.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        block = f.read(block_size)
+        while block:
+            h.update(block)
+            block = f.read(block_size)
+    return h.hexdigest()
+
+def fingerprintFile(path, previous=None):
+    """
+    str x dict ---> dict
+    Return the fingerprint (SHA-1, size and modification time) of the file at
+    `path`. If `previous` (an earlier fingerprint of the same file) has the
+    same size and modification time, its hash is reused instead of reading
+    the file again, as `make` or `git` do.
+    """
+    st = os.stat(path)
+    if (previous is not None
+        and previous.get("size") == st.st_size
+        and previous.get("mtime") == st.st_mtime):
+        return previous
+    return {"sha1": hashFile(path), "size": st.st_size, "mtime": st.st_mtime}
+
+def loadManifest(output_dir):
+    """
+    str ---> dict or None
+    Return the manifest of `output_dir`, or None if there is no valid one.
+    """
+    try:
+        with open(os.path.join(output_dir, OUT_FILE_MANIFEST), "rb") as f:
+            manifest = json.loads(f.read().decode("utf-8"))
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("manifest_version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def buildManifest(output_dir, inputs, tracker, options, program_name, program_version):
+    """
+    str x dict(str: str) x Tracker x dict x str x str ---> dict
+    Return the manifest describing how the outputs of `output_dir` are to be
+    generated (without the outputs themselves), given `inputs` (a dictionary
+    of input file paths, by role), the tracker, and the options which have an
+    influence on outputs.
+    Input hashes are reused from the current manifest, if any, for files which
+    were not modified since.
+    """
+    previous = loadManifest(output_dir) or {}
+    previous_inputs = previous.get("inputs", {})
+    return {"manifest_version": MANIFEST_VERSION,
+            "program": program_name,
+            "program_version": program_version,
+            "tracker": {"name": tracker.getName(), "params": tracker.getParams()},
+            "options": options,
+            "inputs": dict((role, fingerprintFile(path, previous_inputs.get(role)))
+                           for (role, path) in inputs.items())}
+
+def _hashes(fingerprints):
+    return dict((k, fp["sha1"]) for (k, fp) in fingerprints.items())
+
+def checkManifest(output_dir, expected):
+    """
+    str x dict ---> tuple(bool, str)
+    Tell whether the outputs of `output_dir` are up to date with respect to
+    the `expected` manifest (see `buildManifest`), and if not, why.
+    """
+    manifest = loadManifest(output_dir)
+    if manifest is None:
+        return (False, "no manifest")
+    for key in ("program", "program_version", "tracker", "options"):
+        # round trip through JSON, so that types compare as in the manifest
+        if manifest.get(key) != json.loads(json.dumps(expected[key])):
+            return (False, "%s changed" % key.replace("_", " "))
+    if _hashes(manifest.get("inputs", {})) != _hashes(expected["inputs"]):
+        return (False, "inputs changed")
+    for (name, fingerprint) in manifest.get("outputs", {}).items():
+        path = os.path.join(output_dir, name)
+        if not os.path.isfile(path):
+            return (False, "missing output '%s'" % name)
+        if fingerprintFile(path, fingerprint)["sha1"] != fingerprint["sha1"]:
+            return (False, "modified output '%s'" % name)
+    return (True, "up to date")
+
+def invalidateManifest(output_dir):
+    """
+    Remove the manifest of `output_dir` (if any): to be called before outputs
+    are (re)generated.
+    """
+    try:
+        os.remove(os.path.join(output_dir, OUT_FILE_MANIFEST))
+    except OSError:
+        pass
+
+def saveManifest(output_dir, expected, output_files):
+    """
+    str x dict x list(str) ---> dict
+    Write the manifest of `output_dir`: the `expected` manifest (see
+    `buildManifest`) completed with the fingerprints of `output_files` (names
+    relative to `output_dir`). Return the manifest.
+    """
+    manifest = dict(expected)
+    manifest["outputs"] = dict((name, fingerprintFile(os.path.join(output_dir, name)))
+                               for name in output_files)
+    (fd, tmp_path) = tempfile.mkstemp(prefix=".manifest", dir=output_dir)
+    try:
+        with os.fdopen(fd, "wb") as output:
+            output.write(json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+        os.rename(tmp_path, os.path.join(output_dir, OUT_FILE_MANIFEST))
+    except:
+        os.remove(tmp_path)
+        raise
+    return manifest
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Asynchronous writing of output files.
+
+Encoding large PNG images takes a while: instead of blocking the main thread,
+output files are queued to a small pool of writer threads (OpenCV encoding,
+zlib compression and file I/O release the GIL). Every file is written to a
+temporary file first, then renamed, so that an interrupted run never leaves a
+truncated output behind.
+
+Data given to the writer (images in particular) must not be modified once
+queued.
+"""
+
+# ==============================================================================
+# Imports
+import os
+import os.path
+import json
+import logging
+import threading
+import traceback
+import Queue
+
+import cv2
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+DEFAULT_NUM_THREADS = 2
+DEFAULT_PNG_COMPRESSION = 3 # same as cv2.imwrite
+
+# ==============================================================================
+def temporaryPath(path):
+    """
+    Return the path of the temporary file to write before renaming it to
+    `path`: in the same directory (renaming is atomic within a file system),
+    hidden, and unique to the calling process and thread.
+    """
+    (dir_name, base_name) = os.path.split(path)
+    return os.path.join(dir_name, ".%s.%d-%d.tmp" % (base_name, os.getpid(), threading.current_thread().ident))
+
+def atomicWrite(path, data):
+    """
+    Write `data` (bytes) to the file `path` atomically.
+    """
+    tmp_path = temporaryPath(path)
+    try:
+        with open(tmp_path, "wb") as output:
+            output.write(data)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def writeImage(path, img, png_compression=DEFAULT_PNG_COMPRESSION):
+    """
+    Encode `img` according to the extension of `path`, and write it atomically.
+    """
+    ext = os.path.splitext(path)[1]
+    params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression] if ext.lower() == ".png" else []
+    (ok, buf) = cv2.imencode(ext, img, params)
+    if not ok:
+        raise IOError("Could not encode image '%s'" % path)
+    atomicWrite(path, buf.tobytes())
+
+# ==============================================================================
+class WriteTask(object):
+    """
+    An output queued to an `OutputWriter`.
+    """
+    def __init__(self, description, fun, args, after):
+        self.description = description
+        self._fun = fun
+        self._args = args
+        self._after = after
+        self._done = threading.Event()
+        self.error = None # error message if the task failed
+
+    def _run(self):
+        try:
+            for task in self._after:
+                task._done.wait()
+                if task.error is not None:
+                    raise IOError("depends on %s, which failed" % task.description)
+            self._fun(*self._args)
+        except Exception as e:
+            self.error = "%s: %s" % (e.__class__.__name__, e)
+            logger.debug("Writing %s failed:\n%s", self.description, traceback.format_exc())
+        finally:
+            self._done.set()
+            self._fun = self._args = self._after = None # release data
+
+    def wait(self):
+        """
+        Wait until the task is complete. Return True if it succeeded.
+        """
+        self._done.wait()
+        return self.error is None
+
+class OutputWriter(object):
+    """
+    Pool of `num_threads` threads writing output files in the background (0:
+    files are written immediately, by the calling thread).
+    `wait()` (or `close()`) must be called before exiting, to make sure every
+    file is written: it raises an IOError if any write failed.
+    """
+    def __init__(self, num_threads=DEFAULT_NUM_THREADS, png_compression=DEFAULT_PNG_COMPRESSION):
+        self.num_threads = num_threads
+        self.png_compression = png_compression
+        self._queue = Queue.Queue()
+        self._pending = []
+        self._threads = []
+        for k in range(num_threads):
+            thread = threading.Thread(target=self._writeLoop, name="output-writer-%d" % k)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _writeLoop(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            task._run()
+
+    def submit(self, description, fun, args=(), after=()):
+        """
+        OutputWriter x str x function x tuple x list(WriteTask) ---> WriteTask
+        Queue the call `fun(*args)`, to be run once the tasks `after` are
+        complete (it fails if any of them failed).
+        """
+        task = WriteTask(description, fun, args, list(after))
+        self._pending.append(task)
+        if self._threads:
+            self._queue.put(task)
+        else:
+            task._run()
+        return task
+
+    def writeImage(self, path, img, after=()):
+        """
+        Queue the encoding (according to the extension of `path`) and writing
+        of `img`.
+        """
+        return self.submit("'%s'" % path, writeImage, (path, img, self.png_compression), after)
+
+    def writeJson(self, path, obj, after=(), **dump_args):
+        """
+        Queue the writing of `obj` as JSON (serialized immediately, so that
+        `obj` can be modified afterwards).
+        """
+        data = json.dumps(obj, **dump_args).encode("utf-8")
+        return self.submit("'%s'" % path, atomicWrite, (path, data), after)
+
+    def wait(self):
+        """
+        Wait until every queued task is complete. Raise an IOError describing
+        the failed ones, if any.
+        """
+        (pending, self._pending) = (self._pending, [])
+        failed = [task for task in pending if not task.wait()]
+        if failed:
+            raise IOError("%d output(s) could not be written: %s"
+                          % (len(failed), "; ".join("%s (%s)" % (t.description, t.error) for t in failed)))
+
+    def close(self):
+        """
+        Wait for queued tasks (see `wait`), then stop the writer threads.
+        """
+        try:
+            self.wait()
+        finally:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # do not hide the original exception
+            try:
+                self.close()
+            except IOError as e:
+                logger.error("%s", e)
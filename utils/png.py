@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Minimal PNG support for images which are produced by horizontal bands (see
+utils/dewarp.py): the encoder only needs the rows of the current band, so the
+full image never has to be held in memory.
+"""
+
+# ==============================================================================
+# Imports
+import os
+import struct
+import zlib
+
+import numpy as np
+
+# ==============================================================================
+from utils.output import temporaryPath
+
+# ==============================================================================
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# color types, by number of channels
+_COLOR_TYPES = {1: 0,  # grayscale
+                3: 2,  # RGB
+                4: 6}  # RGBA
+
+# ==============================================================================
+def readPngShape(path):
+    """
+    str ---> tuple(int, int)
+    Return the (height, width) of the PNG image at `path`, reading only its
+    header.
+    """
+    with open(path, "rb") as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        raise ValueError("Not a PNG file: '%s'" % path)
+    (width, height) = struct.unpack(">II", header[16:24])
+    return (height, width)
+
+
+class PngStreamWriter(object):
+    """
+    Write an 8-bit PNG image band after band.
+    Bands are given as OpenCV images (BGR, BGRA or grayscale), top to bottom,
+    and must add up to exactly `height` rows. Each row is filtered with the
+    filter (none, sub or up) which minimizes the sum of absolute differences,
+    as libpng does, and compressed as soon as it is received.
+    The image is written to a temporary file, renamed to `path` by `close()`.
+    """
+    def __init__(self, path, width, height, channels=3, compression=3):
+        if channels not in _COLOR_TYPES:
+            raise ValueError("Unsupported number of channels: %d" % channels)
+        self.path = path
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self._rows_written = 0
+        self._prev_row = np.zeros(width * channels, np.uint8)
+        self._compressor = zlib.compressobj(compression)
+        self._tmp_path = temporaryPath(path)
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(PNG_SIGNATURE)
+        self._writeChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, _COLOR_TYPES[channels], 0, 0, 0))
+
+    def _writeChunk(self, tag, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(tag)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff))
+
+    def _filterRows(self, rows):
+        """
+        Return the filtered scanlines of `rows` (uint8 array of shape
+        (num_rows, width * channels)), each prefixed by its filter type byte.
+        """
+        bpp = self.channels
+        prev = np.vstack((self._prev_row[np.newaxis, :], rows[:-1]))
+        sub = rows.copy()
+        sub[:, bpp:] -= rows[:, :-bpp]
+        up = rows - prev
+        # indexed by PNG filter type: 0 = none, 1 = sub, 2 = up
+        candidates = np.array([rows, sub, up])
+        # libpng heuristic: bytes as signed values, minimum sum of magnitudes
+        costs = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+        best = costs.argmin(axis=0)
+        out = np.empty((rows.shape[0], rows.shape[1] + 1), np.uint8)
+        out[:, 0] = best
+        out[:, 1:] = candidates[best, np.arange(rows.shape[0])]
+        return out
+
+    def write(self, band):
+        """
+        Append the rows of `band` (uint8 array of shape (rows, width) or
+        (rows, width, channels)) to the image.
+        """
+        num_rows = band.shape[0]
+        channels = band.shape[2] if band.ndim == 3 else 1
+        if band.shape[1] != self.width or channels != self.channels:
+            raise ValueError("Band shape %s does not match image (w=%d, channels=%d)"
+                             % (band.shape, self.width, self.channels))
+        if self._rows_written + num_rows > self.height:
+            raise ValueError("Too many rows written to '%s'" % self.path)
+        if num_rows == 0:
+            return
+        if self.channels == 3:
+            band = band[..., ::-1] # BGR -> RGB
+        elif self.channels == 4:
+            band = band[..., [2, 1, 0, 3]] # BGRA -> RGBA
+        rows = np.ascontiguousarray(band, np.uint8).reshape(num_rows, -1)
+        data = self._compressor.compress(self._filterRows(rows).tobytes())
+        if data:
+            self._writeChunk(b"IDAT", data)
+        self._prev_row = rows[-1].copy()
+        self._rows_written += num_rows
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            if self._rows_written != self.height:
+                raise ValueError("Incomplete image '%s': %d rows written out of %d"
+                                 % (self.path, self._rows_written, self.height))
+            self._writeChunk(b"IDAT", self._compressor.flush())
+            self._writeChunk(b"IEND", b"")
+            self._file.close()
+            self._file = None
+            os.rename(self._tmp_path, self.path)
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                os.remove(self._tmp_path)
+
+    def abort(self):
+        """
+        Stop writing and remove the (incomplete) image file.
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # do not mask the original error, and leave no truncated image
+            self.abort()
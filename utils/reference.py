@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import os.path
+import json
+
+import cv2
+import numpy as np
+
+from utils.dewarp import dewarpToPng, DEFAULT_BAND_ROWS
+from utils.output import OutputWriter
+
+# ==============================================================================
+# Output file names (relative to the sample output directory)
+OUT_FILE_LOG = "create_reference.log"
+OUT_FILE_STATS = "create_reference_stats.json"
+OUT_FILE_MANIFEST = "manifest.json"
+OUT_FILE_JSON = "sample.json"
+OUT_FILE_FRAME_EXTRACTED = "reference_frame_%02d_extracted.png"
+OUT_FILE_FRAME_EXTRACTED_VIZ = "reference_frame_%02d_extracted_viz.png"
+OUT_FILE_FRAME_DEWARPED = "reference_frame_%02d_dewarped.png"
+OUT_FILE_CANDIDATE_DEWARPED = "candidate_frame_%02d_dewarped.png"
+
+# Input file names (relative to a sample directory of the dataset)
+IN_FILE_GROUND_TRUTH = "ground-truth.png"
+IN_FILE_VIDEO = "input.mp4"
+
+# ==============================================================================
+def listSamples(dataset_root):
+    """
+    str ---> list(str)
+    Return the sorted list of sample directories under `dataset_root`, ie. every
+    direct sub-directory containing both a ground truth image and a video input.
+    """
+    samples = []
+    for name in sorted(os.listdir(dataset_root)):
+        sample_dir = os.path.join(dataset_root, name)
+        if (os.path.isfile(os.path.join(sample_dir, IN_FILE_GROUND_TRUTH))
+            and os.path.isfile(os.path.join(sample_dir, IN_FILE_VIDEO))):
+            samples.append(sample_dir)
+    return samples
+
+def logDetection(logger, fidx, rejected, tl, bl, br, tr):
+    if not rejected:
+        logger.info("frame %04d: A "
+                    "tl:(%4d,%4d) bl:(%4d,%4d) br:(%4d,%4d) tr:(%4d,%4d)",
+                    fidx, tl.x, tl.y, bl.x, bl.y, br.x, br.y, tr.x, tr.y)
+    else:
+        logger.info("frame %04d: R", fidx)
+
+def drawDetection(frame, rejected, tl, bl, br, tr):
+    """
+    Return a copy of `frame` with the detected quadrilateral drawn over it, or
+    a red dot at the center of the frame if the detection was rejected.
+    """
+    draw_mat = frame.copy()
+    if not rejected:
+        dbgq = np.int32([[tl.x, tl.y],
+                         [bl.x, bl.y],
+                         [br.x, br.y],
+                         [tr.x, tr.y]])
+        cv2.polylines(draw_mat, [dbgq], True, (0, 255, 0), 2)
+
+        for pt in (tl, bl, br, tr):
+            cv2.putText(draw_mat, pt.name.upper(), (int(pt.x), int(pt.y)), cv2.FONT_HERSHEY_PLAIN, 2, (64, 255, 64), 2)
+    else:
+        (fh, fw) = frame.shape[:2]
+        cv2.circle(draw_mat, (fw/2, fh/2), 20, (0, 0, 255), 10)
+    return draw_mat
+
+def sampleResults(target_shape, frame_shape, fidx, tl, bl, br, tr):
+    """
+    Build the content of the `sample.json` file.
+    Shapes are (height, width, ...) tuples, as given by `ndarray.shape`.
+    """
+    return {
+        "target_image_shape": {"x_len": target_shape[1], "y_len": target_shape[0]},
+        "input_video_shape": {"x_len": frame_shape[1], "y_len": frame_shape[0]},
+        "reference_frame_id": fidx,
+        "object_coord_in_ref_frame": {
+            "top_left": {"x": tl.x, "y": tl.y},
+            "bottom_left": {"x": bl.x, "y": bl.y},
+            "bottom_right": {"x": br.x, "y": br.y},
+            "top_right": {"x": tr.x, "y": tr.y},
+        }
+    }
+
+def dewarpTransform(tl, bl, br, tr, target_shape):
+    """
+    Return the perspective transform which maps the object quadrilateral
+    to the target image shape.
+    """
+    shape_object = np.float32([[tl.x, tl.y],
+                               [bl.x, bl.y],
+                               [br.x, br.y],
+                               [tr.x, tr.y]])
+    shape_target = np.float32([[0, 0],
+                               [0, target_shape[0]-1],
+                               [target_shape[1]-1, target_shape[0]-1],
+                               [target_shape[1]-1, 0]])
+    return cv2.getPerspectiveTransform(shape_object, shape_target)
+
+def dewarpFrame(frame, tl, bl, br, tr, target_shape):
+    trans = dewarpTransform(tl, bl, br, tr, target_shape)
+    return cv2.warpPerspective(frame, trans, (target_shape[1], target_shape[0]))
+
+def referenceOutputFiles(fidx, candidate_ids=()):
+    """
+    Return the names of the files written by `saveReference` for frame `fidx`
+    (and the candidate frames `candidate_ids`).
+    """
+    return ([OUT_FILE_JSON,
+             OUT_FILE_FRAME_EXTRACTED % fidx,
+             OUT_FILE_FRAME_EXTRACTED_VIZ % fidx,
+             OUT_FILE_FRAME_DEWARPED % fidx]
+            + [OUT_FILE_CANDIDATE_DEWARPED % cidx for cidx in candidate_ids])
+
+def saveReference(output_dir, fidx, frame, draw_mat, tl, bl, br, tr, target_shape, logger,
+                  band_rows=DEFAULT_BAND_ROWS, writer=None, candidates=()):
+    """
+    Write `sample.json` and the extracted, visualization and dewarped versions
+    of the reference frame `fidx` to `output_dir`.
+    Dewarped frames are computed and written by bands of `band_rows` rows (see
+    utils/dewarp.py), so that the full target image is never held in memory
+    (0: whole frames at once).
+    `candidates` is a list of tuple(fidx, frame, tl, bl, br, tr) of other
+    frames to dewarp too (for instance the runner-ups of the automatic
+    selection, to compare them with the reference frame), in the same pass.
+    If an OutputWriter `writer` is given, files are only queued to it (`frame`
+    and `draw_mat` must not be modified until they are written), otherwise they
+    are written before returning.
+    Return the list of WriteTask of the files.
+    """
+    out_path_json = os.path.join(output_dir, OUT_FILE_JSON)
+    out_path_frame_extracted = os.path.join(output_dir, OUT_FILE_FRAME_EXTRACTED % fidx)
+    out_path_frame_extracted_viz = os.path.join(output_dir, OUT_FILE_FRAME_EXTRACTED_VIZ % fidx)
+    out_path_frame_dewarped = os.path.join(output_dir, OUT_FILE_FRAME_DEWARPED % fidx)
+
+    sync_writer = None
+    if writer is None:
+        writer = sync_writer = OutputWriter(num_threads=0)
+    dewarp_frames = [frame]
+    dewarp_transforms = [dewarpTransform(tl, bl, br, tr, target_shape)]
+    dewarp_paths = [out_path_frame_dewarped]
+    for (cidx, cframe, ctl, cbl, cbr, ctr) in candidates:
+        dewarp_frames.append(cframe)
+        dewarp_transforms.append(dewarpTransform(ctl, cbl, cbr, ctr, target_shape))
+        dewarp_paths.append(os.path.join(output_dir, OUT_FILE_CANDIDATE_DEWARPED % cidx))
+    # the largest files first
+    tasks = [writer.submit(", ".join("'%s'" % path for path in dewarp_paths), dewarpToPng,
+                           (dewarp_frames, dewarp_transforms, target_shape, dewarp_paths, band_rows,
+                            writer.png_compression)),
+             writer.writeImage(out_path_frame_extracted, frame),
+             writer.writeImage(out_path_frame_extracted_viz, draw_mat),
+             writer.writeJson(out_path_json, sampleResults(target_shape, frame.shape, fidx, tl, bl, br, tr),
+                              indent=2)]
+    logger.debug("Reference files queued for writing to %s" % output_dir)
+    if sync_writer is not None:
+        sync_writer.close()
+    return tasks
+
+def saveStats(path, tracker, frames=None, logger=None, writer=None):
+    """
+    Write the statistics collected by `tracker` (see `Tracker.enableStats`),
+    and the prefetching statistics of the frame source `frames` if any, to the
+    JSON file `path`, or queue it to the OutputWriter `writer` if given.
+    Return the WriteTask of the file, if queued.
+    """
+    report = tracker.getStats()
+    if frames is not None:
+        report["frame_source"] = frames.getStats()
+    if writer is not None:
+        return writer.writeJson(path, report, indent=2, sort_keys=True)
+    with open(path, "wb") as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    if logger is not None:
+        logger.debug("Statistics file generated: %s" % path)
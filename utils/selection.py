@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import logging
+import multiprocessing
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.frames import IndexedFrameSource, loadFrameIndex, DEFAULT_INDEX_DIR
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Detection of the document in a candidate reference frame, along with the
+# signals used to score it.
+#   num_inliers   RANSAC inliers of the homography
+#   reproj_error  mean reprojection error of inliers (frame pixels)
+#   area_ratio    area of the quad / area of the frame
+#   visibility    fraction of the 4 corners which lie inside the frame
+#   sharpness     variance of the Laplacian over the document region
+Candidate = namedtuple("Candidate", ["frame_id", "tl", "bl", "br", "tr",
+                                     "num_inliers", "reproj_error",
+                                     "area_ratio", "visibility", "sharpness"])
+
+# Relative weights of the (normalized) signals in the score of a candidate.
+DEFAULT_WEIGHTS = {"num_inliers": 0.35,
+                   "reproj_error": 0.15,
+                   "area_ratio": 0.15,
+                   "visibility": 0.10,
+                   "sharpness": 0.25}
+
+MIN_AREA_RATIO = 0.05
+
+# Frames are scanned by contiguous chunks of this many frames (see `scanChunks`).
+DEFAULT_SCAN_CHUNK_SIZE = 15
+
+# ==============================================================================
+def measureSharpness(frame, tl, bl, br, tr):
+    """
+    Variance of the Laplacian of the frame (reduced once) within the bounding
+    box of the quad.
+    """
+    (fh, fw) = frame.shape[:2]
+    xs = [pt.x for pt in (tl, bl, br, tr)]
+    ys = [pt.y for pt in (tl, bl, br, tr)]
+    x0 = int(max(0, min(xs)))
+    y0 = int(max(0, min(ys)))
+    x1 = int(min(fw, max(xs)))
+    y1 = int(min(fh, max(ys)))
+    if x1 - x0 < 8 or y1 - y0 < 8:
+        return 0.
+    gray = cv2.cvtColor(cv2.pyrDown(frame[y0:y1, x0:x1]), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def evaluateFrame(tracker, frame_id, frame):
+    """
+    Tracker x int x ndarray ---> Candidate or None
+    Process `frame` with `tracker` and return the corresponding candidate, or
+    None if the detection was rejected or is not a plausible document outline
+    (non convex, or too small).
+    """
+    (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
+    if rejected:
+        return None
+
+    (fh, fw) = frame.shape[:2]
+    quad = np.float32([[pt.x, pt.y] for pt in (tl, bl, br, tr)])
+    if not cv2.isContourConvex(quad.reshape(-1, 1, 2)):
+        logger.debug("frame %04d: candidate discarded (non convex quad)", frame_id)
+        return None
+    area_ratio = cv2.contourArea(quad.reshape(-1, 1, 2)) / float(fw * fh)
+    if area_ratio < MIN_AREA_RATIO:
+        logger.debug("frame %04d: candidate discarded (area ratio %.3f < %.3f)", frame_id, area_ratio, MIN_AREA_RATIO)
+        return None
+
+    inside = ((quad[:, 0] >= 0) & (quad[:, 0] < fw) & (quad[:, 1] >= 0) & (quad[:, 1] < fh)).sum()
+    info = tracker.getFrameInfo()
+    return Candidate(frame_id=frame_id, tl=tl, bl=bl, br=br, tr=tr,
+                     num_inliers=info.get("num_inliers", 0),
+                     reproj_error=info.get("reproj_error", 0.),
+                     area_ratio=area_ratio,
+                     visibility=inside / 4.,
+                     sharpness=measureSharpness(frame, tl, bl, br, tr))
+
+def scanChunks(num_frames, chunk_size=DEFAULT_SCAN_CHUNK_SIZE):
+    """
+    int x int ---> list(tuple(start, stop))
+    Split the first `num_frames` frames into contiguous chunks of at most
+    `chunk_size` frames.
+    """
+    return [(start, min(start + chunk_size, num_frames)) for start in range(0, num_frames, chunk_size)]
+
+def _scanChunk(tracker, frames, start, stop):
+    """
+    Evaluate frames `start` to `stop - 1` of the IndexedFrameSource `frames`.
+    Each chunk is processed as a sequence of its own (the tracker is
+    reinitialized at its first frame), so that candidates do not depend on
+    whether the chunks are scanned by one process or distributed over several.
+    """
+    candidates = []
+    frame_size = None
+    for fidx in range(start, stop):
+        with tracker.stats.timer("decode"):
+            frame = frames.get(fidx)
+        if frame is None:
+            break
+        if frame_size != frame.shape[:2]:
+            frame_size = frame.shape[:2]
+            tracker.reinitFrameSize(frame_size[1], frame_size[0])
+        candidate = evaluateFrame(tracker, fidx, frame)
+        if candidate is not None:
+            candidates.append(candidate)
+    return candidates
+
+def scanCandidates(tracker, video_path, num_frames, chunk_size=DEFAULT_SCAN_CHUNK_SIZE,
+                   index_dir=DEFAULT_INDEX_DIR):
+    """
+    Tracker x str x int x int x str ---> list(Candidate)
+    Evaluate the first `num_frames` frames of `video_path`, by chunks of
+    `chunk_size` frames (see `scanChunks`). `index_dir`: see `loadFrameIndex`.
+    """
+    candidates = []
+    frames = IndexedFrameSource(video_path, cache_size=0, index_dir=index_dir)
+    try:
+        for (start, stop) in scanChunks(num_frames, chunk_size):
+            candidates.extend(_scanChunk(tracker, frames, start, stop))
+    finally:
+        frames.release()
+    return candidates
+
+def scoreCandidates(candidates, weights=DEFAULT_WEIGHTS):
+    """
+    list(Candidate) x dict ---> list(tuple(score:float, Candidate))
+    Return candidates sorted by decreasing score (earliest frame first for
+    equal scores). Each signal is normalized over the candidates, so that scores
+    lie within [0, 1].
+    """
+    if not candidates:
+        return []
+    max_inliers = float(max(c.num_inliers for c in candidates)) or 1.
+    min_error = min(c.reproj_error for c in candidates)
+    max_area = max(c.area_ratio for c in candidates) or 1.
+    max_sharpness = max(c.sharpness for c in candidates) or 1.
+
+    scored = []
+    for c in candidates:
+        signals = {"num_inliers": c.num_inliers / max_inliers,
+                   "reproj_error": (min_error / c.reproj_error) if c.reproj_error > 0 else 1.,
+                   "area_ratio": c.area_ratio / max_area,
+                   "visibility": c.visibility,
+                   "sharpness": c.sharpness / max_sharpness}
+        score = sum(weights[k] * signals[k] for k in weights) / sum(weights.values())
+        scored.append((score, c))
+    scored.sort(key=lambda sc: (-sc[0], sc[1].frame_id))
+    return scored
+
+# ==============================================================================
+# Parallel scan: each worker process owns its own tracker, configured like the
+# tracker of the main process, and evaluates whole chunks of frames (seeking to
+# the first frame of each chunk).
+_worker_tracker = None
+
+def _initScanWorker(tracker_name, tracker_params, ground_truth_image, model_cache_dir, model_cache_size):
+    global _worker_tracker
+    from trackers import createTracker
+    from trackers.DescriptorCache import DescriptorCache
+    _worker_tracker = createTracker(tracker_name)
+    _worker_tracker.setParams(tracker_params)
+    if model_cache_dir is not None:
+        _worker_tracker.setModelCache(DescriptorCache(model_cache_dir, model_cache_size))
+    _worker_tracker.reconfigureModel(ground_truth_image)
+
+def _scanWorker(task):
+    (video_path, start, stop, index_dir) = task
+    frames = IndexedFrameSource(video_path, cache_size=0, index_dir=index_dir)
+    try:
+        return _scanChunk(_worker_tracker, frames, start, stop)
+    finally:
+        frames.release()
+
+def scanCandidatesParallel(tracker_name, tracker_params, ground_truth_image, video_path, num_frames, jobs,
+                           model_cache_dir=None, model_cache_size=None, chunk_size=DEFAULT_SCAN_CHUNK_SIZE,
+                           index_dir=DEFAULT_INDEX_DIR):
+    """
+    Same as `scanCandidates`, with the chunks distributed over `jobs` worker
+    processes, each one with a `tracker_name` tracker configured with
+    `tracker_params` (see `Tracker.getParams` and `Tracker.setParams`) and
+    `ground_truth_image`. The candidates are the same as with a single
+    process.
+    """
+    # build the frame index once, before the workers need it
+    loadFrameIndex(video_path, index_dir)
+    pool = multiprocessing.Pool(processes=jobs,
+                                initializer=_initScanWorker,
+                                initargs=(tracker_name, tracker_params, ground_truth_image,
+                                          model_cache_dir, model_cache_size))
+    try:
+        results = pool.map(_scanWorker, [(video_path, start, stop, index_dir)
+                                         for (start, stop) in scanChunks(num_frames, chunk_size)],
+                           chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return [c for r in results for c in r]
+
+def logCandidates(logger, scored, num_shown=5):
+    logger.info("%d candidate reference frames, best %d:", len(scored), min(num_shown, len(scored)))
+    logger.info("  %5s %6s %7s %8s %6s %4s %10s", "frame", "score", "inliers", "reproj.", "area", "vis.", "sharpness")
+    for (score, c) in scored[:num_shown]:
+        logger.info("  %5d %6.3f %7d %8.2f %6.3f %4.2f %10.1f",
+                    c.frame_id, score, c.num_inliers, c.reproj_error, c.area_ratio, c.visibility, c.sharpness)
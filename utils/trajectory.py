@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ==============================================================================
+# Imports
+import os
+import os.path
+import json
+import struct
+
+import numpy as np
+
+# ==============================================================================
+# Trajectory file format
+# ----------------------
+#   magic       8 bytes   TRAJ_MAGIC
+#   version     uint32    (little endian)
+#   header_len  uint32    (little endian) length of the JSON metadata block
+#   metadata    JSON text, padded with spaces so records start on a multiple
+#               of TRAJ_ALIGNMENT bytes
+#   records     TRAJ_RECORD_DTYPE records, one per processed frame, appended
+#               as they are produced
+# Corners are (x, y) pairs in tl, bl, br, tr order, NaN for rejected frames.
+# A truncated trailing record (interrupted run) is ignored by readers.
+TRAJ_MAGIC = b"SD17TRAJ"
+TRAJ_VERSION = 1
+TRAJ_ALIGNMENT = 64
+TRAJ_RECORD_DTYPE = np.dtype([("frame_id", "<i4"),
+                              ("accepted", "u1"),
+                              ("corners", "<f4", (4, 2)),
+                              ("num_inliers", "<i4"),
+                              ("time", "<f4")])
+
+_PREAMBLE = struct.Struct("<8sII")
+
+# ==============================================================================
+class TrajectoryWriter(object):
+    """
+    Append-only writer of tracking results.
+    Each record is written (and flushed every `flush_every` records) as soon as
+    it is produced, so memory usage does not depend on the length of the video
+    and results survive an interrupted run.
+    """
+    def __init__(self, path, metadata=None, flush_every=1):
+        self.path = path
+        self.flush_every = flush_every
+        self.num_records = 0
+        self._record = np.zeros(1, dtype=TRAJ_RECORD_DTYPE)
+
+        header = json.dumps(metadata if metadata is not None else {}).encode("utf-8")
+        data_offset = _PREAMBLE.size + len(header)
+        padding = (-data_offset) % TRAJ_ALIGNMENT
+        header += b" " * padding
+
+        self._file = open(path, "wb")
+        self._file.write(_PREAMBLE.pack(TRAJ_MAGIC, TRAJ_VERSION, len(header)))
+        self._file.write(header)
+        self._file.flush()
+
+    def append(self, frame_id, accepted, corners, num_inliers, duration):
+        """
+        TrajectoryWriter x int x bool x sequence(Pt) x int x float ---> None
+        `corners` are the (tl, bl, br, tr) points returned by the tracker; they
+        are ignored for rejected frames.
+        """
+        rec = self._record[0]
+        rec["frame_id"] = frame_id
+        rec["accepted"] = accepted
+        if accepted:
+            rec["corners"] = [(pt.x, pt.y) for pt in corners]
+        else:
+            rec["corners"] = np.nan
+        rec["num_inliers"] = num_inliers
+        rec["time"] = duration
+        self._file.write(self._record.tobytes())
+        self.num_records += 1
+        if self.num_records % self.flush_every == 0:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# ==============================================================================
+class TrajectoryReader(object):
+    """
+    Random access reader of trajectory files.
+    Records are memory-mapped: reading a range of frames does not parse (nor
+    load) the rest of the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            (magic, version, header_len) = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != TRAJ_MAGIC:
+                raise ValueError("'%s' is not a trajectory file." % path)
+            if version != TRAJ_VERSION:
+                raise ValueError("Unsupported trajectory file version %d in '%s'." % (version, path))
+            self.metadata = json.loads(f.read(header_len).decode("utf-8"))
+        self._data_offset = _PREAMBLE.size + header_len
+
+        num_records = (os.path.getsize(path) - self._data_offset) // TRAJ_RECORD_DTYPE.itemsize
+        if num_records > 0:
+            self._records = np.memmap(path, dtype=TRAJ_RECORD_DTYPE, mode="r",
+                                      offset=self._data_offset, shape=(num_records,))
+        else:
+            self._records = np.zeros(0, dtype=TRAJ_RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self._records)
+
+    def read(self, start=0, stop=None):
+        """
+        TrajectoryReader x int x int ---> ndarray(TRAJ_RECORD_DTYPE)
+        Return a copy of the records [start, stop[ (record indices, which are
+        also frame ids when every frame of the video was processed).
+        """
+        return np.array(self._records[start:stop])
+
+    def readFrames(self, first_frame_id, last_frame_id):
+        """
+        TrajectoryReader x int x int ---> ndarray(TRAJ_RECORD_DTYPE)
+        Return a copy of the records of frames first_frame_id..last_frame_id
+        (inclusive). Records must be sorted by frame id.
+        """
+        start = self._bisect(first_frame_id, right=False)
+        stop = self._bisect(last_frame_id, right=True)
+        return self.read(start, stop)
+
+    def _bisect(self, frame_id, right):
+        # Only touches the pages of the records visited by the binary search.
+        (lo, hi) = (0, len(self._records))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._records[mid]["frame_id"]
+            if value < frame_id or (right and value == frame_id):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Quality measures of the reference created for a sample.
+
+The dewarped reference frame should look like the ground truth image: both are
+reduced to a small working size, converted to gray levels, and compared tile by
+tile. Zero-mean normalized cross-correlation (NCC) is insensitive to the
+lighting of the photo (brightness and contrast may change from tile to tile),
+and is undefined on flat tiles (margins), which are ignored. SSIM is reported
+as well, on every tile.
+"""
+
+# ==============================================================================
+# Imports
+import cv2
+import numpy as np
+
+# ==============================================================================
+DEFAULT_WORKING_SIZE = 1024 # pixels along the largest side of the ground truth
+DEFAULT_GRID_SIZE = 8 # number of tiles along the largest side
+FLAT_TILE_STD = 4. # gray levels: tiles of the ground truth less contrasted than this are ignored by NCC
+
+# SSIM constants, for 8-bit images (Wang et al., 2004)
+_SSIM_C1 = (0.01 * 255)**2
+_SSIM_C2 = (0.03 * 255)**2
+_SSIM_SIGMA = 1.5
+
+# ==============================================================================
+def workingShape(shape, size=DEFAULT_WORKING_SIZE):
+    """
+    tuple x int ---> tuple(height, width)
+    Shape of an image of shape `shape` reduced so that its largest side is at
+    most `size` pixels.
+    """
+    (h, w) = shape[:2]
+    scale = min(1., float(size) / max(h, w))
+    return (max(1, int(round(h * scale))), max(1, int(round(w * scale))))
+
+def reduceImage(img, working_shape):
+    """
+    Gray level version of `img`, resized to `working_shape` (height, width).
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(img, (working_shape[1], working_shape[0]), interpolation=cv2.INTER_AREA)
+
+def tileGrid(shape, grid_size=DEFAULT_GRID_SIZE):
+    """
+    tuple x int ---> tuple(rows, cols)
+    Number of (roughly square) tiles along each axis of an image of `shape`.
+    """
+    (h, w) = shape[:2]
+    if h >= w:
+        return (grid_size, max(1, int(round(grid_size * float(w) / h))))
+    return (max(1, int(round(grid_size * float(h) / w))), grid_size)
+
+def _tiles(img, rows, cols):
+    """
+    (rows, cols, tile pixels) view of `img`, cropped to a multiple of the tile size.
+    """
+    (th, tw) = (img.shape[0] // rows, img.shape[1] // cols)
+    tiles = img[:rows * th, :cols * tw].reshape(rows, th, cols, tw).swapaxes(1, 2)
+    return tiles.reshape(rows, cols, th * tw)
+
+def ssimMap(img0, img1):
+    """
+    Local SSIM of two gray level images of the same shape (gaussian window).
+    """
+    (a, b) = (np.float32(img0), np.float32(img1))
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), _SSIM_SIGMA)
+    (mu_a, mu_b) = (blur(a), blur(b))
+    var_a = blur(a * a) - mu_a * mu_a
+    var_b = blur(b * b) - mu_b * mu_b
+    cov = blur(a * b) - mu_a * mu_b
+    return (((2 * mu_a * mu_b + _SSIM_C1) * (2 * cov + _SSIM_C2))
+            / ((mu_a * mu_a + mu_b * mu_b + _SSIM_C1) * (var_a + var_b + _SSIM_C2)))
+
+def tileScores(img, ref, grid_size=DEFAULT_GRID_SIZE, flat_std=FLAT_TILE_STD):
+    """
+    ndarray x ndarray x int x float ---> tuple(ndarray, ndarray)
+    Compare the gray level image `img` with the reference `ref` (same shape)
+    tile by tile. Return tuple(ncc, ssim), two (rows, cols) arrays: NCC of each
+    tile (NaN for tiles of `ref` with a standard deviation below `flat_std`) and
+    mean SSIM of each tile.
+    """
+    (rows, cols) = tileGrid(ref.shape, grid_size)
+    a = _tiles(np.float64(img), rows, cols)
+    b = _tiles(np.float64(ref), rows, cols)
+    a = a - a.mean(axis=2)[:, :, np.newaxis]
+    b = b - b.mean(axis=2)[:, :, np.newaxis]
+    (norm_a, norm_b) = (np.sqrt((a * a).sum(axis=2)), np.sqrt((b * b).sum(axis=2)))
+    informative = norm_b > flat_std * np.sqrt(b.shape[2])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ncc = np.where(informative & (norm_a > 0), (a * b).sum(axis=2) / (norm_a * norm_b), 0.)
+    ncc[~informative] = np.nan
+    ssim = _tiles(ssimMap(img, ref), rows, cols).mean(axis=2)
+    return (ncc, ssim)
+
+def summarizeTiles(ncc, ssim):
+    """
+    Summary of the tile scores of `tileScores`: median and minimum NCC over
+    informative tiles (NaN if none), and mean SSIM.
+    """
+    valid = ncc[~np.isnan(ncc)]
+    return {"ncc": float(np.median(valid)) if len(valid) else float("nan"),
+            "ncc_min": float(valid.min()) if len(valid) else float("nan"),
+            "num_tiles": int(len(valid)),
+            "ssim": float(ssim.mean())}
+
+def quadGeometry(quad, frame_shape):
+    """
+    ndarray x tuple ---> dict
+    Sanity of the (tl, bl, br, tr) quadrilateral `quad` (4x2 array) detected in
+    a frame of shape `frame_shape`: whether it is convex and not mirrored, the
+    fraction of the frame it covers, and the fraction of its corners inside
+    the frame.
+    """
+    edges = np.roll(quad, -1, axis=0) - quad
+    cross = edges[:, 0] * np.roll(edges, -1, axis=0)[:, 1] - edges[:, 1] * np.roll(edges, -1, axis=0)[:, 0]
+    (h, w) = frame_shape[:2]
+    inside = ((quad[:, 0] >= 0) & (quad[:, 0] <= w - 1) & (quad[:, 1] >= 0) & (quad[:, 1] <= h - 1))
+    # tl -> bl -> br -> tr turns the same way at every corner (negative cross
+    # products, since the y axis points down)
+    return {"convex": bool(np.all(cross < 0)),
+            "area_ratio": float(abs(cv2.contourArea(np.float32(quad)))) / (w * h),
+            "visibility": float(inside.mean())}
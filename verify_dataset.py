@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SmartDoc 2017 reference verification tool.
+(c) 2017 L3i - Univ. La Rochelle
+    joseph (dot) chazalon (at) univ-lr (dot) fr
+
+Checks the references created for every sample of a dataset (see
+create_reference.py and create_reference_batch.py), without any user
+interaction:
+- the dewarped reference frame is compared with the ground truth image, tile
+  by tile, at a reduced size (see utils/verification.py);
+- the reference frame is dewarped again with the quadrilateral of
+  `sample.json`, and compared with the ground truth image and with the
+  dewarped reference frame (which must have been produced from it);
+- the quadrilateral must be convex and not mirrored;
+- optionally (`-r`), the tracker is run again on the reference frame, and must
+  find the same quadrilateral;
+- optionally (`-i`), the reference frame is searched for the ground truth
+  images of all the samples at once (see `Tracker.reconfigureModels`), and the
+  one found must be the ground truth of the sample (mislabeled samples).
+
+Samples failing one of these checks, or whose similarity with the ground truth
+is abnormally low compared to the rest of the dataset, are flagged. The report
+ranks samples from the most to the least suspicious.
+
+Samples are processed in parallel. Each worker holds at most one full size
+image at a time (in gray levels): memory grows with the number of workers
+only.
+
+Sample usage:
+python verify_dataset.py -j 8 -o verification.json /path/to/dataset
+
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import os
+import os.path
+import sys
+from time import time
+import json
+import multiprocessing
+import traceback
+
+# ==============================================================================
+import cv2
+import numpy as np
+
+# ==============================================================================
+from utils.args import *
+from utils.log import *
+from utils.reference import *
+from utils.frames import IndexedFrameSource
+from utils.verification import *
+from utils.manifest import hashFile
+
+from trackers import TRACKER_NAMES, DEFAULT_TRACKER, createTracker
+from trackers.Tracker import Pt
+from trackers.DescriptorCache import DescriptorCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+
+# ==============================================================================
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_NAME = "SmartDoc17 Reference Verifier"
+
+STATUS_OK = "ok"
+STATUS_FLAGGED = "flagged"
+STATUS_NO_REFERENCE = "no-reference"
+STATUS_ERROR = "error"
+
+CORNER_NAMES = ("top_left", "bottom_left", "bottom_right", "top_right")
+
+# ==============================================================================
+# Worker side
+# Each worker process owns its own trackers (if the reference frames are tracked
+# again, or identified): OpenCV objects cannot be shared between processes.
+_worker_tracker = None
+_worker_identifier = None
+
+def _initWorker(tracker_name, model_cache_dir, model_cache_size, retrack, identify_models):
+    global _worker_tracker, _worker_identifier
+    model_cache = None
+    if model_cache_dir is not None:
+        model_cache = DescriptorCache(model_cache_dir, model_cache_size)
+    if retrack:
+        _worker_tracker = createTracker(tracker_name)
+        if model_cache is not None:
+            _worker_tracker.setModelCache(model_cache)
+    if identify_models is not None:
+        # all models are indexed once, for every sample processed by the worker
+        _worker_identifier = createTracker(tracker_name)
+        if model_cache is not None:
+            _worker_identifier.setModelCache(model_cache)
+        _worker_identifier.reconfigureModels(identify_models)
+
+def groundTruthModels(samples):
+    """
+    list(str) ---> tuple(list(str), dict)
+    Return the ground truth images of `samples`, without duplicates (samples
+    may share the same document): tuple(paths, model_ids), where model_ids
+    gives the index in paths of the ground truth of each sample directory.
+    """
+    (paths, model_ids, by_hash) = ([], {}, {})
+    for sample_dir in samples:
+        path_gt = os.path.join(sample_dir, IN_FILE_GROUND_TRUTH)
+        digest = hashFile(path_gt)
+        if digest not in by_hash:
+            by_hash[digest] = len(paths)
+            paths.append(path_gt)
+        model_ids[sample_dir] = by_hash[digest]
+    return (paths, model_ids)
+
+def loadReferenceFrame(sample_dir, fidx):
+    """
+    Return the reference frame `fidx` of the sample: the extracted frame saved
+    with the reference if any, otherwise decoded from the video.
+    """
+    frame = cv2.imread(os.path.join(sample_dir, OUT_FILE_FRAME_EXTRACTED % fidx))
+    if frame is None:
+        with IndexedFrameSource(os.path.join(sample_dir, IN_FILE_VIDEO)) as frames:
+            frame = frames.get(fidx)
+    return frame
+
+def retrackCornerDistance(tracker, path_gt, frame, corners):
+    """
+    Run `tracker` on `frame` and return the largest distance between the
+    corners it finds and `corners` (4x2 array), or None if it rejects the frame.
+    """
+    tracker.reconfigureModel(path_gt)
+    tracker.reinitFrameSize(frame.shape[1], frame.shape[0])
+    (rejected, tl, bl, br, tr) = tracker.processFrame(frame)
+    if rejected:
+        return None
+    found = np.float64([[pt.x, pt.y] for pt in (tl, bl, br, tr)])
+    return float(np.sqrt(((found - corners)**2).sum(axis=1)).max())
+
+def identifyReference(tracker, frame):
+    """
+    Run `tracker`, configured with several models (see
+    `Tracker.reconfigureModels`), on `frame` and return the index of the model
+    it finds, or None if it rejects the frame.
+    """
+    tracker.reinitFrameSize(frame.shape[1], frame.shape[0])
+    (rejected, _tl, _bl, _br, _tr) = tracker.processFrame(frame)
+    if rejected:
+        return None
+    return tracker.getFrameInfo()["model_id"]
+
+def verifySample(task):
+    """
+    Check the reference of a single sample directory and return a report
+    dictionary: scores, and the reasons why the sample is flagged.
+    Never raises: errors are reported in the report.
+    """
+    (sample_dir, options) = task
+    sample_name = os.path.basename(os.path.normpath(sample_dir))
+    report = {"sample": sample_name, "status": STATUS_ERROR, "reference_frame_id": None,
+              "scores": {}, "flags": [], "message": "", "duration": 0.}
+    (scores, flags) = (report["scores"], report["flags"])
+    path_gt = os.path.join(sample_dir, IN_FILE_GROUND_TRUTH)
+    path_json = os.path.join(sample_dir, OUT_FILE_JSON)
+
+    t_start = time()
+    try:
+        if not os.path.isfile(path_json):
+            report["status"] = STATUS_NO_REFERENCE
+            report["message"] = "no %s" % OUT_FILE_JSON
+            return report
+        with open(path_json, "rb") as f:
+            results = json.loads(f.read().decode("utf-8"))
+        fidx = report["reference_frame_id"] = results["reference_frame_id"]
+        coords = results["object_coord_in_ref_frame"]
+        corners = np.float64([[coords[name]["x"], coords[name]["y"]] for name in CORNER_NAMES])
+        target_shape = (results["target_image_shape"]["y_len"], results["target_image_shape"]["x_len"])
+        frame_shape = (results["input_video_shape"]["y_len"], results["input_video_shape"]["x_len"])
+
+        geometry = quadGeometry(corners, frame_shape)
+        scores.update(geometry)
+        if not geometry["convex"]:
+            flags.append("quadrilateral not convex or mirrored")
+
+        # ground truth, reduced
+        img_gt = cv2.imread(path_gt, cv2.IMREAD_GRAYSCALE)
+        if img_gt is None:
+            raise IOError("Cannot read '%s'." % path_gt)
+        if img_gt.shape[:2] != target_shape:
+            flags.append("ground truth shape changed")
+        working_shape = workingShape(img_gt.shape, options["working_size"])
+        gt_small = reduceImage(img_gt, working_shape)
+        del img_gt
+
+        # dewarped reference frame vs ground truth
+        dewarped = cv2.imread(os.path.join(sample_dir, OUT_FILE_FRAME_DEWARPED % fidx), cv2.IMREAD_GRAYSCALE)
+        dewarped_small = None
+        if dewarped is None:
+            flags.append("missing dewarped image")
+        else:
+            if dewarped.shape[:2] != target_shape:
+                flags.append("dewarped image shape differs from sample.json")
+            dewarped_small = reduceImage(dewarped, working_shape)
+            del dewarped
+            summary = summarizeTiles(*tileScores(dewarped_small, gt_small, options["grid_size"]))
+            scores.update(("dewarped_" + k, v) for (k, v) in summary.items())
+            if not summary["ncc"] >= options["min_ncc"]:
+                flags.append("low similarity with ground truth")
+
+        # reference frame dewarped again with the quadrilateral, at the working size
+        frame = loadReferenceFrame(sample_dir, fidx)
+        if frame is None:
+            flags.append("reference frame not found")
+        else:
+            (tl, bl, br, tr) = [Pt(name, x, y) for (name, (x, y)) in zip(("tl", "bl", "br", "tr"), corners)]
+            trans = dewarpTransform(tl, bl, br, tr, target_shape)
+            scale = np.diag([float(working_shape[1]) / target_shape[1], float(working_shape[0]) / target_shape[0], 1.])
+            reprojected = cv2.warpPerspective(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), np.dot(scale, trans),
+                                              (working_shape[1], working_shape[0]))
+            summary = summarizeTiles(*tileScores(reprojected, gt_small, options["grid_size"]))
+            scores.update(("reprojected_" + k, v) for (k, v) in summary.items())
+            if not summary["ncc"] >= options["min_ncc"]:
+                flags.append("low similarity of the reference frame dewarped again with ground truth")
+            if dewarped_small is not None:
+                consistency = float(np.corrcoef(np.float64(dewarped_small).ravel(),
+                                                np.float64(reprojected).ravel())[0, 1])
+                scores["consistency"] = consistency
+                if not consistency >= options["min_consistency"]:
+                    flags.append("dewarped image does not match the quadrilateral")
+
+            if _worker_tracker is not None:
+                distance = retrackCornerDistance(_worker_tracker, path_gt, frame, corners)
+                scores["retrack_corner_distance"] = distance
+                if distance is None:
+                    flags.append("tracker rejects the reference frame")
+                elif distance > options["max_corner_distance"]:
+                    flags.append("tracker finds other corners")
+
+            if _worker_identifier is not None:
+                model_id = identifyReference(_worker_identifier, frame)
+                report["identified_model_id"] = model_id
+                if model_id is None:
+                    flags.append("no ground truth of the dataset found in the reference frame")
+                elif model_id != options["model_ids"][sample_dir]:
+                    flags.append("reference frame shows the ground truth of %s" % options["model_samples"][model_id])
+
+        # overall score: the lowest similarity with the ground truth
+        similarities = [scores[k] for k in ("dewarped_ncc", "reprojected_ncc") if k in scores]
+        scores["score"] = float(np.min(similarities)) if similarities else float("nan")
+        report["status"] = STATUS_FLAGGED if flags else STATUS_OK
+    except Exception as e:
+        report["message"] = "%s: %s" % (e.__class__.__name__, e)
+        logger.debug("%s: verification failed:\n%s", sample_name, traceback.format_exc())
+    finally:
+        report["duration"] = time() - t_start
+    return report
+
+# ==============================================================================
+def flagOutliers(reports, threshold):
+    """
+    Flag the samples whose score (similarity with the ground truth) is
+    abnormally low compared to the other samples: more than `threshold` robust
+    standard deviations (median absolute deviation) below the median. Needs at
+    least 5 samples. Return the (median, robust std) used, or None.
+    """
+    values = [r["scores"]["score"] for r in reports
+              if not np.isnan(r["scores"].get("score", np.nan))]
+    if len(values) < 5:
+        return None
+    median = float(np.median(values))
+    sigma = 1.4826 * float(np.median(np.abs(np.float64(values) - median)))
+    for r in reports:
+        score = r["scores"].get("score", np.nan)
+        if not np.isnan(score) and score < median - threshold * max(sigma, 1e-3):
+            r["flags"].append("outlier (%.1f robust std below median)" % ((median - score) / max(sigma, 1e-3)))
+            if r["status"] == STATUS_OK:
+                r["status"] = STATUS_FLAGGED
+    return (median, sigma)
+
+def rankReports(reports):
+    """
+    Sort `reports` from the most to the least suspicious: errors first, then
+    flagged samples, then by increasing score.
+    """
+    order = {STATUS_ERROR: 0, STATUS_FLAGGED: 1, STATUS_NO_REFERENCE: 2, STATUS_OK: 3}
+    def key(r):
+        score = r["scores"].get("score", np.nan)
+        return (order[r["status"]], -np.inf if np.isnan(score) else score, r["sample"])
+    return sorted(reports, key=key)
+
+def logReport(reports, total_duration):
+    logger.info(DBGSEP)
+    logger.info("%4s %-30s %-12s %6s %6s %6s %6s %6s %6s  %s",
+                "rank", "sample", "status", "score", "ncc", "min", "ssim", "reproj", "consis", "flags / message")
+    fmt = lambda s, k: "%6.3f" % s[k] if s.get(k) is not None and not np.isnan(s[k]) else "%6s" % "-"
+    for (rank, r) in enumerate(reports):
+        s = r["scores"]
+        logger.info("%4d %-30s %-12s %s %s %s %s %s %s  %s",
+                    rank + 1, r["sample"], r["status"],
+                    fmt(s, "score"), fmt(s, "dewarped_ncc"), fmt(s, "dewarped_ncc_min"), fmt(s, "dewarped_ssim"),
+                    fmt(s, "reprojected_ncc"), fmt(s, "consistency"),
+                    "; ".join(r["flags"]) or r["message"])
+    logger.info(DBGSEP)
+    count = lambda status: len([r for r in reports if r["status"] == status])
+    logger.info("%d samples verified in %.2fs: %d ok, %d flagged, %d without reference, %d errors.",
+                len(reports), total_duration, count(STATUS_OK), count(STATUS_FLAGGED),
+                count(STATUS_NO_REFERENCE), count(STATUS_ERROR))
+
+# ==============================================================================
+def main(argv):
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Verify the references of every sample of a dataset, and rank the suspicious ones.',
+        version=PROG_VERSION)
+
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+
+    parser.add_argument('-j', '--jobs',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of worker processes (each holds at most one full size image).")
+
+    parser.add_argument('-o', '--output',
+        help="Path to a JSON file where the ranked report will be saved.")
+
+    parser.add_argument('-s', '--working-size',
+        type=int,
+        default=DEFAULT_WORKING_SIZE,
+        help="Size (largest side, in pixels) images are reduced to before being compared.")
+
+    parser.add_argument('-g', '--grid-size',
+        type=int,
+        default=DEFAULT_GRID_SIZE,
+        help="Number of tiles along the largest side of the images.")
+
+    parser.add_argument('--min-ncc',
+        type=float,
+        default=0.5,
+        help="Samples whose median tile NCC between the dewarped reference frame and the ground truth is below this value are flagged.")
+
+    parser.add_argument('--min-consistency',
+        type=float,
+        default=0.9,
+        help="Samples whose dewarped reference frame correlates less than this with the reference frame dewarped again with the quadrilateral of sample.json are flagged.")
+
+    parser.add_argument('--outlier-threshold',
+        type=float,
+        default=3.,
+        help="Samples whose median tile NCC is more than this number of robust standard deviations below the median of the dataset are flagged.")
+
+    parser.add_argument('-r', '--retrack',
+        action="store_true",
+        help="Run the tracker on each reference frame again, and flag samples where it does not find the same corners.")
+
+    parser.add_argument('-i', '--identify',
+        action="store_true",
+        help="Search each reference frame for the ground truth images of all the samples at once, and flag samples where another ground truth than their own is found (mislabeled samples).")
+
+    parser.add_argument('-t', '--tracker',
+        choices=TRACKER_NAMES,
+        default=DEFAULT_TRACKER,
+        help="Tracker used with -r and -i.")
+
+    parser.add_argument('--max-corner-distance',
+        type=float,
+        default=10.,
+        help="With -r, samples where a corner found by the tracker is further than this (in pixels) from the one of sample.json are flagged.")
+
+    parser.add_argument('--model-cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        help="Directory where the features extracted from ground truth images are cached.")
+
+    parser.add_argument('--model-cache-size',
+        type=int,
+        default=DEFAULT_MAX_SIZE / 1024**2,
+        help="Maximum size of the model feature cache, in MiB.")
+
+    parser.add_argument('--no-model-cache',
+        action="store_true",
+        help="Do not use (nor populate) the model feature cache.")
+
+    parser.add_argument('dataset_root',
+        action=StoreValidDirPath,
+        help="Path to the dataset root, containing one directory per sample (with 'ground-truth.png' and 'input.mp4' files).")
+
+    # -----------------------------------------------------------------------------
+    args = parser.parse_args()
+    initLogger(logger, debug=args.debug)
+
+    programHeader(logger, PROG_NAME, PROG_VERSION)
+    dumpArgs(args, logger)
+
+    # --------------------------------------------------------------------------
+    samples = listSamples(args.dataset_root)
+    logger.info("Found %d samples under '%s'.", len(samples), args.dataset_root)
+    if not samples:
+        return 1
+
+    # Let's go
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    # --------------------------------------------------------------------------
+    t_start = time()
+    options = {"working_size": args.working_size,
+               "grid_size": args.grid_size,
+               "min_ncc": args.min_ncc,
+               "min_consistency": args.min_consistency,
+               "max_corner_distance": args.max_corner_distance}
+    identify_models = None
+    if args.identify:
+        (identify_models, options["model_ids"]) = groundTruthModels(samples)
+        # samples sharing each ground truth, to report mislabeled samples
+        options["model_samples"] = [", ".join(sorted(os.path.basename(os.path.normpath(d))
+                                                     for (d, m) in options["model_ids"].items() if m == mid))
+                                    for mid in range(len(identify_models))]
+        logger.info("%d distinct ground truth images to identify.", len(identify_models))
+    tasks = [(sample_dir, options) for sample_dir in samples]
+    pool = multiprocessing.Pool(processes=max(1, args.jobs),
+                                initializer=_initWorker,
+                                initargs=(args.tracker,
+                                          None if args.no_model_cache else args.model_cache_dir,
+                                          args.model_cache_size * 1024**2,
+                                          args.retrack,
+                                          identify_models))
+    reports = []
+    try:
+        for report in pool.imap_unordered(verifySample, tasks):
+            reports.append(report)
+            logger.info("[%3d/%3d] %-30s %-14s (%.2fs)",
+                        len(reports), len(tasks), report["sample"], report["status"], report["duration"])
+        pool.close()
+    except KeyboardInterrupt:
+        logger.error("Interrupted by user.")
+        pool.terminate()
+    pool.join()
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+    outliers = flagOutliers(reports, args.outlier_threshold)
+    if outliers is not None:
+            logger.debug("Scores over the dataset: median %.3f, robust std %.3f.", *outliers)
+    reports = rankReports(reports)
+    logReport(reports, time() - t_start)
+
+    if args.output:
+        report = {"program": PROG_NAME,
+                  "version": PROG_VERSION,
+                  "options": dict(options, outlier_threshold=args.outlier_threshold,
+                                  tracker=args.tracker if args.retrack or args.identify else None,
+                                  identify_models=identify_models),
+                  "samples": reports}
+        with open(args.output, "wb") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        logger.debug("Report saved to %s" % args.output)
+
+    if len([r for r in reports if r["status"] in (STATUS_FLAGGED, STATUS_ERROR)]) > 0:
+        return 2
+
+
+# ==============================================================================
+# ==============================================================================
+if __name__ == "__main__":
+    ret = main(sys.argv)
+    if ret is not None:
+        sys.exit(ret)